@@ -0,0 +1,803 @@
+import argparse
+import atexit
+import csv
+import json
+import logging
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from itertools import islice
+from alignment_memo import AlignmentMemo
+from instrumentation import STAGE_TIMER
+from logging_config import configure_logging
+from reference_cache import cache_path, cached_reference, reference_form, reference_hash
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The logger of this module, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# Specify how many reads are sent to blat in one invocation. Blat loads and
+# indexes the whole reference every time it is started, so larger batches
+# spend less time doing that, but more alignments are wasted when the library
+# type is determined in the middle of a batch.
+BLAT_BATCH_SIZE = 200
+
+# Specify how many alignment batches may run at the same time, each in its
+# own blat or gfClient process. More jobs keep more cores busy, but the
+# batches after the one that determines the library type are aligned in vain.
+ALIGNMENT_JOBS = 1
+
+# Every guesslib run keeps its tmp files in a private workspace directory,
+# created in the first of these directories that exists (/dev/shm keeps them
+# in memory), or else in the system's tmp directory.
+WORKSPACE_DIRS = ['/dev/shm']
+
+# The blat executables, see the README.
+BLAT_EXECUTABLE = './blat'
+GFSERVER_EXECUTABLE = './gfServer'
+GFCLIENT_EXECUTABLE = './gfClient'
+FA_TO_TWO_BIT_EXECUTABLE = './faToTwoBit'
+
+# Blat skips the 11 base tiles that occur more than BLAT_REP_MATCH times in the
+# reference, listed in an .ooc file that is cached with the reference (see
+# reference_cache.py), which makes it a lot faster. Set it to None to use all
+# of the tiles.
+BLAT_REP_MATCH = 1024
+
+# The available aligners. 'blat' starts blat for every batch, 'gfserver'
+# keeps the reference loaded in a local gfServer and queries it with gfClient,
+# and 'kmer' classifies the reads with an in-process k-mer index of the
+# reference (see kmer_index.py) instead of aligning them.
+ALIGNERS = ('blat', 'gfserver', 'kmer')
+
+# Specify where the gfServers run. Every reference gets its own port in the
+# range, the first free one from a port derived from its name.
+GFSERVER_HOST = 'localhost'
+GFSERVER_PORT = 17779
+GFSERVER_PORT_RANGE = 1000
+
+# The gfServers started by guesslib record the reference they serve, and its
+# hash, in a state file per port in this directory, so that separate guesslib
+# runs find the same server, and only while it serves the current version of
+# the reference.
+GFSERVER_STATE_DIR = os.path.join(tempfile.gettempdir(), 'guesslib_gfservers')
+
+# Specify how many seconds to wait for a gfServer to load its reference, and
+# to stop.
+GFSERVER_START_TIMEOUT = 600
+GFSERVER_STOP_TIMEOUT = 10
+
+# The results of the sequences aligned by this process, see alignment_memo.py,
+# so that duplicate reads are only aligned once.
+ALIGNMENT_MEMO = AlignmentMemo()
+
+# The aligner processes of the call that a thread of map_in_order runs, see
+# run_aligner, so that they can be killed when map_in_order is closed.
+ALIGNMENT_JOB = threading.local()
+
+# The gfServers used by this process, by reference.
+GFSERVERS = {}
+GFSERVERS_LOCK = threading.Lock()
+
+###--------- FUNCTIONS ---------###
+
+def alignment_workspace():
+	'''
+	Returns a new private workspace directory for the tmp files of one run,
+	as a context manager that gives its path and removes it with everything
+	in it on exit, also after an error.
+	'''
+
+	workspace_dir = None
+	for directory in WORKSPACE_DIRS:
+		if (os.path.isdir(directory) and os.access(directory, os.W_OK)):
+			workspace_dir = directory
+			break
+
+	return tempfile.TemporaryDirectory(prefix='guesslib_', dir=workspace_dir)
+
+
+def write_batch_fasta(tmp_fasta, seqs):
+	'''
+	Writes a temporary fasta file with one record per sequence in seqs.
+	The records are named after their index in seqs, so that blat results
+	can be matched back to the reads whatever their fastq headers look like.
+	'''
+
+	with STAGE_TIMER.stage('temp_write', len(seqs)), open(tmp_fasta, "w+") as f_out:
+		for i, seq in enumerate(seqs):
+			f_out.write(f'>{i}\n{seq}\n')
+
+
+def parse_blast8(tmp_rslt, nr_of_seqs):
+	'''
+	Reads a blast8 file with the results of nr_of_seqs queries, named by
+	their index, and returns one (seq_start, seq_end, nr_of_results,
+	ref_transcript_id) tuple per query. As with a single query, the first
+	row of a query is its best hit and each row counts as one result.
+	Queries without hits get (0, 0, 0, "N/A").
+	'''
+
+	results = [(0, 0, 0, "N/A")] * nr_of_seqs
+
+	with STAGE_TIMER.stage('result_parse', nr_of_seqs), open(tmp_rslt) as f_in:
+		for hit in csv.reader(f_in, delimiter='\t'):
+			query = int(hit[0])
+			(seq_start, seq_end, nr_of_results,
+				ref_transcript_id) = results[query]
+			if (nr_of_results == 0): # The first row of a query is its best hit
+				results[query] = (int(hit[8]), int(hit[9]), 1, hit[1])
+			else:
+				results[query] = (seq_start, seq_end, nr_of_results + 1,
+									ref_transcript_id)
+
+	return results
+
+
+def two_bit_file(fasta_file, directory):
+	'''
+	Returns the name of the .2bit file of the reference fasta_file in the
+	cache directory directory.
+	'''
+
+	return os.path.join(directory, os.path.splitext(os.path.basename(fasta_file))[0] + '.2bit')
+
+
+def build_two_bit(fasta_file, directory):
+	'''
+	Converts the reference to .2bit with faToTwoBit, see cached_reference.
+	'''
+
+	subprocess.run([FA_TO_TWO_BIT_EXECUTABLE, fasta_file, two_bit_file(fasta_file, directory)],
+					check=True)
+
+
+def build_ooc(fasta_file, directory):
+	'''
+	Lets blat list the over-occurring tiles of the reference in an .ooc file,
+	see cached_reference.
+	'''
+
+	subprocess.run([BLAT_EXECUTABLE, fasta_file, '/dev/null', '/dev/null',
+					'-makeOoc=' + os.path.join(directory, '11.ooc'),
+					f'-repMatch={BLAT_REP_MATCH}'], check=True)
+
+
+def blat_reference(ref):
+	'''
+	Returns the reference file and the .ooc file (None if BLAT_REP_MATCH is
+	None) that blat is run with for the reference 'reference_sequences/' + ref.
+	If faToTwoBit is installed, the cached .2bit form of the reference is
+	used, which blat loads faster than fasta. The forms are only built here,
+	when blat is about to be run, see reference_cache.reference_form.
+	'''
+
+	fasta_file = os.path.join('reference_sequences', ref)
+	reference = fasta_file
+	ooc_file = None
+
+	if os.path.exists(FA_TO_TWO_BIT_EXECUTABLE):
+		reference = two_bit_file(fasta_file, reference_form(fasta_file, '2bit', build_two_bit))
+	if BLAT_REP_MATCH is not None:
+		ooc_file = os.path.join(reference_form(fasta_file, 'ooc', build_ooc,
+												{'rep_match': BLAT_REP_MATCH}), '11.ooc')
+
+	return reference, ooc_file
+
+
+def run_aligner(command, nr_of_seqs):
+	'''
+	Runs an aligner command for nr_of_seqs sequences and waits for it. The
+	time it takes to start is timed apart from the time it runs, see
+	instrumentation.STAGES. In a call of map_in_order, the aligner is killed
+	when map_in_order is closed, and a RuntimeError is raised.
+	'''
+
+	aligner_processes = getattr(ALIGNMENT_JOB, 'aligner_processes', None)
+
+	with STAGE_TIMER.stage('aligner_spawn'):
+		process = subprocess.Popen(command)
+	with STAGE_TIMER.stage('aligner_runtime', nr_of_seqs):
+		try:
+			if aligner_processes is not None:
+				aligner_processes.add(process)
+			process.wait()
+		except BaseException: # Like subprocess.run, not leaving the aligner running
+			process.kill()
+			process.wait()
+			raise
+		finally:
+			if aligner_processes is not None:
+				aligner_processes.remove(process)
+
+	if (aligner_processes is not None and aligner_processes.killed):
+		raise RuntimeError(f'{command[0]} was stopped, its results are not needed anymore.')
+
+
+def run_blat_batch(ref, tmp_fasta, seqs):
+	'''
+	This function calls blat once with all the sequences in seqs as input
+	against the reference ref, and returns a list with one (seq_start,
+	seq_end, nr_of_results, ref_transcript_id) tuple per sequence, in the
+	same order as seqs.
+	'''
+
+	if not seqs:
+		return []
+
+	tmp_rslt = tmp_fasta + "_rslt"
+	reference, ooc_file = blat_reference(ref)
+	blat_command = [BLAT_EXECUTABLE, reference, tmp_fasta, '-out=blast8', tmp_rslt]
+	if ooc_file is not None:
+		blat_command.insert(-1, '-ooc=' + ooc_file)
+
+	write_batch_fasta(tmp_fasta, seqs)
+	logger.debug('Blatting %d sequences against %s.', len(seqs), reference)
+	run_aligner(blat_command, len(seqs))
+	results = parse_blast8(tmp_rslt, len(seqs))
+
+	os.remove(tmp_rslt) # Removing the tmp blat rslt file
+
+	return results
+
+
+def aligner_memo_key(aligner, ref):
+	'''
+	Returns the key that the results of the aligner against the current
+	version of the reference ref are remembered by in ALIGNMENT_MEMO. It
+	includes the settings that change the results of the aligner.
+	'''
+
+	if (aligner == 'kmer'):
+		# Only imported for the k-mer aligner, numpy is slow to import
+		from kmer_index import MIN_KMER_VOTES, kmer_index_parameters
+		settings = f'{kmer_index_parameters()} min_kmer_votes={MIN_KMER_VOTES}'
+	else:
+		settings = f'rep_match={BLAT_REP_MATCH}'
+
+	return f'{reference_hash(os.path.join("reference_sequences", ref))} {aligner} {settings}'
+
+
+def align_batch(aligner, ref, tmp_fasta, seqs):
+	'''
+	Aligns the sequences in seqs against the reference ref with the given
+	aligner, see ALIGNERS. Returns the same list of tuples as run_blat_batch.
+	Sequences that were aligned before, or that occur more than once in seqs,
+	are looked up in ALIGNMENT_MEMO instead of being aligned again.
+	'''
+
+	memo_key = aligner_memo_key(aligner, ref)
+	results = ALIGNMENT_MEMO.lookup(memo_key, seqs)
+	missing = list(dict.fromkeys(seq for seq, result in zip(seqs, results) if result is None))
+
+	if missing:
+		if (aligner == 'gfserver'):
+			aligned = get_gfserver(ref).align_batch(tmp_fasta, missing)
+		elif (aligner == 'kmer'):
+			from kmer_index import get_kmer_index
+			kmer_index = get_kmer_index(ref)
+			with STAGE_TIMER.stage('aligner_runtime', len(missing)):
+				aligned = kmer_index.align_batch(missing)
+		else:
+			aligned = run_blat_batch(ref, tmp_fasta, missing)
+		aligned = dict(zip(missing, aligned))
+		ALIGNMENT_MEMO.store(memo_key, aligned)
+		results = [aligned[seq] if result is None else result
+					for seq, result in zip(seqs, results)]
+
+	return results
+
+
+def prepare_aligner(aligner, ref):
+	'''
+	Readies the reference ref for the aligner before any reads are aligned:
+	caches its hash and its forms for blat, builds (or loads) its k-mer
+	index, or starts its gfServer. Processes started afterwards, e.g. by
+	guesslib_batch.py, then find them ready instead of all preparing them.
+	'''
+
+	aligner_memo_key(aligner, ref)
+	if (aligner == 'gfserver'):
+		get_gfserver(ref)
+	elif (aligner == 'kmer'):
+		from kmer_index import get_kmer_index
+		get_kmer_index(ref)
+	else:
+		blat_reference(ref)
+
+
+class AlignerProcesses:
+	'''
+	The aligner processes running in the calls of one map_in_order, which
+	are all killed when it is closed.
+	'''
+
+	def __init__(self):
+		self.processes = set()
+		self.killed = False
+		self.lock = threading.Lock()
+
+	def add(self, process):
+		'''
+		Adds a process that was just started, killing it right away if the
+		others were already killed.
+		'''
+
+		with self.lock:
+			self.processes.add(process)
+			if self.killed:
+				process.kill()
+
+	def remove(self, process):
+		'''
+		Removes a process that has ended.
+		'''
+
+		with self.lock:
+			self.processes.discard(process)
+
+	def kill(self):
+		'''
+		Kills the running processes, and those that are added afterwards.
+		'''
+
+		with self.lock:
+			self.killed = True
+			for process in self.processes:
+				process.kill()
+
+
+def run_alignment_job(aligner_processes, function, *args):
+	'''
+	Calls function with args in a thread of map_in_order, with the aligners
+	it runs (see run_aligner) in aligner_processes.
+	'''
+
+	ALIGNMENT_JOB.aligner_processes = aligner_processes
+	try:
+		return function(*args)
+	finally:
+		ALIGNMENT_JOB.aligner_processes = None
+
+
+def map_in_order(function, args_list, jobs=ALIGNMENT_JOBS):
+	'''
+	Generator that calls function with every tuple of arguments in args_list
+	and yields the results in the order of args_list. Up to jobs calls run at
+	the same time, in threads, since the work is done by subprocesses, and
+	args_list is only read as far as needed to keep them running. When the
+	generator is closed, the calls that haven't started are cancelled and the
+	aligners of the running ones are killed (see run_aligner), so that
+	closing only waits for the calls to notice.
+	'''
+
+	args_list = iter(args_list)
+
+	if (jobs <= 1):
+		for args in args_list:
+			yield function(*args)
+		return
+
+	executor = ThreadPoolExecutor(jobs)
+	aligner_processes = AlignerProcesses()
+	futures = deque(executor.submit(run_alignment_job, aligner_processes, function, *args)
+					for args in islice(args_list, jobs))
+
+	try:
+		while futures:
+			result = futures.popleft().result()
+			for args in islice(args_list, 1): # Keeping jobs calls in flight
+				futures.append(executor.submit(run_alignment_job, aligner_processes,
+												function, *args))
+			yield result
+	finally:
+		aligner_processes.kill()
+		executor.shutdown(wait=True, cancel_futures=True)
+
+
+def blat_pair_batch(ref, tmp_fasta_1, tmp_fasta_2, batch, aligner):
+	'''
+	Blats the R1 reads of the (seq_id, seq_R1, seq_R2) tuples in batch. The
+	R2 reads of the R1 reads with exactly one result are then blatted together
+	in a second batch. Returns a list of (seq_id_R1, result_R1, result_R2)
+	tuples, where the results are (seq_start, seq_end, nr_of_results,
+	ref_transcript_id) tuples and result_R2 is None when R2 was not blatted.
+	'''
+
+	results_R1 = align_batch(aligner, ref, tmp_fasta_1,
+								[seq_R1 for seq_id, seq_R1, seq_R2 in batch])
+
+	# Collecting the R2 sequences of the reads with a unique hit
+	unique_reads = []
+	seqs_R2 = []
+	for i, ((seq_id_R1, seq_R1, seq_R2), result_R1) in enumerate(zip(batch, results_R1)):
+		if (result_R1[2] == 1 and seq_R2 is not None):
+			unique_reads.append(i)
+			seqs_R2.append(seq_R2)
+
+	logger.debug('Now blatting the corresponding sequences in file 2.')
+	results_R2 = dict(zip(unique_reads, align_batch(aligner, ref, tmp_fasta_2, seqs_R2)))
+
+	results = []
+	for i, ((seq_id_R1, seq_R1, seq_R2), result_R1) in enumerate(zip(batch, results_R1)):
+		result_R2 = None
+		if (result_R1[2] == 1): # A read without a mate in f2 gets no R2 result
+			result_R2 = results_R2.get(i, (0, 0, 0, "N/A"))
+		results.append((seq_id_R1, result_R1, result_R2))
+
+	return results
+
+
+def blat_pairs_in_batches(ref, pairs, aligner, jobs=ALIGNMENT_JOBS):
+	'''
+	Generator that blats the (seq_id, seq_R1, seq_R2) tuples in pairs
+	BLAT_BATCH_SIZE at a time, see blat_pair_batch, up to jobs batches at the
+	same time. Yields (seq_id_R1, result_R1, result_R2) for one read at a
+	time, in the order of pairs. The tmp files are kept in a private
+	workspace, see alignment_workspace, that is removed when the generator
+	is closed.
+	'''
+
+	pairs = iter(pairs)
+	batches = iter(lambda: list(islice(pairs, BLAT_BATCH_SIZE)), [])
+
+	with alignment_workspace() as workspace:
+		# Every batch gets its own tmp files, as they may be blatted at the same time
+		batch_args = ((ref, os.path.join(workspace, f'{batch_nr}_R1.fa'),
+						os.path.join(workspace, f'{batch_nr}_R2.fa'), batch, aligner)
+						for batch_nr, batch in enumerate(batches))
+		# Closed first, so that no batch is still running when the workspace is removed
+		with closing(map_in_order(blat_pair_batch, batch_args, jobs)) as batch_results:
+			for results in batch_results:
+				yield from results
+
+
+def gfserver_state_file(port):
+	'''
+	Returns the state file of the gfServer on port, see GFSERVER_STATE_DIR.
+	'''
+
+	return os.path.join(GFSERVER_STATE_DIR, f'{port}.json')
+
+
+def read_gfserver_state(port):
+	'''
+	Returns the state of the gfServer on port, a dictionary with the
+	reference it serves and its sha256 hash, or None if there is none.
+	'''
+
+	try:
+		with open(gfserver_state_file(port)) as f_in:
+			return json.load(f_in)
+	except (IOError, ValueError):
+		return None
+
+
+def write_gfserver_state(port, state):
+	'''
+	Writes the state of the gfServer on port, see read_gfserver_state.
+	'''
+
+	os.makedirs(GFSERVER_STATE_DIR, exist_ok=True)
+	tmp_state_file = f'{gfserver_state_file(port)}.{os.getpid()}.new'
+	with open(tmp_state_file, 'w') as f_out:
+		json.dump(state, f_out)
+	os.replace(tmp_state_file, gfserver_state_file(port)) # Never read half written
+
+
+def remove_gfserver_state(port):
+	'''
+	Removes the state of the gfServer on port, once it is stopped.
+	'''
+
+	try:
+		os.remove(gfserver_state_file(port))
+	except FileNotFoundError:
+		pass
+
+
+def gfserver_states():
+	'''
+	Yields (port, state) for every gfServer with a state file, see
+	read_gfserver_state.
+	'''
+
+	try:
+		file_names = os.listdir(GFSERVER_STATE_DIR)
+	except FileNotFoundError:
+		return
+
+	for file_name in file_names:
+		port, extension = os.path.splitext(file_name)
+		if (extension == '.json' and port.isdigit()):
+			state = read_gfserver_state(int(port))
+			if state is not None:
+				yield int(port), state
+
+
+def port_is_free(host, port):
+	'''
+	Returns True if nothing listens on port yet.
+	'''
+
+	with socket.socket() as probe:
+		try:
+			probe.bind((host, port))
+		except OSError:
+			return False
+
+	return True
+
+
+def free_gfserver_port(ref, host=GFSERVER_HOST):
+	'''
+	Returns the first free port in the range of the gfServers, from the port
+	derived from the name of the reference ref, so that references whose
+	names lead to the same port get different ones.
+	'''
+
+	first_port = zlib.crc32(ref.encode()) % GFSERVER_PORT_RANGE
+	for i in range(GFSERVER_PORT_RANGE):
+		port = GFSERVER_PORT + (first_port + i) % GFSERVER_PORT_RANGE
+		if port_is_free(host, port):
+			return port
+
+	raise RuntimeError(f'There is no free port for a gfServer from {GFSERVER_PORT} '
+						f'to {GFSERVER_PORT + GFSERVER_PORT_RANGE - 1}.')
+
+
+def get_gfserver(ref, port=None):
+	'''
+	Returns a running gfServer for the reference ref, starting one if this
+	process doesn't have one yet. A server already running on the port of
+	the reference is reused.
+	'''
+
+	with GFSERVERS_LOCK: # Alignment jobs running at the same time share the server
+		if ref not in GFSERVERS:
+			gfserver = GfServer(ref, port)
+			gfserver.start()
+			GFSERVERS[ref] = gfserver
+
+		return GFSERVERS[ref]
+
+
+def stop_gfservers():
+	'''
+	Stops the gfServers that were started by this process.
+	'''
+
+	for gfserver in GFSERVERS.values():
+		gfserver.stop()
+	GFSERVERS.clear()
+
+atexit.register(stop_gfservers)
+
+
+class GfServer:
+	'''
+	A local gfServer holding the reference 'reference_sequences/' + ref in
+	memory, queried with gfClient. gfServer reads .2bit files, so the
+	reference is converted with faToTwoBit the first time, and cached.
+	'''
+
+	def __init__(self, ref, port=None):
+		self.ref = ref
+		self.host = GFSERVER_HOST
+		self.port = port # If not given, found or chosen by start
+		self.seq_dir = 'reference_sequences'
+		fasta_file = os.path.join(self.seq_dir, ref)
+		# The reference in the state file of the server, see GFSERVER_STATE_DIR
+		self.reference = os.path.abspath(fasta_file)
+		# The cached .2bit file, relative to seq_dir
+		self.two_bit = os.path.relpath(two_bit_file(fasta_file, cache_path(fasta_file, '2bit')),
+										self.seq_dir)
+		self.process = None # Only set if this process started the server
+
+	def make_two_bit(self):
+		'''
+		Converts the fasta reference to .2bit, unless an up to date .2bit
+		file is already cached.
+		'''
+
+		if cached_reference(os.path.join(self.seq_dir, self.ref), '2bit', build_two_bit) is None:
+			raise IOError(f'The .2bit file that the gfServer for {self.ref} loads '
+							f'can not be cached in {self.seq_dir}.')
+
+	def is_running(self):
+		'''
+		Returns True if a gfServer answers on the port of this server.
+		'''
+
+		status = subprocess.run([GFSERVER_EXECUTABLE, 'status', self.host,
+								str(self.port)], capture_output=True)
+
+		return (status.returncode == 0)
+
+	def serves_reference(self):
+		'''
+		Returns True if the gfServer on the port of this server has the
+		reference of this server loaded.
+		'''
+
+		files = subprocess.run([GFSERVER_EXECUTABLE, 'files', self.host,
+								str(self.port)], capture_output=True, text=True)
+
+		return (files.returncode == 0 and self.two_bit in files.stdout)
+
+	def is_current(self, sha256):
+		'''
+		Returns True if the gfServer on the port of this server was started
+		for the version of the reference with the hash sha256, see
+		GFSERVER_STATE_DIR.
+		'''
+
+		state = read_gfserver_state(self.port)
+
+		return (state is not None and state['reference'] == self.reference
+				and state['sha256'] == sha256 and self.serves_reference())
+
+	def find(self, sha256=None):
+		'''
+		Looks for a running gfServer that was started for the reference, and
+		returns True if there is one, with the port of this server set to its
+		port. If sha256 is given, the servers of other versions of the
+		reference are stopped instead.
+		'''
+
+		for port, state in gfserver_states():
+			if (state['reference'] != self.reference):
+				continue
+			self.port = port
+			if not self.is_running(): # It was stopped some other way
+				remove_gfserver_state(port)
+			elif (sha256 is None or self.is_current(sha256)):
+				return True
+			else:
+				logger.info('Stopping the gfServer on port %d, it serves another version '
+							'of %s.', port, self.ref)
+				self.stop_server()
+
+		self.port = None
+		return False
+
+	def start(self):
+		'''
+		Starts the gfServer and waits until it has loaded the reference. A
+		gfServer that was started for the current version of the reference
+		is reused, one that was started for another version is restarted.
+		Without a given port, a new server gets a free one, see
+		free_gfserver_port.
+		'''
+
+		sha256 = reference_hash(os.path.join(self.seq_dir, self.ref))
+		if self.port is None:
+			if self.find(sha256):
+				logger.info('Reusing the gfServer for %s on port %d.', self.ref, self.port)
+				return
+			self.port = free_gfserver_port(self.ref, self.host)
+		elif self.is_running():
+			if self.is_current(sha256):
+				logger.info('Reusing the gfServer for %s on port %d.', self.ref, self.port)
+				return
+			state = read_gfserver_state(self.port)
+			if (state is None or state['reference'] != self.reference):
+				raise RuntimeError(f'The gfServer on port {self.port} does '
+									f'not serve {self.two_bit}.')
+			logger.info('Stopping the gfServer on port %d, it serves another version '
+						'of %s.', self.port, self.ref)
+			self.stop_server()
+
+		self.make_two_bit()
+		logger.info('Starting a gfServer for %s on port %d.', self.ref, self.port)
+		# The server runs in the reference directory, so that gfClient finds the
+		# .2bit file in seq_dir under the name the server reports
+		self.process = subprocess.Popen([os.path.abspath(GFSERVER_EXECUTABLE),
+										'start', self.host, str(self.port),
+										self.two_bit, '-canStop'],
+										cwd=self.seq_dir,
+										stdout=subprocess.DEVNULL,
+										stderr=subprocess.DEVNULL)
+
+		start_time = time.time()
+		while not self.is_running(): # Waiting for the index to be built
+			if (self.process.poll() is not None):
+				self.process = None
+				raise RuntimeError(f'The gfServer for {self.ref} on port '
+									f'{self.port} could not be started.')
+			if (time.time() - start_time > GFSERVER_START_TIMEOUT):
+				self.stop()
+				raise RuntimeError(f'The gfServer for {self.ref} did not start '
+									f'within {GFSERVER_START_TIMEOUT} seconds.')
+			time.sleep(0.5)
+		write_gfserver_state(self.port, {'reference': self.reference, 'sha256': sha256})
+
+	def stop(self):
+		'''
+		Stops the gfServer, if it was started by this process.
+		'''
+
+		if self.process is None:
+			return
+
+		self.stop_server()
+		try:
+			self.process.wait(timeout=GFSERVER_STOP_TIMEOUT)
+		except subprocess.TimeoutExpired:
+			self.process.kill()
+			self.process.wait()
+		self.process = None
+
+	def stop_server(self):
+		'''
+		Stops the gfServer on the port of this server, also if another process
+		started it, and waits until it no longer answers.
+		'''
+
+		subprocess.run([GFSERVER_EXECUTABLE, 'stop', self.host, str(self.port)],
+						capture_output=True)
+		remove_gfserver_state(self.port)
+
+		start_time = time.time()
+		while (self.is_running() and time.time() - start_time < GFSERVER_STOP_TIMEOUT):
+			time.sleep(0.1)
+
+	def align_batch(self, tmp_fasta, seqs):
+		'''
+		Aligns all the sequences in seqs with one gfClient call and returns
+		the same list of tuples as run_blat_batch.
+		'''
+
+		if not seqs:
+			return []
+
+		tmp_rslt = tmp_fasta + "_rslt"
+
+		write_batch_fasta(tmp_fasta, seqs)
+		logger.debug('Aligning %d sequences with the gfServer on port %d.', len(seqs), self.port)
+		run_aligner([GFCLIENT_EXECUTABLE, self.host, str(self.port),
+					self.seq_dir, tmp_fasta, tmp_rslt, '-out=blast8'], len(seqs))
+		results = parse_blast8(tmp_rslt, len(seqs))
+
+		os.remove(tmp_rslt) # Removing the tmp gfClient rslt file
+
+		return results
+
+
+###--------- MAIN ---------###
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Manage a gfServer that keeps "
+									"a reference loaded between guesslib runs.")
+	parser.add_argument("command", choices=["start", "status", "stop"])
+	parser.add_argument("-r", "--reference", required=True, help="reference sequence")
+	parser.add_argument("-p", "--port", type=int, help="port of the gfServer")
+	args = parser.parse_args()
+
+	configure_logging()
+	gfserver = GfServer(args.reference, args.port)
+
+	if (args.command == "start"):
+		gfserver.start() # The server keeps running after this program exits
+	elif (args.command == "status"):
+		if (args.port is not None or gfserver.find()):
+			sha256 = reference_hash(os.path.join(gfserver.seq_dir, args.reference))
+			print(f'The gfServer for {args.reference} on port {gfserver.port} is running: '
+				f'{gfserver.is_running() and gfserver.is_current(sha256)}')
+		else:
+			print(f'The gfServer for {args.reference} is running: False')
+	elif (args.command == "stop"):
+		if (args.port is not None or gfserver.find()):
+			gfserver.stop_server()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+###--------- GLOBAL VARIABLES ---------###
+
+# Specify how many alignment results are kept in memory. When there are more,
+# the least recently used ones are evicted.
+ALIGNMENT_MEMO_SIZE = 100000
+
+# Specify how many sequences are looked up in the database in one query.
+DATABASE_QUERY_SIZE = 500
+
+###--------- FUNCTIONS ---------###
+
+class AlignmentMemo:
+	'''
+	Remembers the (seq_start, seq_end, nr_of_results, ref_transcript_id)
+	tuples that sequences were aligned to, by a memo_key identifying the
+	version of the reference and the aligner, and by sequence. The most
+	recently used max_size results are kept in memory. With a database, an
+	SQLite file, all results are also stored there and looked up from there,
+	so they are kept between runs. hits, misses and evictions count the
+	sequences that were found, those that were not, and the results that
+	were evicted from memory.
+	'''
+
+	def __init__(self, max_size=ALIGNMENT_MEMO_SIZE, database=None):
+		self.max_size = max_size
+		self.results = OrderedDict()
+		self.lock = threading.Lock() # Alignment jobs running at the same time share the memo
+		self.connection = None
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		if database is not None:
+			self.open_database(database)
+
+	def open_database(self, database):
+		'''
+		Opens (or creates) the SQLite file database that results are stored in.
+		'''
+
+		with self.lock:
+			self.connection = sqlite3.connect(database, check_same_thread=False)
+			self.connection.execute('CREATE TABLE IF NOT EXISTS alignments ('
+									'memo_key TEXT, seq TEXT, seq_start INTEGER, '
+									'seq_end INTEGER, nr_of_results INTEGER, '
+									'ref_transcript_id TEXT, PRIMARY KEY (memo_key, seq))')
+			self.connection.commit()
+
+	def remember(self, memo_key, seq, result):
+		'''
+		Keeps a result in memory, evicting the least recently used one if the
+		memo is full.
+		'''
+
+		self.results[(memo_key, seq)] = result
+		self.results.move_to_end((memo_key, seq))
+		if (len(self.results) > self.max_size):
+			self.results.popitem(last=False)
+			self.evictions += 1
+
+	def lookup(self, memo_key, seqs):
+		'''
+		Returns a list with the remembered result of every sequence in seqs,
+		or None for the sequences that have to be aligned.
+		'''
+
+		with self.lock:
+			results = []
+			for seq in seqs:
+				result = self.results.get((memo_key, seq))
+				if result is not None:
+					self.results.move_to_end((memo_key, seq))
+				results.append(result)
+
+			missing = list({seq for seq, result in zip(seqs, results) if result is None})
+			if (missing and self.connection is not None):
+				stored = {}
+				for i in range(0, len(missing), DATABASE_QUERY_SIZE):
+					query_seqs = missing[i:i + DATABASE_QUERY_SIZE]
+					rows = self.connection.execute('SELECT seq, seq_start, seq_end, '
+													'nr_of_results, ref_transcript_id '
+													'FROM alignments WHERE memo_key = ? AND seq IN '
+													f'({",".join("?" * len(query_seqs))})',
+													[memo_key] + query_seqs)
+					for seq, *result in rows:
+						stored[seq] = tuple(result)
+						self.remember(memo_key, seq, tuple(result))
+				results = [stored.get(seq) if result is None else result
+							for seq, result in zip(seqs, results)]
+
+			nr_of_misses = results.count(None)
+			self.hits += len(results) - nr_of_misses
+			self.misses += nr_of_misses
+
+		return results
+
+	def store(self, memo_key, results):
+		'''
+		Remembers the results in a dictionary from sequence to result.
+		'''
+
+		with self.lock:
+			for seq, result in results.items():
+				self.remember(memo_key, seq, result)
+			if self.connection is not None:
+				self.connection.executemany('INSERT OR REPLACE INTO alignments '
+											'VALUES (?, ?, ?, ?, ?, ?)',
+											[(memo_key, seq) + tuple(result)
+												for seq, result in results.items()])
+				self.connection.commit()
+
+	def statistics(self):
+		'''
+		Returns the counters of the memo and the nr of results in memory.
+		'''
+
+		return {'hits': self.hits, 'misses': self.misses,
+				'evictions': self.evictions, 'size': len(self.results)}
+
+	def clear(self):
+		'''
+		Forgets the results in memory and resets the counters, e.g. between
+		benchmark runs. The database is kept.
+		'''
+
+		with self.lock:
+			self.results.clear()
+			self.hits = 0
+			self.misses = 0
+			self.evictions = 0
+
+	def close(self):
+		'''
+		Closes the database, if there is one.
+		'''
+
+		with self.lock:
+			if self.connection is not None:
+				self.connection.close()
+				self.connection = None
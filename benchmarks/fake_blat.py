@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import bisect
+import os
+import sys
+import time
+
+###--------- GLOBAL VARIABLES ---------###
+
+# A stand-in for blat, for benchmarking guesslib without blat installed. It
+# takes the arguments that aligners.py calls blat with, finds the exact
+# matches of every query (and of its reverse complement) in the reference
+# fasta, and writes them in the blast8 format. The latency of blat is modelled
+# by sleeping for the seconds in these environment variables: once per call,
+# like loading the reference, and once per query sequence.
+LATENCY_VARIABLE = 'FAKE_BLAT_LATENCY'
+READ_LATENCY_VARIABLE = 'FAKE_BLAT_READ_LATENCY'
+
+COMPLEMENT = str.maketrans('ACGTN', 'TGCAN')
+
+###--------- FUNCTIONS ---------###
+
+def read_fasta(fasta_file):
+	'''
+	Returns a list of (seq_id, seq) tuples of the sequences in fasta_file.
+	'''
+
+	sequences = []
+	with open(fasta_file) as f_in:
+		for line in f_in:
+			line = line.strip()
+			if line.startswith('>'):
+				sequences.append((line[1:].split()[0], []))
+			elif sequences:
+				sequences[-1][1].append(line.upper())
+
+	return [(seq_id, ''.join(lines)) for seq_id, lines in sequences]
+
+
+def find_all(text, seq):
+	'''
+	Yields the positions of all occurrences of seq in text.
+	'''
+
+	position = text.find(seq)
+	while (position >= 0):
+		yield position
+		position = text.find(seq, position + 1)
+
+
+def blast8_lines(query_id, seq, reference, starts, ids):
+	'''
+	Yields the blast8 lines of the exact matches of seq in reference, the
+	reference sequences joined by '|', that start at starts and are named
+	ids. Matches on the reverse strand have a subject start after their end,
+	like in the output of blat.
+	'''
+
+	length = len(seq)
+	for strand_seq, reverse in ((seq, False), (seq.translate(COMPLEMENT)[::-1], True)):
+		for position in find_all(reference, strand_seq):
+			index = bisect.bisect_right(starts, position) - 1
+			start = position - starts[index] + 1
+			end = start + length - 1
+			if reverse:
+				start, end = end, start
+			yield (f'{query_id}\t{ids[index]}\t100.00\t{length}\t0\t0\t1\t{length}\t'
+					f'{start}\t{end}\t1e-20\t{2*length}\n')
+
+###--------- MAIN ---------###
+
+def main():
+
+	options = [arg for arg in sys.argv[1:] if arg.startswith('-')]
+	arguments = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
+
+	for option in options:
+		if option.startswith('-makeOoc='): # See aligners.build_ooc
+			open(option.split('=', 1)[1], 'w').close()
+			return
+
+	time.sleep(float(os.environ.get(LATENCY_VARIABLE, 0)))
+
+	reference_file, query_file, output_file = arguments[0], arguments[1], arguments[-1]
+	sequences = read_fasta(reference_file)
+	reference = '|'.join(seq for seq_id, seq in sequences)
+	ids = [seq_id for seq_id, seq in sequences]
+	starts = []
+	position = 0
+	for seq_id, seq in sequences:
+		starts.append(position)
+		position += len(seq) + 1
+
+	queries = read_fasta(query_file)
+	time.sleep(float(os.environ.get(READ_LATENCY_VARIABLE, 0)) * len(queries))
+
+	with open(output_file, 'w') as f_out:
+		for query_id, seq in queries:
+			f_out.writelines(blast8_lines(query_id, seq, reference, starts, ids))
+
+if __name__ == "__main__":
+	main()
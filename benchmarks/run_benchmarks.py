@@ -0,0 +1,273 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import fake_blat
+import synthetic_data
+from aligners import ALIGNMENT_JOBS, ALIGNMENT_MEMO, BLAT_EXECUTABLE
+from fastq_checker_pair import check_format_and_remove_low_quality_reads_pair
+from fastq_checker_single import check_format_and_remove_low_quality_reads_single
+from guesslib_genomic_pair import guesslib_genomic_pair
+from guesslib_pair import guesslib_pair
+from guesslib_single import guesslib_single
+from instrumentation import STAGE_TIMER
+from logging_config import configure_logging
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The benchmarks, with the lib types of the libraries they are run on. The
+# fastq checkers are timed end to end, guesslib also per stage (see
+# instrumentation.STAGES).
+BENCHMARKS = {
+	'check-single': synthetic_data.SINGLE_LIB_TYPES,
+	'check-pair': ('ISF',),
+	'guess-single': synthetic_data.SINGLE_LIB_TYPES,
+	'guess-pair': synthetic_data.PAIRED_LIB_TYPES,
+	'guess-genomic': ('IU', 'OU')
+}
+
+# The default nr of reads (or pairs) of the libraries
+LIBRARY_SIZES = [1000, 10000]
+
+# Every benchmark is run WARMUP_RUNS times before it is timed REPEATS times.
+# The warmup runs build the reference caches and the fastq indexes, and
+# import scipy, so the timed runs measure the steady state.
+WARMUP_RUNS = 1
+REPEATS = 3
+
+# The aligners that can be benchmarked: the fake blat, see fake_blat.py, and
+# the k-mer index. gfServer is left out, it needs the real executables.
+BENCHMARK_ALIGNERS = ('blat', 'kmer')
+
+# The version of the format of the results file
+RESULTS_VERSION = 1
+
+###--------- FUNCTIONS ---------###
+
+def repo_version():
+	'''
+	Returns the commit of the repository that is benchmarked, with -dirty if
+	it has uncommitted changes, or None if it is not a git repository.
+	'''
+
+	try:
+		return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+							capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def install_fake_blat(directory):
+	'''
+	Copies fake_blat.py to directory as the blat executable that guesslib
+	runs from there, see aligners.BLAT_EXECUTABLE.
+	'''
+
+	blat = os.path.join(directory, BLAT_EXECUTABLE)
+	shutil.copy(fake_blat.__file__, blat)
+	os.chmod(blat, 0o755)
+
+
+def benchmark_call(benchmark, lib_type, size, aligner, jobs):
+	'''
+	Returns the function and arguments that run a benchmark on the library of
+	lib_type and size, and the library type that guesslib should find (None
+	for the checkers).
+	'''
+
+	if (benchmark == 'check-single'):
+		return (check_format_and_remove_low_quality_reads_single,
+				[synthetic_data.single_library_file('', lib_type, size)], None)
+	elif (benchmark == 'check-pair'):
+		return (check_format_and_remove_low_quality_reads_pair,
+				list(synthetic_data.paired_library_files('', lib_type, size)), None)
+	elif (benchmark == 'guess-single'):
+		return (guesslib_single, ['transcriptome.fa',
+				synthetic_data.single_library_file('', lib_type, size), aligner,
+				True, 0, jobs], lib_type)
+	elif (benchmark == 'guess-pair'):
+		return (guesslib_pair, ['transcriptome.fa',
+				*synthetic_data.paired_library_files('', lib_type, size), aligner,
+				True, 0, jobs], lib_type)
+	else:
+		return (guesslib_genomic_pair, ['transcriptome.fa',
+				*synthetic_data.paired_library_files('', lib_type, size), aligner,
+				True, 0, jobs], lib_type[0])
+
+
+def mean_stages(runs):
+	'''
+	Returns the mean seconds and count of every stage over the
+	STAGE_TIMER.statistics() of the runs.
+	'''
+
+	names = dict.fromkeys(name for run in runs for name in run)
+	return {name: {'seconds': sum(run.get(name, {}).get('seconds', 0.0) for run in runs) / len(runs),
+					'count': sum(run.get(name, {}).get('count', 0) for run in runs) / len(runs)}
+			for name in names}
+
+
+def run_benchmark(benchmark, lib_type, size, aligner, jobs=ALIGNMENT_JOBS,
+				repeats=REPEATS, warmup_runs=WARMUP_RUNS):
+	'''
+	Runs a benchmark on the library of lib_type and size in the current
+	directory, and returns its result: the seconds of every timed run, their
+	median and minimum, the reads (or pairs) of the library per second, the
+	mean time per stage and, for guesslib, the library type it found and
+	whether that is the right one. Every run starts with an empty alignment
+	memo, and prints nothing.
+	'''
+
+	function, args, expected_lib_type = benchmark_call(benchmark, lib_type, size, aligner, jobs)
+
+	seconds = []
+	stages = []
+	for run in range(warmup_runs + repeats):
+		ALIGNMENT_MEMO.clear()
+		STAGE_TIMER.reset()
+		with open(os.devnull, 'w') as f_null, redirect_stdout(f_null):
+			start_time = time.perf_counter()
+			output = function(*args)
+			run_time = time.perf_counter() - start_time
+		if (run >= warmup_runs):
+			seconds.append(run_time)
+			stages.append(STAGE_TIMER.statistics())
+
+	result = {'benchmark': benchmark, 'library': lib_type, 'size': size,
+				'aligner': aligner, 'jobs': jobs, 'seconds': seconds,
+				'median_seconds': statistics.median(seconds), 'min_seconds': min(seconds),
+				'reads_per_second': size / statistics.median(seconds),
+				'stages': mean_stages(stages)}
+	if expected_lib_type is not None:
+		result.update({'lib_type': output[0], 'correct': output[0] == expected_lib_type})
+	else:
+		result['reads_out'] = output[1]
+
+	return result
+
+
+def run_benchmarks(directory, sizes=LIBRARY_SIZES, benchmarks=tuple(BENCHMARKS),
+					aligner='blat', jobs=ALIGNMENT_JOBS, repeats=REPEATS,
+					warmup_runs=WARMUP_RUNS, seed=0, **data_settings):
+	'''
+	Writes the synthetic data (see synthetic_data.write_dataset, which takes
+	data_settings) and the fake blat to directory, and runs the benchmarks on
+	every size of library from there. Returns the list of results, see
+	run_benchmark.
+	'''
+
+	synthetic_data.write_dataset(directory, sizes, seed=seed, **data_settings)
+	install_fake_blat(directory)
+
+	results = []
+	working_dir = os.getcwd()
+	os.chdir(directory) # guesslib runs blat and finds the reference from here
+	try:
+		for size in sizes:
+			for benchmark in benchmarks:
+				for lib_type in BENCHMARKS[benchmark]:
+					result = run_benchmark(benchmark, lib_type, size, aligner, jobs,
+											repeats, warmup_runs)
+					print(f'{benchmark} {lib_type} {size}: {result["median_seconds"]:.3f} s'
+						+ (f', {result["lib_type"]}' if 'lib_type' in result else ''))
+					results.append(result)
+	finally:
+		os.chdir(working_dir)
+
+	return results
+
+
+def compare_results(baseline, results):
+	'''
+	Prints the median time of every benchmark in results next to the one in
+	the baseline results, and their ratio.
+	'''
+
+	baseline_times = {(result['benchmark'], result['library'], result['size'],
+						result['aligner']): result['median_seconds']
+						for result in baseline['results']}
+	print(f'Compared to {baseline.get("version")}:')
+	for result in results['results']:
+		key = (result['benchmark'], result['library'], result['size'], result['aligner'])
+		if key in baseline_times:
+			print(f'{" ".join(map(str, key))}: {baseline_times[key]:.3f} s -> '
+				f'{result["median_seconds"]:.3f} s '
+				f'({result["median_seconds"] / baseline_times[key]:.2f}x)')
+
+###--------- MAIN ---------###
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Time the fastq checkers and guesslib "
+									"on synthetic libraries, with a fake blat.")
+	parser.add_argument("-o", "--output", default="benchmark_results.json",
+						help="JSON file to write the results to")
+	parser.add_argument("-n", "--sizes", type=int, nargs="+", default=LIBRARY_SIZES,
+						help="nr of reads (or pairs) of the libraries")
+	parser.add_argument("-b", "--benchmarks", choices=BENCHMARKS, nargs="+",
+						default=list(BENCHMARKS), help="benchmarks to run")
+	parser.add_argument("-a", "--aligner", choices=BENCHMARK_ALIGNERS, default="blat",
+						help="the fake blat or the k-mer index")
+	parser.add_argument("-j", "--jobs", type=int, default=ALIGNMENT_JOBS,
+						help="nr of read batches to align at the same time")
+	parser.add_argument("-r", "--repeats", type=int, default=REPEATS,
+						help="nr of timed runs of every benchmark")
+	parser.add_argument("-w", "--warmup_runs", type=int, default=WARMUP_RUNS,
+						help="nr of runs of every benchmark before it is timed")
+	parser.add_argument("--latency", type=float, default=0.0,
+						help="seconds that the fake blat takes to start")
+	parser.add_argument("--read_latency", type=float, default=0.0,
+						help="seconds that the fake blat takes per read")
+	parser.add_argument("-t", "--transcripts", type=int, default=synthetic_data.NR_OF_TRANSCRIPTS,
+						help="nr of transcripts of the synthetic transcriptome")
+	parser.add_argument("--noise", type=float, default=synthetic_data.NOISE,
+						help="fraction of reads that are random sequence")
+	parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the synthetic data")
+	parser.add_argument("--workdir",
+						help="folder to write the data to and keep, a tmp folder by default")
+	parser.add_argument("--baseline", help="results file of an earlier run to compare to")
+	args = parser.parse_args()
+
+	configure_logging('warning')
+	os.environ[fake_blat.LATENCY_VARIABLE] = str(args.latency)
+	os.environ[fake_blat.READ_LATENCY_VARIABLE] = str(args.read_latency)
+
+	directory = args.workdir or tempfile.mkdtemp(prefix='guesslib_benchmarks_')
+	try:
+		benchmark_results = run_benchmarks(directory, args.sizes, args.benchmarks,
+											args.aligner, args.jobs, args.repeats,
+											args.warmup_runs, args.seed,
+											nr_of_transcripts=args.transcripts,
+											noise=args.noise)
+	finally:
+		if not args.workdir:
+			shutil.rmtree(directory)
+
+	results = {'results_version': RESULTS_VERSION, 'version': repo_version(),
+				'date': datetime.datetime.now().isoformat(timespec='seconds'),
+				'python': platform.python_version(), 'platform': platform.platform(),
+				'cpu_count': os.cpu_count(), 'settings': vars(args),
+				'results': benchmark_results}
+	with open(args.output, 'w') as f_out:
+		json.dump(results, f_out, indent=1)
+	print(f'Wrote the results to {args.output}.')
+
+	if args.baseline:
+		with open(args.baseline) as f_in:
+			compare_results(json.load(f_in), results)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,227 @@
+import argparse
+import os
+import random
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The library types that single and paired libraries can be generated with.
+# U and IU/OU libraries have reads (or pairs) of both strands, in equal parts.
+SINGLE_LIB_TYPES = ('SF', 'SR', 'U')
+PAIRED_LIB_TYPES = ('ISF', 'ISR', 'IU', 'OSF', 'OSR', 'OU')
+
+# The default shape of the synthetic data
+NR_OF_TRANSCRIPTS = 200
+TRANSCRIPT_LENGTH = 2000
+READ_LENGTH = 50
+FRAGMENT_LENGTH = 250
+
+# The fraction of reads (or pairs) that are random sequence, and that the
+# aligner finds no results for.
+NOISE = 0.05
+
+# The range of the phred scores of the generated qualities. Every read gets
+# its own mean quality in this range, so that the fastq checkers have reads
+# to remove.
+QUALITY_RANGE = (10, 41)
+PHRED_OFFSET = 33
+
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+###--------- FUNCTIONS ---------###
+
+def reverse_complement(seq):
+	'''
+	Returns the reverse complement of seq.
+	'''
+
+	return seq.translate(COMPLEMENT)[::-1]
+
+
+def random_sequence(length, rng):
+	'''
+	Returns a random DNA sequence of length bases.
+	'''
+
+	return ''.join(rng.choices('ACGT', k=length))
+
+
+def random_quality(length, rng):
+	'''
+	Returns a quality line of length scores, around a mean quality that is
+	drawn from QUALITY_RANGE.
+	'''
+
+	mean_quality = rng.randint(*QUALITY_RANGE)
+	return ''.join(chr(PHRED_OFFSET + min(max(mean_quality + rng.randint(-3, 3),
+												QUALITY_RANGE[0]), QUALITY_RANGE[1]))
+					for i in range(length))
+
+
+def random_transcriptome(nr_of_transcripts=NR_OF_TRANSCRIPTS, length=TRANSCRIPT_LENGTH,
+						rng=None):
+	'''
+	Returns a list of (transcript_id, seq) tuples of random transcripts.
+	'''
+
+	rng = rng or random.Random()
+	return [(f'transcript{i}', random_sequence(length, rng)) for i in range(nr_of_transcripts)]
+
+
+def write_fasta(fasta_file, transcripts):
+	'''
+	Writes the (transcript_id, seq) tuples of transcripts to fasta_file.
+	'''
+
+	with open(fasta_file, 'w') as f_out:
+		for transcript_id, seq in transcripts:
+			f_out.write(f'>{transcript_id}\n{seq}\n')
+
+
+def single_read(transcripts, lib_type, read_length, noise, rng):
+	'''
+	Returns the sequence of one read of a single library of lib_type (see
+	SINGLE_LIB_TYPES) from a random place of a random transcript: the
+	transcript strand for SF, the opposite strand for SR and either for U.
+	'''
+
+	if (rng.random() < noise):
+		return random_sequence(read_length, rng)
+
+	transcript = rng.choice(transcripts)[1]
+	start = rng.randint(0, len(transcript) - read_length)
+	seq = transcript[start:start + read_length]
+	if (lib_type == 'SR' or (lib_type == 'U' and rng.random() < 0.5)):
+		seq = reverse_complement(seq)
+
+	return seq
+
+
+def read_pair(transcripts, lib_type, read_length, fragment_length, noise, rng):
+	'''
+	Returns the sequences of the R1 and R2 read of one pair of a paired
+	library of lib_type (see PAIRED_LIB_TYPES), from the ends of a random
+	fragment of a random transcript. In an ISF library R1 is the start of
+	the fragment and R2 the reverse complement of its end, so that they point
+	inward; ISR swaps their strands, and the outward (O) types swap their ends.
+	'''
+
+	if (rng.random() < noise):
+		return random_sequence(read_length, rng), random_sequence(read_length, rng)
+
+	transcript = rng.choice(transcripts)[1]
+	start = rng.randint(0, len(transcript) - fragment_length)
+	fragment = transcript[start:start + fragment_length]
+	left, right = fragment[:read_length], fragment[-read_length:]
+
+	stranded_lib_type = lib_type
+	if lib_type.endswith('U'):
+		stranded_lib_type = lib_type[0] + rng.choice(['SF', 'SR'])
+
+	if (stranded_lib_type == 'ISF'):
+		return left, reverse_complement(right)
+	elif (stranded_lib_type == 'ISR'):
+		return reverse_complement(right), left
+	elif (stranded_lib_type == 'OSF'):
+		return right, reverse_complement(left)
+	else: # OSR
+		return reverse_complement(left), right
+
+
+def write_single_library(fastq_file, transcripts, lib_type, nr_of_reads,
+						read_length=READ_LENGTH, noise=NOISE, rng=None):
+	'''
+	Writes a single library of lib_type with nr_of_reads reads to fastq_file.
+	'''
+
+	rng = rng or random.Random()
+	with open(fastq_file, 'w') as f_out:
+		for i in range(nr_of_reads):
+			seq = single_read(transcripts, lib_type, read_length, noise, rng)
+			f_out.write(f'@read{i}\n{seq}\n+\n{random_quality(read_length, rng)}\n')
+
+
+def write_paired_library(fastq_file_1, fastq_file_2, transcripts, lib_type, nr_of_pairs,
+						read_length=READ_LENGTH, fragment_length=FRAGMENT_LENGTH,
+						noise=NOISE, rng=None):
+	'''
+	Writes a paired library of lib_type with nr_of_pairs pairs to
+	fastq_file_1 (R1) and fastq_file_2 (R2).
+	'''
+
+	rng = rng or random.Random()
+	with open(fastq_file_1, 'w') as f_out_1, open(fastq_file_2, 'w') as f_out_2:
+		for i in range(nr_of_pairs):
+			seq_R1, seq_R2 = read_pair(transcripts, lib_type, read_length, fragment_length,
+										noise, rng)
+			f_out_1.write(f'@pair{i} 1\n{seq_R1}\n+\n{random_quality(read_length, rng)}\n')
+			f_out_2.write(f'@pair{i} 2\n{seq_R2}\n+\n{random_quality(read_length, rng)}\n')
+
+
+def single_library_file(directory, lib_type, nr_of_reads):
+	'''
+	Returns the name of the single library of lib_type and size nr_of_reads
+	in directory.
+	'''
+
+	return os.path.join(directory, f'single_{lib_type}_{nr_of_reads}.fq')
+
+
+def paired_library_files(directory, lib_type, nr_of_pairs):
+	'''
+	Returns the names of the R1 and R2 files of the paired library of
+	lib_type and size nr_of_pairs in directory.
+	'''
+
+	return (os.path.join(directory, f'paired_{lib_type}_{nr_of_pairs}_1.fq'),
+			os.path.join(directory, f'paired_{lib_type}_{nr_of_pairs}_2.fq'))
+
+
+def write_dataset(directory, sizes, single_lib_types=SINGLE_LIB_TYPES,
+				paired_lib_types=PAIRED_LIB_TYPES, nr_of_transcripts=NR_OF_TRANSCRIPTS,
+				transcript_length=TRANSCRIPT_LENGTH, read_length=READ_LENGTH,
+				fragment_length=FRAGMENT_LENGTH, noise=NOISE, seed=0):
+	'''
+	Writes a random transcriptome to <directory>/reference_sequences/
+	transcriptome.fa, and a library of every lib type and size (nr of reads,
+	or pairs) from it to directory, see single_library_file and
+	paired_library_files. The same seed gives the same data.
+	'''
+
+	rng = random.Random(seed)
+	os.makedirs(os.path.join(directory, 'reference_sequences'), exist_ok=True)
+	transcripts = random_transcriptome(nr_of_transcripts, transcript_length, rng)
+	write_fasta(os.path.join(directory, 'reference_sequences', 'transcriptome.fa'), transcripts)
+
+	for size in sizes:
+		for lib_type in single_lib_types:
+			write_single_library(single_library_file(directory, lib_type, size), transcripts,
+								lib_type, size, read_length, noise, rng)
+		for lib_type in paired_lib_types:
+			write_paired_library(*paired_library_files(directory, lib_type, size), transcripts,
+								lib_type, size, read_length, fragment_length, noise, rng)
+
+###--------- MAIN ---------###
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Write a synthetic transcriptome and "
+									"single and paired libraries of known library types.")
+	parser.add_argument("-o", "--output_dir", required=True, help="folder to write the data to")
+	parser.add_argument("-n", "--sizes", type=int, nargs="+", default=[10000],
+						help="nr of reads (or pairs) of the libraries")
+	parser.add_argument("-t", "--transcripts", type=int, default=NR_OF_TRANSCRIPTS,
+						help="nr of transcripts")
+	parser.add_argument("--transcript_length", type=int, default=TRANSCRIPT_LENGTH)
+	parser.add_argument("--read_length", type=int, default=READ_LENGTH)
+	parser.add_argument("--fragment_length", type=int, default=FRAGMENT_LENGTH)
+	parser.add_argument("--noise", type=float, default=NOISE,
+						help="fraction of reads that are random sequence")
+	parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the random data")
+	args = parser.parse_args()
+
+	write_dataset(args.output_dir, args.sizes, SINGLE_LIB_TYPES, PAIRED_LIB_TYPES,
+				args.transcripts, args.transcript_length, args.read_length,
+				args.fragment_length, args.noise, args.seed)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,112 @@
+import math
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The ways guesslib can decide on the library type. 'fisher' tests the counts
+# of the read (or pair) types against the training data with Fisher's exact
+# test, see get_libtype_and_pvalue in the guesslib scripts. 'sprt' and
+# 'bayes' update the evidence for every library type with every read, in
+# constant time, and stop as soon as it is strong enough, see SequentialTest
+# and BayesianTest.
+DECISION_MODES = ('fisher', 'sprt', 'bayes')
+
+# The error budget of the sequential modes. 'sprt' stops when the best
+# library type is at least 1/ERROR_BUDGET times as likely as every other one,
+# which by Wald's bound makes the probability of choosing a wrong library
+# type at most ERROR_BUDGET per other library type. 'bayes' stops when the
+# posterior probability of all other library types together, with equal
+# priors, is at most ERROR_BUDGET.
+ERROR_BUDGET = 0.01
+
+###--------- FUNCTIONS ---------###
+
+class SequentialTest:
+	'''
+	A multi-hypothesis sequential probability ratio test. probabilities is a
+	dictionary from every library type to a dictionary from every read type
+	to the (nonzero) probability of a read of that type in a library of that
+	type, derived from the training data. Read types that aren't in the
+	dictionaries carry no evidence and are ignored.
+	'''
+
+	def __init__(self, probabilities, error_budget=ERROR_BUDGET):
+		self.lib_types = list(probabilities)
+		self.error_budget = error_budget
+		read_types = {read_type for read_type_probabilities in probabilities.values()
+						for read_type in read_type_probabilities}
+		# The log probability of every read type in every library type
+		self.log_probabilities = {
+			read_type: [math.log(probabilities[lib_type][read_type])
+						for lib_type in self.lib_types]
+			for read_type in read_types
+		}
+		self.log_likelihoods = [0.0] * len(self.lib_types)
+		self.nr_of_reads = 0
+
+	def update(self, read_type):
+		'''
+		Adds the evidence of one read of type read_type.
+		'''
+
+		log_probabilities = self.log_probabilities.get(read_type)
+		if log_probabilities is None:
+			return
+
+		for i, log_probability in enumerate(log_probabilities):
+			self.log_likelihoods[i] += log_probability
+		self.nr_of_reads += 1
+
+	def error(self):
+		'''
+		Returns the likelihood of the second most likely library type relative
+		to the most likely one.
+		'''
+
+		best, second_best = sorted(self.log_likelihoods, reverse=True)[:2]
+
+		return math.exp(second_best - best)
+
+	def decision(self):
+		'''
+		Returns the most likely library type and its error (see error), which
+		is at most error_budget once the test has decided. Before the first
+		read, it returns ("N/A", 1.0).
+		'''
+
+		if (self.nr_of_reads == 0):
+			return "N/A", 1.0
+
+		best = self.log_likelihoods.index(max(self.log_likelihoods))
+
+		return self.lib_types[best], self.error()
+
+
+class BayesianTest(SequentialTest):
+	'''
+	A sequential test of the posterior probabilities of the library types,
+	with equal priors, see SequentialTest.
+	'''
+
+	def error(self):
+		'''
+		Returns the posterior probability of all but the most likely library
+		type.
+		'''
+
+		best = max(self.log_likelihoods)
+		relative_likelihoods = sum(math.exp(log_likelihood - best)
+									for log_likelihood in self.log_likelihoods)
+
+		return (relative_likelihoods - 1) / relative_likelihoods
+
+
+def sequential_test(decision_mode, probabilities, error_budget=ERROR_BUDGET):
+	'''
+	Returns the sequential test of the decision mode 'sprt' or 'bayes', see
+	DECISION_MODES, for the probabilities of the read types.
+	'''
+
+	if (decision_mode == 'bayes'):
+		return BayesianTest(probabilities, error_budget)
+
+	return SequentialTest(probabilities, error_budget)
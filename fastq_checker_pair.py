@@ -1,5 +1,10 @@
 import subprocess
 import argparse
+import json
+from fastq_qc import (PHRED_OFFSET, FastqFormatError, ReadStatistics, calculate_quality_bands,
+	choose_quality_threshold, read_selected_reads, read_statistics_report, records_read_batch,
+	select_top_reads, write_records, write_selected_reads)
+from fastq_io import plain_fastq_name, rereadable_fastq
 
 ###--------- GLOBAL VARIABLES ---------###
 
@@ -17,20 +22,32 @@ REPLACE_INPUT = False
 
 ###--------- FUNCTIONS ---------###
 
-def check_format_and_remove_low_quality_reads_pair(fastq_file_1, fastq_file_2):
+def check_format_and_remove_low_quality_reads_pair(fastq_file_1, fastq_file_2, phred_offset=PHRED_OFFSET,
+													selected_pairs=None, read_statistics=None):
 	'''
 	This function writes a file with reads over a certain
-	average Q-threshold. It then checks if it has at least
-	NR_OF_SEQUENCES_THRESHOLD sequences. If it doesnt, it lowers the
-	threshold by 1, and loops through the file again to append the file
-	with sequences of meeting this lower quality threshold. It also makes
+	average Q-threshold. The threshold starts at QUALITY_THRESHOLD_START
+	and is lowered by 1 until the files have at least
+	NR_OF_SEQUENCES_THRESHOLD sequences. It also makes
 	sure to only include a sequence in its out files if the corresponding
-	sequence in the other file also meets the quality threshold.
+	sequence in the other file also meets the quality threshold. The
+	formats and qualities are checked in one pass through the files, the
+	threshold is chosen from the nr of pairs per quality, and the pairs are
+	written in a second pass, in the same order as if the files had been
+	read once per threshold. Only the band of every pair and the hash of its
+	R1 header are kept in memory, see fastq_qc.calculate_quality_bands. If
+	selected_pairs is a list (or a fastq_sampler.RecordSample), the pairs
+	are appended to it as (record_R1, record_R2) tuples (see
+	read_selected_reads) in file order instead, and no files are written.
+	The GC and N content and the quality per position of the reads in and
+	out (see fastq_qc.ReadStatistics) are calculated in the same two passes
+	and printed. If read_statistics is a dictionary, their summaries are stored
+	in it, under 'in' and 'out', as a list with one per file.
 	'''
 
 	# Naming outfiles and initializing variables
-	pairchecked_f1 = "pairchecked_" + fastq_file_1
-	pairchecked_f2 = "pairchecked_" + fastq_file_2
+	pairchecked_f1 = "pairchecked_" + plain_fastq_name(fastq_file_1)
+	pairchecked_f2 = "pairchecked_" + plain_fastq_name(fastq_file_2)
 	quality_threshold = QUALITY_THRESHOLD_START
 	proper_formats = False
 	fin1_avg_quality = 0
@@ -40,158 +57,195 @@ def check_format_and_remove_low_quality_reads_pair(fastq_file_1, fastq_file_2):
 	fout2_avg_quality = 0
 	fout_avg_quality = 0
 	nr_of_seqs_fout = 0
-	nr_of_seqs_fin = 0
-	seq_ids = [] # A list of sequences stored in the outfiles
+	in_statistics = [ReadStatistics(phred_offset), ReadStatistics(phred_offset)]
+	out_statistics = [ReadStatistics(phred_offset), ReadStatistics(phred_offset)]
+
+	with (rereadable_fastq(fastq_file_1) as fastq_path_1, # Stdin is read twice
+		rereadable_fastq(fastq_file_2) as fastq_path_2):
+		try: # The formats are checked while calculating the qualities of the pairs
+			(bands, histogram, fin_qualities, nr_of_seqs_fin,
+				band_qualities) = calculate_quality_bands([fastq_path_1, fastq_path_2],
+															QUALITY_THRESHOLD_START,
+															phred_offset, in_statistics)
+			proper_formats = True
+		except FastqFormatError as error:
+			print(error)
+		except IOError:
+			print("You had an IOError.")
+
+		if proper_formats:
+			# Choosing the threshold and writing the pairs above it
+			(quality_threshold,
+				nr_of_seqs_fout) = choose_quality_threshold(histogram,
+															QUALITY_THRESHOLD_START,
+															NR_OF_SEQUENCES_THRESHOLD)
+			if selected_pairs is not None: # Kept in memory, for guesslib in the same process
+				selected_pairs.extend(read_selected_reads([fastq_path_1, fastq_path_2],
+															bands, quality_threshold,
+															out_statistics))
+			else:
+				write_selected_reads([fastq_path_1, fastq_path_2],
+									[pairchecked_f1, pairchecked_f2],
+									bands, quality_threshold, out_statistics)
+
+			if (nr_of_seqs_fout < NR_OF_SEQUENCES_THRESHOLD):
+				print(f'{fastq_file_1} and {fastq_file_2} only have {nr_of_seqs_fout} pairs.')
+
+			# Replacing the input files with the output files, not for compressed files or stdin
+			if (REPLACE_INPUT and selected_pairs is None
+				and pairchecked_f1 == "pairchecked_" + fastq_file_1
+				and pairchecked_f2 == "pairchecked_" + fastq_file_2):
+				subprocess.run(["mv", pairchecked_f1, fastq_file_1])
+				subprocess.run(["mv", pairchecked_f2, fastq_file_2])
+
+			# Calculating the average Q-values
+			if (nr_of_seqs_fout > 0):
+				fout1_avg_quality = sum(qualities[0] for band, qualities in band_qualities.items()
+										if band >= quality_threshold)
+				fout2_avg_quality = sum(qualities[1] for band, qualities in band_qualities.items()
+										if band >= quality_threshold)
+				fin1_avg_quality = fin_qualities[0] / nr_of_seqs_fin
+				fin2_avg_quality = fin_qualities[1] / nr_of_seqs_fin
+				fin_avg_quality = (fin1_avg_quality + fin2_avg_quality)/2
+				fout1_avg_quality = fout1_avg_quality / nr_of_seqs_fout
+				fout2_avg_quality = fout2_avg_quality / nr_of_seqs_fout
+				fout_avg_quality = (fout1_avg_quality + fout2_avg_quality)/2
+
+			print(f'All of the sequences in the out files '
+				f'have average qualities above {quality_threshold}.\n'
+				f'Average quality of {fastq_file_1}: {fin1_avg_quality}\n'
+				f'Average quality of corresponding outfile to f1: {fout1_avg_quality}\n'
+				f'Average quality of {fastq_file_2}: {fin2_avg_quality}\n'
+				f'Average quality of corresponding outfile to f2: {fout2_avg_quality}')
+
+			for name, statistics in (
+					(fastq_file_1, in_statistics[0]),
+					('The corresponding outfile to f1', out_statistics[0]),
+					(fastq_file_2, in_statistics[1]),
+					('The corresponding outfile to f2', out_statistics[1])):
+				print(read_statistics_report(name, statistics.summary()))
+			if read_statistics is not None:
+				read_statistics.update({'in': [statistics.summary() for statistics in in_statistics],
+										'out': [statistics.summary() for statistics in out_statistics]})
 
-	proper_format_f1 = proper_fastq_format(fastq_file_1) # Checking if f1 and f2 are
-	proper_format_f2 = proper_fastq_format(fastq_file_2) # proper formatted fastq files
+	return proper_formats, nr_of_seqs_fout, fout_avg_quality, fin_avg_quality
+
+
+def check_format_and_keep_top_pairs(fastq_file_1, fastq_file_2, nr_of_pairs=NR_OF_SEQUENCES_THRESHOLD,
+									phred_offset=PHRED_OFFSET, selected_pairs=None,
+									read_statistics=None):
+	'''
+	This function writes files with the nr_of_pairs pairs of the highest
+	quality, the lowest average Q-phred of the two sequences, in the order of
+	the input files, like check_format_and_remove_low_quality_reads_pair but
+	without a threshold: the files are read once, and only the best pairs so
+	far are kept in memory (see fastq_qc.select_top_reads). selected_pairs
+	and read_statistics are used like there, and it returns the same.
+	'''
 
-	if (proper_format_f1 and proper_format_f2):
+	# Naming outfiles and initializing variables
+	pairchecked_f1 = "pairchecked_" + plain_fastq_name(fastq_file_1)
+	pairchecked_f2 = "pairchecked_" + plain_fastq_name(fastq_file_2)
+	proper_formats = False
+	fin1_avg_quality = 0
+	fin2_avg_quality = 0
+	fin_avg_quality = 0
+	fout1_avg_quality = 0
+	fout2_avg_quality = 0
+	fout_avg_quality = 0
+	nr_of_seqs_fout = 0
+	in_statistics = [ReadStatistics(phred_offset), ReadStatistics(phred_offset)]
+	out_statistics = [ReadStatistics(phred_offset), ReadStatistics(phred_offset)]
+
+	try: # The formats are checked while selecting the pairs
+		selected, fin_qualities, nr_of_seqs_fin = select_top_reads([fastq_file_1, fastq_file_2],
+																	nr_of_pairs, phred_offset,
+																	in_statistics)
 		proper_formats = True
+	except FastqFormatError as error:
+		print(error)
+	except IOError:
+		print("You had an IOError.")
 
-		fout_1 = open(pairchecked_f1, "w+") # Initializing outfile 1
-		fout_1.close()
-		fout_2 = open(pairchecked_f2, "w+") # Initializing outfile 2
-		fout_2.close()
-
-		first_iteration = True
-		while (nr_of_seqs_fout < NR_OF_SEQUENCES_THRESHOLD):
-			with open(fastq_file_1) as fin_1, open(fastq_file_2) as fin_2:
-				counter = 0
-				for line in fin_1:
-					if (counter % 4 == 0): # Reading first line of seq in f1 and f2
-						first_line_f1 = line
-						first_line_f2 = fin_2.readline()
-					if (counter % 4 == 1): # Reading second line in f1 and f2
-						second_line_f1 = line
-						second_line_f2 = fin_2.readline()
-					if (counter % 4 == 2): # Reading third line in f1 and f2
-						third_line_f1 = line
-						third_line_f2 = fin_2.readline()
-					if (counter % 4 == 3): # Reading fourth line in f1 and f2
-						fourth_line_f1 = line
-						fourth_line_f2 = fin_2.readline()
-						if first_line_f1 not in seq_ids:  # Making sure we haven't added the seq already
-						# Calculating the quality of the sequences
-							phred_quality_f1 = calculate_phred_quality(fourth_line_f1)
-							phred_quality_f2 = calculate_phred_quality(fourth_line_f2)
-							if first_iteration:
-								# Calculating the average quality of the in file seqs
-								fin1_avg_quality += phred_quality_f1
-								fin2_avg_quality += phred_quality_f2
-								nr_of_seqs_fin += 1
-							if (phred_quality_f1 > quality_threshold and phred_quality_f2 > quality_threshold):
-								seq_ids.append(first_line_f1)
-								# Calculating the average quality of the out file seqs
-								fout1_avg_quality += phred_quality_f1
-								fout2_avg_quality += phred_quality_f2
-								nr_of_seqs_fout += 1
-								with open(pairchecked_f1, "a") as fout_1: # Appending
-									fout_1.write(first_line_f1)			# the sequence to
-									fout_1.write(second_line_f1)		# outfile 1
-									fout_1.write(third_line_f1)
-									fout_1.write(fourth_line_f1)
-								with open(pairchecked_f2, 'a') as fout_2: # Appending the
-									fout_2.write(first_line_f2)				# sequence to
-									fout_2.write(second_line_f2)			# outfile 2
-									fout_2.write(third_line_f2)
-									fout_2.write(fourth_line_f2)
-					
-					counter += 1 # Nr of lines read in file1 and file2
-			quality_threshold = quality_threshold - 1 # Lowering quality
-			first_iteration = False						# for next iteration
-
-		if REPLACE_INPUT: # Replacing the input files with the output files
+	if proper_formats:
+		pairs = [records for qualities, records in selected]
+		if selected_pairs is not None: # Kept in memory, for guesslib in the same process
+			selected_pairs.extend(pairs)
+		else:
+			write_records([pairchecked_f1, pairchecked_f2], pairs)
+		for i, statistics in enumerate(out_statistics):
+			statistics.add(records_read_batch([pair[i] for pair in pairs]))
+		nr_of_seqs_fout = len(selected)
+
+		if (nr_of_seqs_fout < nr_of_pairs):
+			print(f'{fastq_file_1} and {fastq_file_2} only have {nr_of_seqs_fout} pairs.')
+
+		# Replacing the input files with the output files, not for compressed files or stdin
+		if (REPLACE_INPUT and selected_pairs is None
+			and pairchecked_f1 == "pairchecked_" + fastq_file_1
+			and pairchecked_f2 == "pairchecked_" + fastq_file_2):
 			subprocess.run(["mv", pairchecked_f1, fastq_file_1])
 			subprocess.run(["mv", pairchecked_f2, fastq_file_2])
 
 		# Calculating the average Q-values
-		fin1_avg_quality = fin1_avg_quality / nr_of_seqs_fin
-		fin2_avg_quality = fin2_avg_quality / nr_of_seqs_fin
-		fin_avg_quality = (fin1_avg_quality + fin2_avg_quality)/2
-		fout1_avg_quality = fout1_avg_quality / nr_of_seqs_fout
-		fout2_avg_quality = fout2_avg_quality / nr_of_seqs_fout
-		fout_avg_quality = (fout1_avg_quality + fout2_avg_quality)/2
-
-		print(f'All of the sequences in the out files '
-			f'have average qualities above {quality_threshold}.\n'
+		if (nr_of_seqs_fout > 0):
+			fin1_avg_quality = fin_qualities[0] / nr_of_seqs_fin
+			fin2_avg_quality = fin_qualities[1] / nr_of_seqs_fin
+			fin_avg_quality = (fin1_avg_quality + fin2_avg_quality)/2
+			fout1_avg_quality = sum(qualities[0] for qualities, pair in selected) / nr_of_seqs_fout
+			fout2_avg_quality = sum(qualities[1] for qualities, pair in selected) / nr_of_seqs_fout
+			fout_avg_quality = (fout1_avg_quality + fout2_avg_quality)/2
+
+		print(f'The out files have the {nr_of_seqs_fout} pairs '
+			f'with the highest average qualities.\n'
 			f'Average quality of {fastq_file_1}: {fin1_avg_quality}\n'
 			f'Average quality of corresponding outfile to f1: {fout1_avg_quality}\n'
 			f'Average quality of {fastq_file_2}: {fin2_avg_quality}\n'
 			f'Average quality of corresponding outfile to f2: {fout2_avg_quality}')
+		for name, statistics in (
+				(fastq_file_1, in_statistics[0]),
+				('The corresponding outfile to f1', out_statistics[0]),
+				(fastq_file_2, in_statistics[1]),
+				('The corresponding outfile to f2', out_statistics[1])):
+			print(read_statistics_report(name, statistics.summary()))
+		if read_statistics is not None:
+			read_statistics.update({'in': [statistics.summary() for statistics in in_statistics],
+									'out': [statistics.summary() for statistics in out_statistics]})
 
 	return proper_formats, nr_of_seqs_fout, fout_avg_quality, fin_avg_quality
 
 
-def proper_fastq_format(fastq_file):
-	'''
-	This function returns True if the fastq file is properly formatted.
-	'''
-
-	fastq_format = False
-	fastq_decision = 0
-	counter = 0
-
-	try:
-		with open(fastq_file) as f_in:
-			try:
-				for line in f_in:
-					if (counter % 4 == 0): # Checking first line
-						if (line.startswith('@')):
-							fastq_decision += 1
-					if (counter % 4 == 1): # Checking second line
-						second_line = line
-						if all(c in 'ATGCNatgcn\n' for c in list(line)):
-							fastq_decision += 1
-					if (counter % 4 == 2): # Checking third line
-						if (line.startswith('+')):
-							fastq_decision += 1
-					if (counter % 4 == 3): # Checking fourth line
-						if (len(line) == len(second_line)):
-							fastq_decision += 1
-					counter += 1
-				if (fastq_decision == counter):
-					fastq_format = True
-
-			except UnicodeDecodeError:
-				fastq_format = False
-				print("You had a UnicodeDecodeError.")
-	except IOError:
-		fastq_format = False
-		print("You had an IOError.")
-
-	return fastq_format
-
-
-def calculate_phred_quality(phred_string):
-	'''
-	This function calculates the average Q-phred based on an ascii-string,
-	using the phred ascii-33 system.
-	'''
-
-	phred_char_list = list(phred_string)
-	phred_quality = 0
-
-	for i in range(len(phred_char_list)):
-		phred_quality = phred_quality + ord(phred_char_list[i])-33
-
-	phred_quality = phred_quality/len(phred_char_list)
-	
-	return phred_quality
-
-
 ###--------- MAIN ---------###
 
-def main():
+def main(argv=None, prog=None):
 
-	parser = argparse.ArgumentParser()
+	parser = argparse.ArgumentParser(prog=prog)
 	parser.add_argument("-f1", "--file_1", required=True, help="FASTQ file one")
 	parser.add_argument("-f2", "--file_2", required=True, help="corresponding FASTQ of paired sequences")
-	args = parser.parse_args()
-
-	(proper_formats, nr_of_seqs_fout, fout_avg_quality,
-		fin_avg_quality) = check_format_and_remove_low_quality_reads_pair(args.file_1,
-																			args.file_2)
+	parser.add_argument("-p", "--phred_offset", type=int, choices=[33, 64],
+						default=PHRED_OFFSET, help="ascii offset of the quality scores")
+	parser.add_argument("--statistics",
+						help="JSON file to write the statistics of the reads in and out to")
+	parser.add_argument("-k", "--top", type=int,
+						help="keep this nr of pairs of the highest quality, in one pass, "
+						"instead of lowering a quality threshold")
+	args = parser.parse_args(argv)
+
+	read_statistics = {}
+	if args.top is not None:
+		(proper_formats, nr_of_seqs_fout, fout_avg_quality,
+			fin_avg_quality) = check_format_and_keep_top_pairs(args.file_1, args.file_2, args.top,
+																args.phred_offset,
+																read_statistics=read_statistics)
+	else:
+		(proper_formats, nr_of_seqs_fout, fout_avg_quality,
+			fin_avg_quality) = check_format_and_remove_low_quality_reads_pair(args.file_1,
+																				args.file_2,
+																				args.phred_offset,
+																				read_statistics=read_statistics)
+	if (args.statistics and read_statistics):
+		with open(args.statistics, 'w') as f_out:
+			json.dump(read_statistics, f_out, indent=1)
 
 	print(f'The two input files are properly formatted: {proper_formats}\n'
 		f'The number of sequences in your subsetted files are: {nr_of_seqs_fout}')
@@ -1,5 +1,10 @@
 import argparse
+import json
 import subprocess
+from fastq_qc import (PHRED_OFFSET, FastqFormatError, ReadStatistics, calculate_quality_bands,
+	choose_quality_threshold, read_selected_reads, read_statistics_report, records_read_batch,
+	select_top_reads, write_records, write_selected_reads)
+from fastq_io import plain_fastq_name, rereadable_fastq
 
 ###--------- GLOBAL VARIABLES ---------###
 
@@ -17,142 +22,177 @@ REPLACE_INPUT = False
 
 ###--------- FUNCTIONS ---------###
 
-def proper_fastq_format(fastq_file):
+def check_format_and_remove_low_quality_reads_single(fastq_file, phred_offset=PHRED_OFFSET,
+														selected_reads=None, read_statistics=None):
 	'''
-	This function returns True if the fastq file is properly formatted.
-	'''
-
-	proper_fastq_format = False
-	fastq_decision = 0
-	counter = 0
-
-	try:
-		with open(fastq_file) as f_in:
-			try:
-				for line in f_in:
-					if (counter % 4 == 0): # Checking first line
-						if (line.startswith('@')):
-							fastq_decision += 1
-					if (counter % 4 == 1): # Checking second line
-						second_line = line
-						if all(c in 'ATGCNatgcn\n' for c in list(line)):
-							fastq_decision += 1
-					if (counter % 4 == 2): # Checking third line
-						if (line.startswith('+')):
-							fastq_decision += 1
-					if (counter % 4 == 3): # Checking fourth line
-						if (len(line) == len(second_line)):
-							fastq_decision += 1
-					counter += 1
-				if (fastq_decision == counter):
-					proper_fastq_format = True
-
-			except UnicodeDecodeError:
-				fastq_format = False
-				print("You had a UnicodeDecodeError.")
-	except IOError:
-		fastq_format = False
-		print("You had an IOError.")
-
-	return proper_fastq_format
-
-
-def calculate_phred_quality(phred_string):
-	'''
-	This function calculates the average Q-phred based on an ascii-string,
-	using the phred ascii-33 system.
+	This function writes a file with reads over a certain
+	average Q-threshold. The threshold starts at QUALITY_THRESHOLD_START
+	and is lowered by 1 until the file has at least
+	NR_OF_SEQUENCES_THRESHOLD sequences. The format and the quality of every
+	read are checked in one pass through the file, the threshold is chosen from
+	the nr of reads per quality, and the reads are written in a second
+	pass, in the same order as if the file had been read once per threshold.
+	If selected_reads is a list (or a fastq_sampler.RecordSample), the
+	records of the reads (used like tuples of their four lines) are appended
+	to it in file order instead, and no file is written. The GC and N content and the quality per position of the reads
+	in and out (see fastq_qc.ReadStatistics) are calculated in the same two
+	passes and printed. If read_statistics is a dictionary, their summaries
+	are stored in it, under 'in' and 'out'.
 	'''
 
-	phred_char_list = list(phred_string)
-	phred_quality = 0
+	quality_threshold = QUALITY_THRESHOLD_START
+	q_fastq_file = "singlechecked_" + plain_fastq_name(fastq_file)
+	nr_of_sequences_out = 0
+	fin_avg_quality = 0
+	fout_avg_quality = 0
 
-	for i in range(len(phred_char_list)):
-		phred_quality = phred_quality + ord(phred_char_list[i])-33
+	proper_format = False
+	in_statistics = ReadStatistics(phred_offset)
+	out_statistics = ReadStatistics(phred_offset)
+
+	with rereadable_fastq(fastq_file) as fastq_path: # Stdin is read twice
+		try: # The format is checked while calculating the qualities
+			(bands, histogram, fin_qualities, nr_of_seqs_fin,
+				band_qualities) = calculate_quality_bands([fastq_path],
+															QUALITY_THRESHOLD_START,
+															phred_offset, [in_statistics])
+			proper_format = True
+		except FastqFormatError as error:
+			print(error)
+		except IOError:
+			print("You had an IOError.")
+
+		if proper_format:
+			(quality_threshold,
+				nr_of_sequences_out) = choose_quality_threshold(histogram,
+																QUALITY_THRESHOLD_START,
+																NR_OF_SEQUENCES_THRESHOLD)
+			if selected_reads is not None: # Kept in memory, for guesslib in the same process
+				selected_reads.extend(record for record, in
+										read_selected_reads([fastq_path], bands,
+															quality_threshold,
+															[out_statistics]))
+			else:
+				write_selected_reads([fastq_path], [q_fastq_file], bands, quality_threshold,
+									[out_statistics])
+
+			if (nr_of_sequences_out < NR_OF_SEQUENCES_THRESHOLD):
+				print(f'{fastq_file} only has {nr_of_sequences_out} sequences.')
+
+			if (nr_of_sequences_out > 0):
+				fin_avg_quality = fin_qualities[0] / nr_of_seqs_fin
+				fout_avg_quality = sum(qualities[0] for band, qualities in band_qualities.items()
+										if band >= quality_threshold) / nr_of_sequences_out
+
+			if (REPLACE_INPUT and selected_reads is None
+				and q_fastq_file == "singlechecked_" + fastq_file):
+				subprocess.run(["mv", q_fastq_file, fastq_file]) # Not for compressed files or stdin
+
+			print(f'All of the sequences in the out file '
+				f'have an average quality above {quality_threshold}.\n'
+				+ read_statistics_report(fastq_file, in_statistics.summary()) + '\n'
+				+ read_statistics_report('The out file', out_statistics.summary()))
+			if read_statistics is not None:
+				read_statistics.update({'in': in_statistics.summary(),
+										'out': out_statistics.summary()})
 
-	phred_quality = phred_quality/len(phred_char_list)
-	
-	return phred_quality
+	return proper_format, nr_of_sequences_out, fout_avg_quality, fin_avg_quality
 
 
-def check_format_and_remove_low_quality_reads_single(fastq_file):
+def check_format_and_keep_top_reads_single(fastq_file, nr_of_reads=NR_OF_SEQUENCES_THRESHOLD,
+											phred_offset=PHRED_OFFSET, selected_reads=None,
+											read_statistics=None):
 	'''
-	This function writes a file with reads over a certain
-	average Q-threshold. It then checks if it has at least
-	NR_OF_SEQUENCES_THRESHOLD sequences. If it doesnt, it lowers the
-	threshold by 1, and loops through the file again to append the file
-	with sequences of meeting this lower quality threshold.
+	This function writes a file with the nr_of_reads reads of the highest
+	average Q-phred, in the order of the input file, like
+	check_format_and_remove_low_quality_reads_single but without a
+	threshold: the file is read once, and only the best reads so far are
+	kept in memory (see fastq_qc.select_top_reads). selected_reads and
+	read_statistics are used like there, and it returns the same.
 	'''
 
-	quality_threshold = QUALITY_THRESHOLD_START
-	q_fastq_file = "singlechecked_" + fastq_file
+	q_fastq_file = "singlechecked_" + plain_fastq_name(fastq_file)
 	nr_of_sequences_out = 0
 	fin_avg_quality = 0
 	fout_avg_quality = 0
-	nr_of_seqs_fin = 0
-	seq_ids = [] # A list of sequences stored in the outfiles
+	in_statistics = ReadStatistics(phred_offset)
+	out_statistics = ReadStatistics(phred_offset)
 
-	proper_format = proper_fastq_format(fastq_file)
+	proper_format = False
+
+	try: # The format is checked while selecting the reads
+		selected, fin_qualities, nr_of_seqs_fin = select_top_reads([fastq_file], nr_of_reads,
+																	phred_offset, [in_statistics])
+		proper_format = True
+	except FastqFormatError as error:
+		print(error)
+	except IOError:
+		print("You had an IOError.")
 
 	if proper_format:
-		f = open(q_fastq_file, "w+") # Initializing the outfile.
-		f.close()
-
-		first_iteration = True
-		while (nr_of_sequences_out < NR_OF_SEQUENCES_THRESHOLD):
-			with open(fastq_file) as f_in:
-				counter = 0
-				for line in f_in:
-					if (counter % 4 == 0): # Reading the first line of seq
-						first_line = line
-					if (counter % 4 == 1): # Reading the second line
-						second_line = line
-					if (counter % 4 == 2): # Reading the third line
-						third_line = line
-					if (counter % 4 == 3): # Reading th quality line
-						fourth_line = line
-						if (first_line not in seq_ids):
-							phred_quality = calculate_phred_quality(fourth_line)
-							if first_iteration:
-								# Calculating the avg quality, the first loop
-								fin_avg_quality += phred_quality
-								nr_of_seqs_fin += 1
-							if (phred_quality > quality_threshold):
-								seq_ids.append(first_line) # adding to seq_ids
-								fout_avg_quality += phred_quality
-								nr_of_sequences_out += 1
-								with open(q_fastq_file, "a") as f_out: 
-									f_out.write(first_line)
-									f_out.write(second_line)
-									f_out.write(third_line)
-									f_out.write(fourth_line)
-						
-					counter += 1 # Nr of lines read in the file
-			quality_threshold = quality_threshold - 1 # Reducing quality threshold for 
-			first_iteration = False 					# next iteration
-
-		fin_avg_quality = fin_avg_quality / nr_of_seqs_fin
-		fout_avg_quality = fout_avg_quality / nr_of_sequences_out
-
-		if REPLACE_INPUT:
-			subprocess.run(["mv", q_fastq_file, fastq_file])
-
-		print(f'All of the sequences in the out file '
-			f'have an average quality above {quality_threshold}.')
+		records = [records for qualities, records in selected]
+		if selected_reads is not None: # Kept in memory, for guesslib in the same process
+			selected_reads.extend(record for record, in records)
+		else:
+			write_records([q_fastq_file], records)
+		out_statistics.add(records_read_batch([record for record, in records]))
+		nr_of_sequences_out = len(selected)
+
+		if (nr_of_sequences_out < nr_of_reads):
+			print(f'{fastq_file} only has {nr_of_sequences_out} sequences.')
+
+		if (nr_of_sequences_out > 0):
+			fin_avg_quality = fin_qualities[0] / nr_of_seqs_fin
+			fout_avg_quality = (sum(qualities[0] for qualities, records in selected)
+								/ nr_of_sequences_out)
+
+		if (REPLACE_INPUT and selected_reads is None
+			and q_fastq_file == "singlechecked_" + fastq_file):
+			subprocess.run(["mv", q_fastq_file, fastq_file]) # Not for compressed files or stdin
+
+		print(f'The out file has the {nr_of_sequences_out} sequences '
+			f'with the highest average qualities.\n'
+			+ read_statistics_report(fastq_file, in_statistics.summary()) + '\n'
+			+ read_statistics_report('The out file', out_statistics.summary()))
+		if read_statistics is not None:
+			read_statistics.update({'in': in_statistics.summary(),
+									'out': out_statistics.summary()})
 
 	return proper_format, nr_of_sequences_out, fout_avg_quality, fin_avg_quality
 
 ###--------- MAIN ---------###
 
-def main():
+def main(argv=None, prog=None):
 
-	parser = argparse.ArgumentParser()
+	parser = argparse.ArgumentParser(prog=prog)
 	parser.add_argument("-f", "--file", help="FASTQ file")
-	args = parser.parse_args()
-
-	(proper_format,
-		nr_of_sequences_fout,
-		fout_avg_quality,
-		fin_avg_quality) = check_format_and_remove_low_quality_reads_single(args.file)
+	parser.add_argument("-p", "--phred_offset", type=int, choices=[33, 64],
+						default=PHRED_OFFSET, help="ascii offset of the quality scores")
+	parser.add_argument("--statistics",
+						help="JSON file to write the statistics of the reads in and out to")
+	parser.add_argument("-k", "--top", type=int,
+						help="keep this nr of reads of the highest quality, in one pass, "
+						"instead of lowering a quality threshold")
+	args = parser.parse_args(argv)
+
+	read_statistics = {}
+	if args.top is not None:
+		(proper_format,
+			nr_of_sequences_fout,
+			fout_avg_quality,
+			fin_avg_quality) = check_format_and_keep_top_reads_single(args.file, args.top,
+																		args.phred_offset,
+																		read_statistics=read_statistics)
+	else:
+		(proper_format,
+			nr_of_sequences_fout,
+			fout_avg_quality,
+			fin_avg_quality) = check_format_and_remove_low_quality_reads_single(args.file,
+																				args.phred_offset,
+																				read_statistics=read_statistics)
+	if (args.statistics and read_statistics):
+		with open(args.statistics, 'w') as f_out:
+			json.dump(read_statistics, f_out, indent=1)
 	
 	print(f'The input file was in proper fastq format: {proper_format}\n'
 		f'It contains {nr_of_sequences_fout} nr of sequences '
@@ -0,0 +1,601 @@
+import gzip
+import logging
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from itertools import islice
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The logger of this module, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# The index of a fastq file, from read id to byte offset, is stored next to
+# it in a file with this suffix, and reused as long as the fastq is unchanged.
+FASTQ_INDEX_SUFFIX = '.idx'
+
+# Files with these suffixes are gzip (or bgzip) compressed, and are
+# decompressed while they are read.
+COMPRESSED_SUFFIXES = ('.gz', '.bgz')
+
+# Multi-threaded decompressors that are used, in this order, if they are
+# installed. Otherwise the files are decompressed by python's gzip module.
+PARALLEL_DECOMPRESSORS = [
+	['pigz', '--decompress', '--stdout', '--processes', '{threads}'],
+	['bgzip', '--decompress', '--stdout', '--threads', '{threads}']
+]
+
+# Specify how many threads the decompressors may use.
+DECOMPRESSION_THREADS = 4
+
+# The nr of records per chunk of read_fastq_chunks, by default.
+FASTQ_CHUNK_SIZE = 10000
+
+# The newlines of a memory mapped fastq file are searched for in windows of at
+# least this many bytes, see mapped_fastq_chunks.
+MAPPED_WINDOW_SIZE = 1 << 20
+
+###--------- FUNCTIONS ---------###
+
+def is_compressed(fastq_file):
+	'''
+	Returns True if the fastq file is gzip or bgzip compressed.
+	'''
+
+	return fastq_file.endswith(COMPRESSED_SUFFIXES)
+
+
+def plain_fastq_name(fastq_file):
+	'''
+	Returns the name of the fastq file without its compression suffix, or
+	'stdin.fastq' for '-'. Used to name the files written from it.
+	'''
+
+	if (fastq_file == '-'):
+		return 'stdin.fastq'
+	for suffix in COMPRESSED_SUFFIXES:
+		if fastq_file.endswith(suffix):
+			return fastq_file[:-len(suffix)]
+
+	return fastq_file
+
+
+class DecompressorStream:
+	'''
+	The output of a decompressor process, read like a binary file. Closing
+	it stops the process.
+	'''
+
+	def __init__(self, command):
+		self.process = subprocess.Popen(command, stdout=subprocess.PIPE,
+										stderr=subprocess.DEVNULL)
+		self.stdout = self.process.stdout
+
+	def __getattr__(self, name):
+		return getattr(self.stdout, name)
+
+	def __iter__(self):
+		return iter(self.stdout)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def close(self):
+		if self.stdout.closed:
+			return
+		stopped = bool(self.stdout.read(1)) # There is output left, it was not read to the end
+		self.stdout.close()
+		if stopped:
+			self.process.terminate()
+			self.process.wait()
+		elif (self.process.wait() != 0): # Not caused by the close, e.g. a truncated file
+			raise IOError(f'{self.process.args[-1]} could not be decompressed.')
+
+
+def open_fastq(fastq_file):
+	'''
+	Opens a fastq file for reading, in binary mode.
+	Gzip and bgzip compressed files are decompressed while they are read,
+	with a multi-threaded decompressor if one is installed, and '-' reads
+	from stdin.
+	'''
+
+	if (fastq_file == '-'):
+		f_in = sys.stdin.buffer
+	elif is_compressed(fastq_file):
+		f_in = None
+		for decompressor in PARALLEL_DECOMPRESSORS:
+			if shutil.which(decompressor[0]):
+				f_in = DecompressorStream([argument.format(threads=DECOMPRESSION_THREADS)
+											for argument in decompressor] + [fastq_file])
+				break
+		if f_in is None:
+			f_in = gzip.open(fastq_file, 'rb')
+	else:
+		f_in = open(fastq_file, 'rb')
+
+	return f_in
+
+
+@contextmanager
+def rereadable_fastq(fastq_file):
+	'''
+	Context manager that gives a fastq file name that can be opened more
+	than once with open_fastq. Only stdin needs to be copied to a temporary
+	file for that, compressed files are decompressed again.
+	'''
+
+	if (fastq_file != '-'):
+		yield fastq_file
+		return
+
+	with tempfile.NamedTemporaryFile(suffix='.fastq') as f_out:
+		shutil.copyfileobj(sys.stdin.buffer, f_out)
+		f_out.flush()
+		yield f_out.name
+
+
+def map_fastq(fastq_file):
+	'''
+	Returns a read-only memory map of a plain fastq file, which can also be
+	read like a binary file (readline, seek and tell), or None if the file
+	can't be mapped: stdin, compressed files and empty files.
+	'''
+
+	if (fastq_file == '-' or is_compressed(fastq_file) or not os.path.isfile(fastq_file)
+		or os.path.getsize(fastq_file) == 0):
+		return None
+
+	with open(fastq_file, 'rb') as f_in: # The map stays valid when the file is closed
+		return mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class FastqChunk:
+	'''
+	Consecutive records of a fastq file, as the byte offsets of their lines in
+	a buffer (a uint8 array of a memory mapped file, or of the joined lines
+	of a stream) instead of one bytes object per line. starts and ends have
+	four entries per record: the start of every line and the end of its
+	content, where its newline is (or the '\r' of a CRLF newline, crlf is
+	True if there are any). The missing lines of a truncated last record
+	are empty lines at the end of the buffer, nr_of_lines counts the lines
+	that were read.
+	'''
+
+	__slots__ = ('buffer', 'starts', 'ends', 'nr_of_lines', 'crlf')
+
+	def __init__(self, buffer, starts, ends, nr_of_lines, crlf=False):
+		self.buffer = buffer
+		self.starts = starts
+		self.ends = ends
+		self.nr_of_lines = nr_of_lines
+		self.crlf = crlf
+
+	def __len__(self):
+		return len(self.starts) // 4
+
+	def line_starts(self, line):
+		'''
+		Returns the offsets of line (0 the header, 1 the sequence, 2 the '+'
+		and 3 the quality line) of every record.
+		'''
+
+		return self.starts[line::4]
+
+	def line_ends(self, line):
+		'''
+		Returns the offsets of the ends of line of every record.
+		'''
+
+		return self.ends[line::4]
+
+	def lines(self, line, records=None):
+		'''
+		Returns a list with line of every record as bytes, without its newline,
+		or of the records (an array of record nrs) only.
+		'''
+
+		starts, ends = self.starts[line::4], self.ends[line::4]
+		if records is not None:
+			starts, ends = starts[records], ends[records]
+		if (len(starts) == 0):
+			return []
+
+		# One copy of the part of the buffer with the lines, sliced as bytes
+		first = int(starts[0])
+		data = self.buffer[first:ends[-1]].tobytes()
+		return [data[start:end] for start, end
+				in zip((starts - first).tolist(), (ends - first).tolist())]
+
+	def first_bytes(self, line):
+		'''
+		Returns an array with the first byte of line of every record, 0 for
+		empty lines.
+		'''
+
+		import numpy as np
+
+		starts = self.starts[line::4]
+		non_empty = (self.ends[line::4] > starts)
+		first_bytes = np.zeros(len(starts), dtype=np.uint8)
+		first_bytes[non_empty] = self.buffer[starts[non_empty]]
+
+		return first_bytes
+
+	def line_bytes(self, i):
+		'''
+		Returns line i (from zero) of the chunk as bytes, with a '\n' newline,
+		or b'' for the missing lines of a truncated last record.
+		'''
+
+		if (i >= self.nr_of_lines):
+			return b''
+
+		return self.buffer[self.starts[i]:self.ends[i]].tobytes() + b'\n'
+
+	def records_bytes(self, first, last):
+		'''
+		Returns the records first up to last of the chunk as they are in the
+		file, as a view of the buffer. If the last line of the file has no
+		newline, or the chunk has CRLF newlines, a copy with '\n' newlines is
+		returned instead, so the records can be written before other ones.
+		'''
+
+		if self.crlf:
+			import numpy as np
+			return np.frombuffer(b''.join(map(self.line_bytes, range(4 * first, 4 * last))),
+								dtype=np.uint8)
+
+		start, end = self.starts[4 * first], self.ends[4 * last - 1] + 1
+		if (end > len(self.buffer) and 4 * last <= self.nr_of_lines):
+			import numpy as np
+			return np.append(self.buffer[start:], np.uint8(ord('\n')))
+
+		return self.buffer[start:end]
+
+	def record(self, nr):
+		'''
+		Returns a FastqRecord view of record nr (from zero) of the chunk.
+		'''
+
+		return FastqRecord(self, nr)
+
+
+class FastqRecord:
+	'''
+	A view of record nr of a FastqChunk, which is used like the tuple of its
+	four lines that read_fastq_record returns: record[1] is its sequence
+	line, with a '\n' newline. A line is only copied out of the buffer when
+	it is used.
+	'''
+
+	__slots__ = ('chunk', 'nr')
+
+	def __init__(self, chunk, nr):
+		self.chunk = chunk
+		self.nr = nr
+
+	def __getitem__(self, line):
+		if not 0 <= line < 4:
+			raise IndexError('a fastq record has four lines')
+
+		return self.chunk.line_bytes(4 * self.nr + line)
+
+	def __len__(self):
+		return 4
+
+	def __iter__(self):
+		return (self[line] for line in range(4))
+
+	def tobytes(self):
+		'''
+		Returns the record as it is in the file.
+		'''
+
+		return self.chunk.records_bytes(self.nr, self.nr + 1).tobytes()
+
+
+def strip_carriage_returns(buffer, starts, ends):
+	'''
+	Returns the ends of the lines of a buffer without the '\r' of CRLF
+	newlines (or at the end of a last line without newline), like the
+	universal newlines of a file opened in text mode, and True if there were
+	any.
+	'''
+
+	import numpy as np
+
+	if (len(buffer) == 0):
+		return ends, False
+
+	carriage_returns = (ends > starts) & (buffer[np.maximum(ends - 1, 0)] == ord('\r'))
+	if not carriage_returns.any():
+		return ends, False
+
+	return ends - carriage_returns, True
+
+
+def chunk_from_lines(lines):
+	'''
+	Returns a FastqChunk of the lines (bytes, with their newlines) of a
+	stream, by joining them into its buffer.
+	'''
+
+	import numpy as np
+
+	nr_of_lines = len(lines)
+	lines = lines + [b''] * (-nr_of_lines % 4)
+	lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+	newlines = np.fromiter((line.endswith(b'\n') for line in lines), dtype=np.int64,
+							count=len(lines))
+	starts = np.cumsum(lengths) - lengths
+	buffer = np.frombuffer(b''.join(lines), dtype=np.uint8)
+	ends, crlf = strip_carriage_returns(buffer, starts, starts + lengths - newlines)
+
+	return FastqChunk(buffer, starts, ends, nr_of_lines, crlf)
+
+
+def mapped_fastq_chunks(mapped, chunk_size=FASTQ_CHUNK_SIZE):
+	'''
+	Generator that yields the records of a memory mapped fastq file (see
+	map_fastq) chunk_size at a time, as FastqChunks of the whole map. Only
+	the newlines are searched for, in windows of at least MAPPED_WINDOW_SIZE
+	bytes, no line is copied.
+	'''
+
+	import numpy as np # Not at the top, so that the help of the scripts doesn't wait for it
+
+	buffer = np.frombuffer(mapped, dtype=np.uint8)
+	size = len(buffer)
+	nr_of_lines = 4 * chunk_size
+	window = MAPPED_WINDOW_SIZE
+	position = 0
+
+	while (position < size):
+		end = min(position + window, size)
+		newlines = np.flatnonzero(buffer[position:end] == ord('\n'))
+		if (len(newlines) < nr_of_lines and end < size):
+			window *= 2 # Not enough lines in the window
+			continue
+
+		ends = newlines[:nr_of_lines] + position
+		if (len(ends) < nr_of_lines and buffer[size - 1] != ord('\n')):
+			ends = np.append(ends, size) # The last line has no newline
+		starts = np.concatenate(([position], ends[:-1] + 1))
+		position = int(ends[-1]) + 1
+		nr_of_chunk_lines = len(ends)
+		ends, crlf = strip_carriage_returns(buffer, starts, ends)
+
+		missing = np.full(-nr_of_chunk_lines % 4, size, dtype=np.int64)
+		yield FastqChunk(buffer, np.append(starts, missing), np.append(ends, missing),
+						nr_of_chunk_lines, crlf)
+
+
+def read_fastq_chunks(fastq_file, chunk_size=FASTQ_CHUNK_SIZE):
+	'''
+	Generator that reads a fastq file chunk_size records at a time and yields
+	them as FastqChunks. Plain files are memory mapped, see
+	mapped_fastq_chunks, compressed files and stdin are read line by line.
+	The map is closed when the last FastqChunk and FastqRecord of it are gone.
+	'''
+
+	mapped = map_fastq(fastq_file)
+	if mapped is not None:
+		mapped.madvise(mmap.MADV_SEQUENTIAL)
+		yield from mapped_fastq_chunks(mapped, chunk_size)
+		return
+
+	with open_fastq(fastq_file) as f_in:
+		while True:
+			lines = list(islice(f_in, 4 * chunk_size))
+			if not lines:
+				return
+			yield chunk_from_lines(lines)
+
+
+def read_fastq_records(fastq_file, chunk_size=FASTQ_CHUNK_SIZE):
+	'''
+	Generator that yields the records of a fastq file as FastqRecords, read
+	chunk_size at a time, see read_fastq_chunks. Stops at a truncated record,
+	like read_fastq_record.
+	'''
+
+	for chunk in read_fastq_chunks(fastq_file, chunk_size):
+		yield from map(chunk.record, range(chunk.nr_of_lines // 4))
+
+
+def read_fastq_record(f_in):
+	'''
+	Reads the record at the current position of a binary fastq file and
+	returns its four lines, or None at the end of the file (or at a
+	truncated record).
+	'''
+
+	record = (f_in.readline(), f_in.readline(), f_in.readline(), f_in.readline())
+	if not record[3]:
+		return None
+
+	return record
+
+
+def record_id(record):
+	'''
+	Returns the seq_id of a record, the first word of the header without
+	the '@'.
+	'''
+
+	return record[0][1:].split()[0].decode()
+
+
+def record_sequence(record):
+	'''
+	Returns the sequence of a record.
+	'''
+
+	return record[1].strip().decode()
+
+
+def build_fastq_index(fastq_file):
+	'''
+	Reads the (plain) fastq file once and returns a dictionary from the
+	seq_id of every record to the byte offset of its header line.
+	'''
+
+	index = {}
+
+	for chunk in read_fastq_chunks(fastq_file): # Memory mapped, the offsets are in the file
+		for header, offset in zip(chunk.lines(0), chunk.line_starts(0).tolist()):
+			index.setdefault(header[1:].split()[0].decode(), offset)
+
+	return index
+
+
+def load_fastq_index(fastq_file):
+	'''
+	Returns the index of the fastq file, see build_fastq_index. The index is
+	read from its sidecar file if that was written for the current version
+	of the fastq file, otherwise it is built and the sidecar is (re)written.
+	'''
+
+	index_file = fastq_file + FASTQ_INDEX_SUFFIX
+	fastq_stat = os.stat(fastq_file)
+	fastq_version = f'#{fastq_stat.st_size}\t{fastq_stat.st_mtime_ns}\n'
+
+	try:
+		with open(index_file) as f_in:
+			if (f_in.readline() == fastq_version):
+				index = {}
+				for line in f_in:
+					seq_id, offset = line.rsplit('\t', 1)
+					index[seq_id] = int(offset)
+				return index
+	except (IOError, ValueError):
+		pass
+
+	logger.info('Indexing %s.', fastq_file)
+	index = build_fastq_index(fastq_file)
+
+	try:
+		with open(index_file, 'w') as f_out:
+			f_out.write(fastq_version)
+			for seq_id, offset in index.items():
+				f_out.write(f'{seq_id}\t{offset}\n')
+	except IOError: # The index is still used, just not saved
+		logger.warning('Could not write the index %s.', index_file)
+
+	return index
+
+
+class MateReader:
+	'''
+	Looks up the records of a fastq file (R2) by the seq_id and record
+	number of their mates in another fastq file (R1). While the two files are
+	in the same order the R2 file is read in lockstep with the lookups. The
+	first time the ids don't match, the R2 file is indexed (see
+	load_fastq_index) and every later lookup is a single seek in its memory
+	map. Compressed files can't be seeked in, so their records are then kept
+	in memory instead. Stdin can't be read again either, and the records
+	before the mismatch are already gone, so an R2 on stdin must be in the
+	order of R1: a ValueError is raised at the first mismatch.
+	'''
+
+	def __init__(self, fastq_file):
+		self.fastq_file = fastq_file
+		self.reader = read_fastq_records(fastq_file) # In lockstep
+		self.f_in = None # Seeked in, once the file is indexed
+		self.record_nr = 0 # The record number of the next record in lockstep
+		self.index = None
+		self.records = None
+
+	def read_record(self):
+		'''
+		Reads the record at the current position, returns (seq_id, record),
+		or None at the end of the file.
+		'''
+
+		record = next(self.reader, None)
+		if record is None:
+			return None
+
+		return (record_id(record), record)
+
+	def read_records(self):
+		'''
+		Reads the rest of the file into a dictionary from seq_id to record.
+		'''
+
+		records = {}
+		record = self.read_record()
+		while record is not None:
+			records.setdefault(*record)
+			record = self.read_record()
+
+		return records
+
+	def find_record(self, seq_id, record_nr):
+		'''
+		Returns the record with the id seq_id, which is expected to be the
+		record number record_nr (from zero), or None if there is no such
+		record in the file.
+		'''
+
+		if (self.index is None and self.records is None):
+			record = None
+			while (self.record_nr <= record_nr): # Skipping forward in lockstep
+				record = self.read_record()
+				self.record_nr += 1
+				if record is None:
+					break
+			if (record is not None and record[0] == seq_id):
+				return record[1]
+
+			if (self.fastq_file == '-' and record is not None):
+				raise ValueError(f'R2 on stdin must be in the order of R1, record {self.record_nr} '
+								f'is {record[0]} instead of {seq_id}.')
+			logger.warning('%s is not in the same order as its mate file.', self.fastq_file)
+			if (self.fastq_file == '-'): # Ended before R1
+				self.records = {}
+			elif is_compressed(self.fastq_file):
+				self.reader.close()
+				self.reader = read_fastq_records(self.fastq_file)
+				self.records = self.read_records()
+			else:
+				self.index = load_fastq_index(self.fastq_file)
+				self.f_in = map_fastq(self.fastq_file) or open_fastq(self.fastq_file)
+
+		if self.records is not None:
+			return self.records.get(seq_id)
+
+		offset = self.index.get(seq_id)
+		if offset is None:
+			return None
+		self.f_in.seek(offset)
+
+		return read_fastq_record(self.f_in)
+
+	def find(self, seq_id, record_nr):
+		'''
+		Returns the sequence of the record found by find_record, or None.
+		'''
+
+		record = self.find_record(seq_id, record_nr)
+		if record is None:
+			return None
+
+		return record_sequence(record)
+
+	def close(self):
+		'''
+		Closes the fastq file.
+		'''
+
+		self.reader.close()
+		if self.f_in is not None:
+			self.f_in.close()
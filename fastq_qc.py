@@ -0,0 +1,859 @@
+import heapq
+import shutil
+import tempfile
+from array import array
+from contextlib import ExitStack, closing
+from itertools import zip_longest
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from fastq_io import read_fastq_chunks
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The ascii offset of the quality strings, 33 for phred+33 (Sanger, Illumina
+# 1.8+) and 64 for phred+64 (older Illumina).
+PHRED_OFFSET = 33
+
+# The nr of records that are read, checked and scored together.
+QUALITY_CHUNK_SIZE = 10000
+
+# The nr of records that are read, checked and scored together when the checked
+# reads are streamed, see stream_checked_reads. Kept small, so that the files are
+# read little further than the reads that are used.
+STREAM_CHUNK_SIZE = 256
+
+# The fixed quality threshold of the streamed reads, see stream_checked_reads.
+STREAM_QUALITY_THRESHOLD = 30
+
+# The characters allowed in the sequence lines.
+VALID_SEQUENCE_CHARS = b'ATGCNatgcn\n'
+
+# The bases that are counted in the read statistics, see ReadStatistics.
+BASES = 'ACGTN'
+
+# A bytes.translate table from every byte to 1 if it is not in VALID_SEQUENCE_CHARS, else 0
+INVALID_SEQUENCE_BYTES = bytes(0 if byte in VALID_SEQUENCE_CHARS else 1 for byte in range(256))
+
+# The size of the write buffers of the out files.
+WRITE_BUFFER_SIZE = 1 << 23
+
+# Reads of a lower band than the first one are held in memory up to this
+# size before they are spooled to a temporary file.
+SPOOL_SIZE = 1 << 24
+
+# The reads of a ReadBatch are padded to the longest one for the statistics
+# per position only if that takes at most this many times the size of the
+# reads, see ReadBatch.rows.
+MAX_PADDING = 2
+
+# The band of a read that is never written, see calculate_quality_bands. The
+# bands are kept in one byte per read.
+NOT_SELECTED = -128
+
+###--------- FUNCTIONS ---------###
+
+class FastqFormatError(ValueError):
+	'''
+	Raised when a fastq file is not properly formatted. The line_nr (from 1)
+	is the first line of the first malformed record.
+	'''
+
+	def __init__(self, fastq_file, line_nr, reason):
+		super().__init__(f'{fastq_file} is not a proper fastq file, '
+						f'the record on line {line_nr} {reason}.')
+		self.fastq_file = fastq_file
+		self.line_nr = line_nr
+		self.reason = reason
+
+
+def reduce_spans(ufunc, buffer, starts, ends, dtype=None):
+	'''
+	Returns an array with ufunc (like np.add) reduced over every
+	span buffer[start:end], in one call of its reduceat. The spans are in
+	order and none of them is empty.
+	'''
+
+	first = starts[0]
+	bounds = np.empty(2 * len(starts) - 1, dtype=np.int64)
+	bounds[0::2] = starts - first
+	bounds[1::2] = ends[:-1] - first
+
+	# The last span runs to the end of the part of the buffer with the spans
+	return ufunc.reduceat(buffer[first:ends[-1]], bounds, dtype=dtype)[0::2]
+
+
+def span_phred_qualities(buffer, starts, ends, phred_offset=PHRED_OFFSET):
+	'''
+	Calculates the average Q-phred of the ascii quality strings
+	buffer[start:end] of a uint8 buffer at once. Returns an array with the
+	value of each string, nan for empty strings.
+	'''
+
+	lengths = ends - starts
+	non_empty = (lengths > 0)
+
+	mean = np.full(len(lengths), np.nan)
+	if non_empty.any():
+		sums = reduce_spans(np.add, buffer, starts[non_empty], ends[non_empty], np.int64)
+		mean[non_empty] = (sums - phred_offset * lengths[non_empty]) / lengths[non_empty]
+
+	return mean
+
+
+def chunk_phred_qualities(chunk, phred_offset=PHRED_OFFSET):
+	'''
+	Calculates the average Q-phred of the quality lines of a FastqChunk (see
+	fastq_io.read_fastq_chunks) in its buffer, see span_phred_qualities.
+	'''
+
+	return span_phred_qualities(chunk.buffer, chunk.line_starts(3), chunk.line_ends(3),
+								phred_offset)
+
+
+class ReadBatch:
+	'''
+	The sequences and quality strings of N reads, each joined into one uint8
+	array without newlines, and the lengths of the reads. Statistics per read
+	are then calculated from the offsets of the reads (see reduce_spans), and
+	statistics per position sums over the columns of the reads padded to the
+	longest one (see rows), or bincounts over the position of every base if
+	the padding would take too much memory, without python code per read. The
+	quality strings have the lengths of the sequences, which the format check
+	makes sure of.
+	'''
+
+	__slots__ = ('sequences', 'qualities', 'lengths', 'starts')
+
+	def __init__(self, sequences, qualities, lengths):
+		self.sequences = sequences
+		self.qualities = qualities
+		self.lengths = lengths
+		self.starts = np.cumsum(lengths) - lengths
+
+	def __len__(self):
+		return len(self.lengths)
+
+	def positions(self):
+		'''
+		Returns an array with the position (from zero) of every base in its read.
+		'''
+
+		return np.arange(len(self.sequences)) - np.repeat(self.starts, self.lengths)
+
+	def rows(self, values):
+		'''
+		Returns values (an array with a value per base) as an array with one
+		row per read, padded with zeros to the longest read, or None if that
+		takes more than MAX_PADDING times the size of values (if some reads
+		are much longer than the others).
+		'''
+
+		width = int(self.lengths.max(initial=0))
+		if (len(self.lengths) * width > MAX_PADDING * len(values)):
+			return None
+		if np.all(self.lengths == width): # No padding
+			return values.reshape(len(self.lengths), width)
+
+		# The row of a read runs on into the next reads, these values are zeroed
+		rows = sliding_window_view(np.concatenate([values, np.zeros(width, dtype=values.dtype)]),
+									width)[self.starts]
+		rows *= (np.arange(width) < self.lengths[:, None])
+		return rows
+
+	def mean_phred_qualities(self, phred_offset=PHRED_OFFSET):
+		'''
+		Returns an array with the average Q-phred of every read, like
+		span_phred_qualities: nan for empty reads.
+		'''
+
+		return span_phred_qualities(self.qualities, self.starts, self.starts + self.lengths,
+									phred_offset)
+
+
+def read_batch(chunk, records=None):
+	'''
+	Returns a ReadBatch of the reads of a checked FastqChunk (see
+	fastq_io.read_fastq_chunks), or of the records (an array of record nrs)
+	of it only.
+	'''
+
+	lengths = chunk.line_ends(1) - chunk.line_starts(1)
+	if records is not None:
+		lengths = lengths[records]
+
+	return ReadBatch(joined_lines(chunk.lines(1, records)), joined_lines(chunk.lines(3, records)),
+						lengths)
+
+
+def joined_lines(lines):
+	'''
+	Returns a uint8 array with the lines (bytes) joined.
+	'''
+
+	return np.frombuffer(b''.join(lines), dtype=np.uint8)
+
+
+class ReadStatistics:
+	'''
+	Sums up the statistics of the reads of a fastq file, one ReadBatch at a
+	time: the nr of reads and bases, the nr of every base of BASES (in upper
+	or lower case), the nr of reads with an N, and the summed quality and the
+	nr of reads at every position.
+	'''
+
+	def __init__(self, phred_offset=PHRED_OFFSET):
+		self.phred_offset = phred_offset
+		self.nr_of_reads = 0
+		self.nr_of_bases = 0
+		self.base_counts = dict.fromkeys(BASES, 0)
+		self.nr_of_reads_with_n = 0
+		self.position_qualities = np.zeros(0, dtype=np.int64)
+		self.position_counts = np.zeros(0, dtype=np.int64)
+
+	def add(self, batch):
+		'''
+		Adds the reads of a ReadBatch.
+		'''
+
+		width = int(batch.lengths.max(initial=0))
+		if (width > len(self.position_qualities)):
+			self.position_qualities = np.pad(self.position_qualities,
+												(0, width - len(self.position_qualities)))
+			self.position_counts = np.pad(self.position_counts,
+											(0, width - len(self.position_counts)))
+
+		self.nr_of_reads += len(batch)
+		self.nr_of_bases += len(batch.sequences)
+
+		lower_case = batch.sequences | 0x20
+		for base in BASES:
+			self.base_counts[base] += int(np.count_nonzero(lower_case == ord(base.lower())))
+		n_bases = np.flatnonzero(lower_case == ord('n'))
+		self.nr_of_reads_with_n += len(np.unique(np.searchsorted(batch.starts + batch.lengths,
+																n_bases, side='right')))
+
+		# The padding zeros add nothing to the sums, the quality sums of the
+		# bincount are exact in float64, and the nr of reads at a position is
+		# the nr of reads that are longer
+		quality_rows = batch.rows(batch.qualities)
+		if quality_rows is not None:
+			self.position_qualities[:width] += quality_rows.sum(axis=0, dtype=np.int64)
+		else:
+			self.position_qualities[:width] += np.bincount(batch.positions(),
+															weights=batch.qualities,
+															minlength=width).astype(np.int64)
+		self.position_counts[:width] += (len(batch) - np.cumsum(np.bincount(batch.lengths,
+																		minlength=width + 1))[:width])
+
+	def summary(self):
+		'''
+		Returns a dictionary with the nr of reads and bases, the fraction of
+		the bases that is every base, the GC content, the fraction of the bases
+		that is N, the fraction of the reads with an N and the average Q-phred
+		at every position of the reads.
+		'''
+
+		composition = {base: count / max(self.nr_of_bases, 1)
+						for base, count in self.base_counts.items()}
+
+		return {'nr_of_reads': self.nr_of_reads, 'nr_of_bases': self.nr_of_bases,
+				'base_composition': composition,
+				'gc_content': composition['G'] + composition['C'],
+				'n_content': composition['N'],
+				'reads_with_n': self.nr_of_reads_with_n / max(self.nr_of_reads, 1),
+				'position_qualities': ((self.position_qualities
+										- self.phred_offset * self.position_counts)
+										/ self.position_counts).tolist()}
+
+
+def read_statistics_report(name, summary):
+	'''
+	Returns a line with the main statistics of the reads of name, from the
+	summary of their ReadStatistics.
+	'''
+
+	report = (f'{name}: GC content {summary["gc_content"]:.3f}, '
+				f'N content {summary["n_content"]:.4f} '
+				f'({summary["reads_with_n"]:.3f} of the reads have an N)')
+	if summary['position_qualities']:
+		report += (f', Q = {summary["position_qualities"][0]:.1f} at the first and '
+					f'{summary["position_qualities"][-1]:.1f} at the last position')
+
+	return report + '.'
+
+
+def find_malformed_record(chunk):
+	'''
+	Checks a FastqChunk, see fastq_io.read_fastq_chunks. Returns the index of
+	the first record that is not properly formatted and the reason, or None
+	if all of them are. The whole chunk is checked with a few array
+	operations on its buffer, without copying its lines.
+	'''
+
+	nr_of_records = len(chunk)
+	malformed = [] # The first malformed record of each check
+
+	if (chunk.nr_of_lines < 4 * nr_of_records): # Only the last record can be missing lines
+		malformed.append((nr_of_records - 1, "is truncated"))
+
+	header_bytes = chunk.first_bytes(0)
+	if np.any(header_bytes != ord('@')):
+		malformed.append((int(np.argmax(header_bytes != ord('@'))),
+							"doesn't start with '@'"))
+
+	plus_bytes = chunk.first_bytes(2)
+	if np.any(plus_bytes != ord('+')):
+		malformed.append((int(np.argmax(plus_bytes != ord('+'))),
+							"doesn't have a '+' line"))
+
+	seq_starts, seq_ends = chunk.line_starts(1), chunk.line_ends(1)
+	seq_lengths = seq_ends - seq_starts
+	non_empty = (seq_lengths > 0)
+	if non_empty.any():
+		first, last = seq_starts[non_empty][0], seq_ends[non_empty][-1]
+		invalid_bytes = np.frombuffer(chunk.buffer[first:last].tobytes()
+										.translate(INVALID_SEQUENCE_BYTES), dtype=np.uint8)
+		has_invalid = np.zeros(nr_of_records, dtype=np.uint8)
+		has_invalid[non_empty] = reduce_spans(np.maximum, invalid_bytes, seq_starts[non_empty] - first,
+												seq_ends[non_empty] - first)
+		if has_invalid.any():
+			malformed.append((int(np.argmax(has_invalid)),
+								"has other characters than ATGCN in its sequence"))
+
+	qual_lengths = chunk.line_ends(3) - chunk.line_starts(3)
+	if np.any(seq_lengths != qual_lengths):
+		malformed.append((int(np.argmax(seq_lengths != qual_lengths)),
+							"has a quality line of another length than its sequence"))
+
+	return min(malformed, key=lambda record: record[0], default=None)
+
+
+def check_fastq_chunk(fastq_file, chunk, first_record_nr):
+	'''
+	Raises a FastqFormatError if a FastqChunk, starting with record
+	first_record_nr (from zero) of fastq_file, has a malformed record.
+	'''
+
+	malformed = find_malformed_record(chunk)
+	if malformed is not None:
+		record_nr, reason = malformed
+		raise FastqFormatError(fastq_file, 4 * (first_record_nr + record_nr) + 1, reason)
+
+
+def read_checked_chunks(fastq_files, chunk_size=QUALITY_CHUNK_SIZE):
+	'''
+	Generator that reads the fastq files (one file, or the two files of a
+	pair) in lockstep, checks their format and yields a list with one
+	FastqChunk (see fastq_io.read_fastq_chunks) per file at a time. Raises a
+	FastqFormatError at the first malformed record, or if the files don't
+	have the same nr of records.
+	'''
+
+	record_nr = 0
+
+	with ExitStack() as stack:
+		readers = [stack.enter_context(closing(read_fastq_chunks(fastq_file, chunk_size)))
+					for fastq_file in fastq_files]
+		for chunks in zip_longest(*readers):
+			nr_of_records = [0 if chunk is None else len(chunk) for chunk in chunks]
+			for fastq_file, chunk in zip(fastq_files, chunks):
+				if (chunk is None or len(chunk) < max(nr_of_records)):
+					raise FastqFormatError(fastq_file, 4 * (record_nr + min(nr_of_records)) + 1,
+											"is missing, the mate file has more records")
+				check_fastq_chunk(fastq_file, chunk, record_nr)
+			yield chunks
+			record_nr += nr_of_records[0]
+
+
+def chunks_mean_qualities(chunks, phred_offset=PHRED_OFFSET, read_statistics=None):
+	'''
+	Returns a list with an array of the average Q-phred of every record of
+	each of the chunks (one per file). If read_statistics is a list with a
+	ReadStatistics per file, the reads of the chunks are added to them, and
+	the qualities are calculated from their ReadBatches.
+	'''
+
+	if read_statistics is None:
+		return [chunk_phred_qualities(chunk, phred_offset) for chunk in chunks]
+
+	batches = [read_batch(chunk) for chunk in chunks]
+	for statistics, batch in zip(read_statistics, batches):
+		statistics.add(batch)
+
+	return [batch.mean_phred_qualities(phred_offset) for batch in batches]
+
+
+class SeenHeaders:
+	'''
+	The set of the hashes of the headers of a fastq file, to tell which
+	headers were seen before in about 9 bytes per header instead of the
+	headers themselves. Two headers only have the same hash by chance about
+	once in 2**64 pairs. The hashes are kept in sorted runs, with the start of
+	every bucket of about 4 to 8 hashes with the same high bits, so a hash is
+	only compared to the hashes of its bucket. The runs of the last headers
+	are merged when they are about as long as the run before them, so there
+	are about log2(nr of headers) runs, and merging the largest ones briefly
+	takes twice the memory.
+	'''
+
+	def __init__(self):
+		self.runs = [] # (hashes, bucket starts, nr of bits of the buckets)
+
+	def indexed_run(self, run):
+		'''
+		Returns the run (a sorted uint64 array) with the start of every
+		bucket in it, for contains.
+		'''
+
+		bits = max(len(run).bit_length() - 3, 1)
+		buckets = (run >> np.uint64(64 - bits)).astype(np.intp)
+		bucket_starts = np.zeros((1 << bits) + 1, dtype=np.intp)
+		np.cumsum(np.bincount(buckets, minlength=1 << bits), out=bucket_starts[1:])
+
+		return run, bucket_starts, bits
+
+	def contains(self, run, bucket_starts, bits, hashes):
+		'''
+		Returns a boolean array that tells which of the hashes are in an
+		indexed run. The sorted hashes of the bucket of every hash are
+		compared one at a time, for all of the hashes that can still be
+		further in their bucket.
+		'''
+
+		buckets = (hashes >> np.uint64(64 - bits)).astype(np.intp)
+		ends = bucket_starts[buckets + 1]
+		found = np.zeros(len(hashes), dtype=bool)
+		searching = np.flatnonzero(bucket_starts[buckets] < ends)
+		positions = bucket_starts[buckets[searching]]
+		while (len(searching) > 0):
+			values, searched_hashes = run[positions], hashes[searching]
+			found[searching[values == searched_hashes]] = True
+			positions += 1
+			further = (values < searched_hashes) & (positions < ends[searching])
+			searching, positions = searching[further], positions[further]
+
+		return found
+
+	def add(self, hashes):
+		'''
+		Adds the hashes (a uint64 array) of headers, and returns a boolean
+		array that tells which of them were seen before, earlier in hashes
+		too.
+		'''
+
+		unique_hashes, first_indices = np.unique(hashes, return_index=True)
+		seen_before = np.zeros(len(unique_hashes), dtype=bool)
+		for run in self.runs:
+			seen_before |= self.contains(*run, unique_hashes)
+		seen = np.ones(len(hashes), dtype=bool)
+		seen[first_indices] = seen_before
+
+		if (len(unique_hashes) > 0):
+			self.runs.append(self.indexed_run(unique_hashes))
+		while (len(self.runs) > 1 and len(self.runs[-2][0]) <= 2 * len(self.runs[-1][0])):
+			merged = np.concatenate([run for run, bucket_starts, bits in self.runs[-2:]])
+			del self.runs[-2:]
+			merged.sort(kind='stable') # Merges the two sorted runs
+			self.runs.append(self.indexed_run(merged))
+
+		return seen
+
+
+def header_hashes(headers):
+	'''
+	Returns a uint64 array with the hash of every header (bytes). The hashes
+	are only the same within one run of python.
+	'''
+
+	return np.fromiter(map(hash, headers), dtype=np.int64, count=len(headers)).view(np.uint64)
+
+
+def add_band_qualities(histogram, band_qualities, chunk_bands, chunk_qualities):
+	'''
+	Adds the selectable records of a chunk, with chunk_bands (an int8 array)
+	and chunk_qualities (an array per file), to the nr of records and the
+	summed qualities per file of their band. The bands are added in the
+	order they first appear, and the qualities of a band in file order, so
+	the sums are the same as when the records are added one at a time.
+	'''
+
+	selectable = np.flatnonzero(chunk_bands != NOT_SELECTED)
+	selectable_bands = chunk_bands[selectable]
+	unique_bands, first_records = np.unique(selectable_bands, return_index=True)
+
+	for band in unique_bands[np.argsort(first_records)].tolist():
+		records = selectable[selectable_bands == band]
+		histogram[band] = histogram.get(band, 0) + len(records)
+		summed_qualities = band_qualities.setdefault(band, [0] * len(chunk_qualities))
+		for i, qualities in enumerate(chunk_qualities):
+			summed_qualities[i] = sum(qualities[records].tolist(), summed_qualities[i])
+
+
+def calculate_quality_bands(fastq_files, quality_threshold_start, phred_offset=PHRED_OFFSET,
+							read_statistics=None):
+	'''
+	Reads the fastq files (one file, or the two files of a pair) once, in
+	lockstep, checks their format and calculates the band of every record:
+	the highest integer quality threshold, at most quality_threshold_start,
+	below the lowest quality of its mates. When the threshold is lowered by 1
+	at a time, this is the threshold at which the record is first picked.
+	Like in the threshold lowering loop, a record whose header in the first
+	file was already seen in a record of a higher band (or of the same band,
+	earlier in the file) is never selected. Records without bases are never
+	selected either. Raises a FastqFormatError if a file is not properly
+	formatted. If read_statistics is a list with a ReadStatistics per file,
+	all of the reads are added to them in the same pass.
+
+	The records are first counted as if every header was unique. Only the
+	band of every record (one byte) and the hash of every header (8 bytes,
+	see SeenHeaders) are kept, not the headers. Only if headers were seen
+	twice are the records with these headers read once more to correct the
+	counts, see correct_duplicate_headers.
+
+	Returns (bands, histogram, fin_qualities, nr_of_seqs_fin, band_qualities):
+	the band of each record (NOT_SELECTED for the headers picked elsewhere),
+	the nr of selectable records per band, the summed qualities per file and
+	the nr of records with bases that the first loop would have counted for
+	the in file averages (like in select_top_reads, the records without bases
+	are left out of both), and the summed qualities per file of the
+	selectable records of each band.
+	'''
+
+	bands = array('b')
+	histogram = {}
+	fin_qualities = [0] * len(fastq_files)
+	nr_of_seqs_fin = 0
+	band_qualities = {}
+	seen_headers = SeenHeaders()
+	repeated_hashes = [np.zeros(0, dtype=np.uint64)] # Of the headers that were seen before
+
+	for chunks in read_checked_chunks(fastq_files):
+		chunk_qualities = chunks_mean_qualities(chunks, phred_offset, read_statistics)
+		lowest_qualities = np.minimum.reduce(chunk_qualities)
+
+		# The highest integer threshold, at most the start, below the lowest mate quality
+		chunk_bands = np.full(len(lowest_qualities), NOT_SELECTED, dtype=np.int8)
+		with_bases = ~np.isnan(lowest_qualities)
+		chunk_bands[with_bases] = np.minimum(quality_threshold_start,
+											np.ceil(lowest_qualities[with_bases]) - 1)
+		bands.frombytes(chunk_bands.tobytes())
+
+		for i, qualities in enumerate(chunk_qualities):
+			fin_qualities[i] = sum(qualities[with_bases].tolist(), fin_qualities[i])
+		nr_of_seqs_fin += int(np.count_nonzero(with_bases))
+		add_band_qualities(histogram, band_qualities, chunk_bands, chunk_qualities)
+
+		hashes = header_hashes(chunks[0].lines(0))
+		repeated_hashes.append(hashes[seen_headers.add(hashes)])
+
+	del seen_headers
+	repeated_hashes = np.unique(np.concatenate(repeated_hashes))
+	if (len(repeated_hashes) > 0):
+		del chunks # Closes the maps of the files before they are read again
+		nr_of_seqs_fin -= correct_duplicate_headers(fastq_files, repeated_hashes,
+													quality_threshold_start, bands, histogram,
+													fin_qualities, band_qualities, phred_offset)
+
+	return bands, histogram, fin_qualities, nr_of_seqs_fin, band_qualities
+
+
+def correct_duplicate_headers(fastq_files, repeated_hashes, quality_threshold_start, bands,
+								histogram, fin_qualities, band_qualities,
+								phred_offset=PHRED_OFFSET):
+	'''
+	Reads the fastq files once more and, for the records whose header (in the
+	first file) has one of the repeated_hashes (a uint64 array), corrects
+	what calculate_quality_bands counted as if every header was unique: like
+	in the threshold lowering loop, only the record of the highest band (the
+	earliest of them) of a header stays selected, and the records after a
+	record of quality_threshold_start are not counted in the in file
+	averages. Only the best record so far of these headers is kept. Changes
+	bands, histogram, fin_qualities (the summed qualities of the records with
+	bases) and band_qualities, and returns the nr of records with bases that
+	are not counted.
+	'''
+
+	def unselect(record_nr, band, phred_qualities):
+		bands[record_nr] = NOT_SELECTED
+		histogram[band] -= 1
+		for i, phred_quality in enumerate(phred_qualities):
+			band_qualities[band][i] -= phred_quality
+
+	best_records = {} # header -> (record nr, band, qualities) of the best record so far
+	nr_not_counted = 0
+	record_nr = 0
+
+	with ExitStack() as stack:
+		readers = [stack.enter_context(closing(read_fastq_chunks(fastq_file, QUALITY_CHUNK_SIZE)))
+					for fastq_file in fastq_files]
+		for chunks in zip(*readers):
+			headers = chunks[0].lines(0)
+			first_record_nr = record_nr
+			record_nr += len(headers)
+			matches = np.flatnonzero(np.isin(header_hashes(headers), repeated_hashes))
+			if (len(matches) == 0):
+				continue
+			chunk_qualities = zip(*(chunk_phred_qualities(chunk, phred_offset)[matches].tolist()
+									for chunk in chunks))
+
+			for i, phred_qualities in zip(matches.tolist(), chunk_qualities):
+				band = bands[first_record_nr + i]
+				previous = best_records.get(headers[i])
+
+				# The first loop skipped the reads whose header it had already picked
+				if (previous is not None and previous[1] >= quality_threshold_start
+					and band != NOT_SELECTED): # The records without bases weren't counted
+					for j, phred_quality in enumerate(phred_qualities):
+						fin_qualities[j] -= phred_quality
+					nr_not_counted += 1
+
+				if (band == NOT_SELECTED):
+					continue
+				if (previous is None or band > previous[1]):
+					if previous is not None: # Replacing the previously best record
+						unselect(*previous)
+					best_records[headers[i]] = (first_record_nr + i, band, phred_qualities)
+				else:
+					unselect(first_record_nr + i, band, phred_qualities)
+
+	return nr_not_counted
+
+
+def choose_quality_threshold(histogram, quality_threshold_start, nr_of_sequences_threshold):
+	'''
+	Lowers the quality threshold from quality_threshold_start by 1 until at
+	least nr_of_sequences_threshold records, counted in the histogram from
+	calculate_quality_bands, are above it. Stops at the lowest band if there
+	aren't that many records. Returns the threshold and the nr of records
+	above it.
+	'''
+
+	quality_threshold = quality_threshold_start
+	nr_of_sequences_out = histogram.get(quality_threshold, 0)
+	lowest_band = min(histogram, default=quality_threshold_start)
+
+	while (nr_of_sequences_out < nr_of_sequences_threshold
+		and quality_threshold > lowest_band):
+		quality_threshold -= 1
+		nr_of_sequences_out += histogram.get(quality_threshold, 0)
+
+	return quality_threshold, nr_of_sequences_out
+
+
+def add_selected_reads(read_statistics, chunks, selected):
+	'''
+	Adds the records of the chunks (one per file) with the record nrs in
+	selected (an array) to the ReadStatistics of their file.
+	'''
+
+	if (len(selected) > 0):
+		for statistics, chunk in zip(read_statistics, chunks):
+			statistics.add(read_batch(chunk, selected))
+
+
+def write_selected_reads(fastq_files, out_files, bands, quality_threshold,
+							read_statistics=None):
+	'''
+	Reads the fastq files in lockstep once more and writes the records with a
+	band of at least quality_threshold to the corresponding out files. The
+	records are written band by band, highest band first, and in file order
+	within a band, which is the order the threshold lowering loop wrote them in.
+	The lower bands are held in spool files until the input has been read.
+	Runs of consecutive records that go to the same file are written straight
+	from the buffer of their chunk, in one write, through write buffers of
+	WRITE_BUFFER_SIZE. If read_statistics is a list with a ReadStatistics per
+	file, the written reads are added to them.
+	'''
+
+	bands = np.frombuffer(bands, dtype=np.int8)
+
+	with ExitStack() as stack:
+		readers = [stack.enter_context(closing(read_fastq_chunks(fastq_file, QUALITY_CHUNK_SIZE)))
+					for fastq_file in fastq_files]
+		f_outs = [stack.enter_context(open(out_file, "wb", buffering=WRITE_BUFFER_SIZE))
+					for out_file in out_files]
+		top_band = int(bands.max()) if len(bands) > 0 else quality_threshold
+		spools = {} # band -> one spool file per out file
+		record_nr = 0
+
+		for chunks in zip(*readers):
+			chunk_bands = bands[record_nr:record_nr + len(chunks[0])]
+			record_nr += len(chunk_bands)
+			selected = np.flatnonzero(chunk_bands >= quality_threshold)
+			if (len(selected) == 0):
+				continue
+
+			# Runs of consecutive records of the same band
+			run_starts = np.flatnonzero((np.diff(selected) != 1)
+										| (np.diff(chunk_bands[selected]) != 0)) + 1
+			firsts = selected[np.concatenate(([0], run_starts))]
+			lasts = selected[np.concatenate((run_starts - 1, [len(selected) - 1]))] + 1
+			for band, first, last in zip(chunk_bands[firsts].tolist(), firsts.tolist(),
+											lasts.tolist()):
+				if (band == top_band):
+					outs = f_outs
+				else:
+					if band not in spools:
+						spools[band] = [stack.enter_context(tempfile.SpooledTemporaryFile(
+											max_size=SPOOL_SIZE, mode="w+b"))
+										for out_file in out_files]
+					outs = spools[band]
+				for f_out, chunk in zip(outs, chunks):
+					f_out.write(chunk.records_bytes(first, last))
+			if read_statistics is not None:
+				add_selected_reads(read_statistics, chunks, selected)
+
+		for band in sorted(spools, reverse=True): # Appending the lower bands
+			for spool, f_out in zip(spools[band], f_outs):
+				spool.seek(0)
+				shutil.copyfileobj(spool, f_out)
+
+
+def read_selected_reads(fastq_files, bands, quality_threshold, read_statistics=None):
+	'''
+	Generator that reads the fastq files in lockstep once more, like
+	write_selected_reads, and yields the records with a band of at least
+	quality_threshold in file order, as a tuple with the record (a
+	FastqRecord view, used like a tuple of its four lines) of every file.
+	If read_statistics is a list with a ReadStatistics per file, the
+	records of a chunk are added to them when it is read.
+	'''
+
+	bands = np.frombuffer(bands, dtype=np.int8)
+
+	with ExitStack() as stack:
+		readers = [stack.enter_context(closing(read_fastq_chunks(fastq_file, QUALITY_CHUNK_SIZE)))
+					for fastq_file in fastq_files]
+		record_nr = 0
+
+		for chunks in zip(*readers):
+			chunk_bands = bands[record_nr:record_nr + len(chunks[0])]
+			record_nr += len(chunk_bands)
+			selected = np.flatnonzero(chunk_bands >= quality_threshold)
+			if read_statistics is not None:
+				add_selected_reads(read_statistics, chunks, selected)
+			for i in selected.tolist():
+				yield tuple(chunk.record(i) for chunk in chunks)
+
+
+def select_top_reads(fastq_files, nr_of_reads, phred_offset=PHRED_OFFSET,
+						read_statistics=None):
+	'''
+	Reads the fastq files (one file, or the two files of a pair) once, in
+	lockstep, checks their format and keeps the nr_of_reads records with the
+	highest quality, the lowest average quality of their mates, in a heap.
+	Only the kept records are held in memory. Like in calculate_quality_bands,
+	of the records with the same header in the first file only the best one
+	is kept, and of records of the same quality the earliest one. A record
+	that is replaced by a better one with the same header stays in the heap,
+	without its lines, until it is the worst one. Records without bases are
+	never kept. Raises a FastqFormatError if a file is not properly
+	formatted. If read_statistics is a list with a ReadStatistics per file,
+	all of the reads are added to them.
+
+	Returns (selected, fin_qualities, nr_of_seqs_fin): a list with the
+	(qualities, records) of the kept records in file order, the average
+	quality and the record (a tuple of its four lines) of every file, and the
+	summed qualities per file and the nr of the records with bases.
+	'''
+
+	heap = [] # [quality, -record nr, header, qualities, records], the worst kept record first
+	kept = {} # The header of the first file -> its entry in the heap
+	nr_of_stale = 0 # Entries of replaced records, which are still in the heap
+	fin_qualities = [0] * len(fastq_files)
+	nr_of_seqs_fin = 0
+	record_nr = 0
+
+	for chunks in read_checked_chunks(fastq_files):
+		chunk_qualities = chunks_mean_qualities(chunks, phred_offset, read_statistics)
+		ranks = np.minimum.reduce(chunk_qualities)
+		with_bases = ~np.isnan(ranks)
+		for i, qualities in enumerate(chunk_qualities):
+			fin_qualities[i] += float(qualities[with_bases].sum())
+		nr_of_seqs_fin += int(np.count_nonzero(with_bases))
+
+		# Only the records better than the worst kept one can be kept
+		candidates = np.flatnonzero(with_bases)
+		if (len(kept) >= nr_of_reads):
+			candidates = candidates[ranks[candidates] > heap[0][0]] if heap else candidates[:0]
+
+		chunk_qualities = [qualities.tolist() for qualities in chunk_qualities]
+		for i, header in zip(candidates.tolist(), chunks[0].lines(0, candidates)):
+			qualities = tuple(qualities[i] for qualities in chunk_qualities)
+			key = [min(qualities), -(record_nr + i)]
+			previous = kept.get(header)
+			if (previous is not None and key[0] <= previous[0]):
+				continue
+			elif (previous is None and len(kept) >= nr_of_reads and key < heap[0][:2]):
+				continue
+
+			entry = key + [header, qualities, tuple(tuple(chunk.record(i)) for chunk in chunks)]
+			if previous is not None: # Replacing the kept record of the header
+				previous[2:] = [None, None, None] # Stale, it is skipped when it is the worst
+				nr_of_stale += 1
+				heapq.heappush(heap, entry)
+			elif (len(kept) < nr_of_reads):
+				heapq.heappush(heap, entry)
+			else:
+				del kept[heapq.heapreplace(heap, entry)[2]]
+			kept[header] = entry
+
+			while (heap[0][2] is None):
+				heapq.heappop(heap)
+				nr_of_stale -= 1
+			if (nr_of_stale > nr_of_reads): # Dropping the stale entries, in O(nr_of_reads)
+				heap = list(kept.values())
+				heapq.heapify(heap)
+				nr_of_stale = 0
+
+		record_nr += len(chunks[0])
+
+	return ([(qualities, records) for quality, record_nr, header, qualities, records
+				in sorted(kept.values(), key=lambda entry: -entry[1])], fin_qualities, nr_of_seqs_fin)
+
+
+def records_read_batch(records):
+	'''
+	Returns a ReadBatch of records, tuples of the four lines of a fastq record
+	with their newlines.
+	'''
+
+	sequences = [record[1].rstrip(b'\n') for record in records]
+	lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+
+	return ReadBatch(joined_lines(sequences),
+						joined_lines([record[3].rstrip(b'\n') for record in records]), lengths)
+
+
+def write_records(out_files, selected_records):
+	'''
+	Writes selected_records, tuples with the record (a tuple of its four
+	lines) of every file, to the corresponding out files.
+	'''
+
+	with ExitStack() as stack:
+		f_outs = [stack.enter_context(open(out_file, "wb", buffering=WRITE_BUFFER_SIZE))
+					for out_file in out_files]
+		for records in selected_records:
+			for f_out, record in zip(f_outs, records):
+				f_out.writelines(record)
+
+
+def stream_checked_reads(fastq_files, quality_threshold=STREAM_QUALITY_THRESHOLD,
+							phred_offset=PHRED_OFFSET, chunk_size=STREAM_CHUNK_SIZE):
+	'''
+	Generator that reads the fastq files (one file, or the two files of a
+	pair) in lockstep, checks their format and yields the records whose mates
+	all have an average quality above quality_threshold, as tuples with the
+	record of every file like read_selected_reads. Unlike in the fastq
+	checkers, the threshold isn't lowered to keep enough reads, so every
+	record is yielded as soon as it is read, and the files are only read as
+	far as the records are used. Raises a FastqFormatError at the first
+	malformed record.
+	'''
+
+	for chunks in read_checked_chunks(fastq_files, chunk_size):
+		chunk_qualities = np.minimum.reduce([chunk_phred_qualities(chunk, phred_offset)
+											for chunk in chunks])
+		for i in np.flatnonzero(chunk_qualities > quality_threshold).tolist():
+			yield tuple(chunk.record(i) for chunk in chunks)
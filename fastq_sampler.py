@@ -0,0 +1,431 @@
+import argparse
+import logging
+import os
+import random
+import time
+from contextlib import closing
+from fastq_io import (MateReader, is_compressed, load_fastq_index, map_fastq, open_fastq,
+	plain_fastq_name, read_fastq_record, read_fastq_records, record_id, record_sequence)
+from instrumentation import STAGE_TIMER
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The logger of this module, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# The default seed of the sampler. The same seed gives the same sample of the
+# same file.
+SAMPLE_SEED = 1
+
+# Specify how many reads the sampler writes by default, 2500 reads are the
+# 10000 lines that used to be taken with head.
+SAMPLE_SIZE = 2500
+
+# Files are sampled by seeking to random byte offsets, unless they have fewer
+# than this many records per sampled read (estimated from the size of the
+# first record). Those are read whole, as are compressed files and stdin.
+SEEK_MIN_RECORDS_PER_READ = 4
+
+# Specify how many random offsets are tried per sampled read before the
+# sampler settles for fewer distinct reads.
+SEEK_ATTEMPTS_PER_READ = 4
+
+# The mate of a read is searched for around the same relative offset in the
+# R2 file, within a window that grows from MATE_SEARCH_START to
+# MATE_SEARCH_MAX bytes on each side, and then in the index of the R2 file.
+MATE_SEARCH_START = 1 << 12
+MATE_SEARCH_MAX = 1 << 20
+
+###--------- FUNCTIONS ---------###
+
+def is_seekable(fastq_file):
+	'''
+	Returns True if random offsets of the fastq file can be seeked to.
+	'''
+
+	return (fastq_file != '-' and not is_compressed(fastq_file))
+
+
+def find_record_start(f_in, offset):
+	'''
+	Returns the byte offset of the first record that starts at or after
+	offset in a binary fastq file (or its memory map), or None if there is
+	none. A header is
+	recognized by the '@' and '+' lines of its record, and by its sequence
+	and quality lines having the same length, since quality lines can start
+	with '@' as well.
+	'''
+
+	f_in.seek(max(offset - 1, 0))
+	if (offset > 0):
+		f_in.readline() # Skipping to the start of the next line
+	positions = []
+	lines = []
+	for i in range(7): # One of the first four lines is a header
+		positions.append(f_in.tell())
+		lines.append(f_in.readline())
+
+	for i in range(4):
+		header, seq, plus, qual = lines[i:i + 4]
+		if (header.startswith(b'@') and plus.startswith(b'+') and qual
+			and len(seq.rstrip()) == len(qual.rstrip())):
+			return positions[i]
+
+	return None
+
+
+def sample_record_starts(f_in, size, nr_of_reads, rng):
+	'''
+	Seeks to random byte offsets of a binary fastq file of size bytes and
+	returns the sorted byte offsets of up to nr_of_reads distinct records,
+	each the first record after one of the offsets. An offset in the last
+	record wraps around to the first one.
+	'''
+
+	record_starts = set()
+
+	for attempt in range(nr_of_reads * SEEK_ATTEMPTS_PER_READ):
+		if (len(record_starts) == nr_of_reads):
+			break
+		record_start = find_record_start(f_in, rng.randrange(size))
+		record_starts.add(record_start or 0)
+
+	return sorted(record_starts)
+
+
+def reservoir_sample(records, nr_of_reads, rng):
+	'''
+	Reads the records of a fastq file (see fastq_io.read_fastq_records) to the
+	end and returns a uniform sample of up to nr_of_reads of them, as (record,
+	record_nr) tuples in file order. The sampled records are copied out of
+	their chunks, so that the chunks aren't kept in memory.
+	'''
+
+	sample = []
+
+	for record_nr, record in enumerate(records):
+		if (record_nr < nr_of_reads):
+			sample.append((tuple(record), record_nr))
+		else: # Replacing a sampled record with probability nr_of_reads/(record_nr+1)
+			i = rng.randrange(record_nr + 1)
+			if (i < nr_of_reads):
+				sample[i] = (tuple(record), record_nr)
+
+	sample.sort(key=lambda sampled: sampled[1])
+
+	return sample
+
+
+def sample_records(fastq_file, nr_of_reads, rng, seek=True):
+	'''
+	Returns a sample of up to nr_of_reads records of the fastq file, as
+	(record, position) tuples in file order, and whether it was seeked in.
+	If it was, see is_seekable, the positions are the byte offsets of the
+	records and only the sampled records are read, from the memory map of the
+	file. Otherwise the file is read whole, see reservoir_sample, and the
+	positions are the record numbers.
+	'''
+
+	mapped = None
+	if (seek and is_seekable(fastq_file)):
+		mapped = map_fastq(fastq_file)
+	if mapped is not None:
+		with mapped:
+			size = len(mapped)
+			first_record = read_fastq_record(mapped)
+			if (first_record is not None and size > len(b''.join(first_record))
+				* nr_of_reads * SEEK_MIN_RECORDS_PER_READ):
+				sample = []
+				for record_start in sample_record_starts(mapped, size, nr_of_reads, rng):
+					mapped.seek(record_start)
+					sample.append((read_fastq_record(mapped), record_start))
+				return sample, True
+
+	with closing(read_fastq_records(fastq_file)) as records:
+		return reservoir_sample(records, nr_of_reads, rng), False
+
+
+class MateSeeker:
+	'''
+	Looks up the records of a fastq file (R2) by the seq_id and byte offset
+	of their mates in another fastq file (R1) of size_R1 bytes. The mate is
+	expected at about the same relative offset, so it is searched for around
+	there first. If it isn't found, the R2 file is indexed (see
+	load_fastq_index) and every later lookup is a single seek. The file is
+	read through its memory map.
+	'''
+
+	def __init__(self, fastq_file, size_R1):
+		self.fastq_file = fastq_file
+		self.f_in = map_fastq(fastq_file) or open_fastq(fastq_file) # Empty files aren't mapped
+		self.scale = os.path.getsize(fastq_file) / max(size_R1, 1)
+		self.index = None
+
+	def search(self, seq_id, offset, window):
+		'''
+		Returns the record with the id seq_id if it starts within window bytes
+		of offset, otherwise None.
+		'''
+
+		position = find_record_start(self.f_in, max(offset - window, 0))
+		if position is None:
+			return None
+		self.f_in.seek(position)
+
+		while (position <= offset + window):
+			record = read_fastq_record(self.f_in)
+			if record is None:
+				return None
+			if (record_id(record) == seq_id):
+				return record
+			position = self.f_in.tell()
+
+		return None
+
+	def find_record(self, seq_id, offset_R1):
+		'''
+		Returns the record with the id seq_id, the mate of the read at
+		offset_R1 in the R1 file, or None if there is no such record.
+		'''
+
+		if self.index is None:
+			offset = int(offset_R1 * self.scale)
+			window = MATE_SEARCH_START
+			while (window <= MATE_SEARCH_MAX):
+				record = self.search(seq_id, offset, window)
+				if record is not None:
+					return record
+				window *= 4
+
+			logger.warning('%s is not in the same order as its mate file.', self.fastq_file)
+			self.index = load_fastq_index(self.fastq_file)
+
+		offset = self.index.get(seq_id)
+		if offset is None:
+			return None
+		self.f_in.seek(offset)
+
+		return read_fastq_record(self.f_in)
+
+	def close(self):
+		'''
+		Closes the fastq file.
+		'''
+
+		self.f_in.close()
+
+
+def sample_pairs(fastq_file_1, fastq_file_2, nr_of_reads, rng):
+	'''
+	Returns a sample of up to nr_of_reads reads of fastq_file_1 together with
+	their mates in fastq_file_2, as (record_R1, record_R2) tuples in file
+	order. record_R2 is None for a read without a mate. The R1 file is only
+	seeked in if the R2 file can be seeked in as well, see MateSeeker,
+	otherwise the mates are read in lockstep, see MateReader.
+	'''
+
+	seek = is_seekable(fastq_file_2)
+	start_time = time.perf_counter()
+	sample, seeked = sample_records(fastq_file_1, nr_of_reads, rng, seek)
+	STAGE_TIMER.add('fastq_read', time.perf_counter() - start_time, len(sample))
+
+	if seeked:
+		mates = MateSeeker(fastq_file_2, os.path.getsize(fastq_file_1))
+	else: # The positions are record numbers
+		mates = MateReader(fastq_file_2)
+
+	try:
+		with STAGE_TIMER.stage('r2_lookup', len(sample)):
+			return [(record, mates.find_record(record_id(record), position))
+					for record, position in sample]
+	finally:
+		mates.close()
+
+
+def random_reads(fastq_file, nr_of_reads, seed=SAMPLE_SEED):
+	'''
+	Returns up to nr_of_reads reads sampled from the whole fastq file, see
+	sample_records, as (seq_id, seq) tuples in random order, so that any
+	number of the first of them is a sample of the whole file as well.
+	'''
+
+	rng = random.Random(seed)
+	start_time = time.perf_counter()
+	sample, seeked = sample_records(fastq_file, nr_of_reads, rng)
+	STAGE_TIMER.add('fastq_read', time.perf_counter() - start_time, len(sample))
+	reads = [(record_id(record), record_sequence(record)) for record, position in sample]
+	rng.shuffle(reads)
+
+	return reads
+
+
+def random_pairs(fastq_file_1, fastq_file_2, nr_of_reads, seed=SAMPLE_SEED):
+	'''
+	Returns up to nr_of_reads pairs sampled from the whole fastq files, see
+	sample_pairs, as (seq_id, seq_R1, seq_R2) tuples in random order. seq_R2
+	is None for a read without a mate.
+	'''
+
+	rng = random.Random(seed)
+	pairs = []
+	for record_R1, record_R2 in sample_pairs(fastq_file_1, fastq_file_2, nr_of_reads, rng):
+		seq_R2 = None
+		if record_R2 is not None:
+			seq_R2 = record_sequence(record_R2)
+		pairs.append((record_id(record_R1), record_sequence(record_R1), seq_R2))
+	rng.shuffle(pairs)
+
+	return pairs
+
+
+def first_reads(fastq_file, start, nr_of_reads):
+	'''
+	Generator that yields the reads of the fastq file from record number start
+	on (from zero), at most nr_of_reads of them, as (seq_id, seq) tuples.
+	'''
+
+	with closing(read_fastq_records(fastq_file)) as records:
+		for record_nr in range(start + nr_of_reads):
+			with STAGE_TIMER.stage('fastq_read'):
+				record = next(records, None)
+			if record is None: # The end of the file
+				return
+			if (record_nr >= start):
+				yield (record_id(record), record_sequence(record))
+
+
+def first_pairs(fastq_file_1, fastq_file_2, start, nr_of_reads):
+	'''
+	Generator that yields the reads of fastq_file_1 from record number start
+	on, at most nr_of_reads of them, with their mates in fastq_file_2, as
+	(seq_id, seq_R1, seq_R2) tuples. seq_R2 is None for a read without a mate.
+	'''
+
+	mate_reader = MateReader(fastq_file_2)
+
+	try:
+		for record_nr, (seq_id, seq_R1) in enumerate(first_reads(fastq_file_1, start,
+																	nr_of_reads), start):
+			with STAGE_TIMER.stage('r2_lookup'):
+				seq_R2 = mate_reader.find(seq_id, record_nr)
+			yield (seq_id, seq_R1, seq_R2)
+	finally:
+		mate_reader.close()
+
+
+class RecordSample:
+	'''
+	A sample of up to nr_of_reads of the records (or tuples of the records of
+	a pair) that the fastq checker selects in memory, for guesslib in the
+	same process. It is extended like the selected_reads (or selected_pairs)
+	list of the checker, and samples the records uniformly like
+	reservoir_sample, or with sample_reads set to False, keeps the first
+	ones. Only the kept records are copied out of their chunks, so that not
+	the chunks of the whole file stay in memory.
+	'''
+
+	def __init__(self, nr_of_reads, sample_reads=True, seed=SAMPLE_SEED):
+		self.nr_of_reads = nr_of_reads
+		self.sample_reads = sample_reads
+		self.rng = random.Random(seed)
+		self.sample = []
+		self.nr_of_records = 0
+
+	def __len__(self):
+		return len(self.sample)
+
+	def extend(self, records):
+		'''
+		Adds the records, in file order.
+		'''
+
+		for record in records:
+			if (self.nr_of_records < self.nr_of_reads):
+				self.sample.append(copied_record(record))
+			elif self.sample_reads: # Replacing a kept record with probability nr_of_reads/(nr+1)
+				i = self.rng.randrange(self.nr_of_records + 1)
+				if (i < self.nr_of_reads):
+					self.sample[i] = copied_record(record)
+			self.nr_of_records += 1
+
+	def records(self):
+		'''
+		Returns the kept records, in random order if they were sampled, so
+		that any number of the first of them is a sample as well.
+		'''
+
+		records = list(self.sample)
+		if self.sample_reads:
+			self.rng.shuffle(records)
+
+		return records
+
+
+def copied_record(record):
+	'''
+	Returns a record (e.g. a FastqRecord view, see fastq_io), or a tuple of
+	the records of a pair, as tuples of their four lines.
+	'''
+
+	if isinstance(record[0], bytes):
+		return tuple(record)
+
+	return tuple(map(tuple, record))
+
+
+def reads_from_records(records):
+	'''
+	Returns the records in a list (e.g. of a RecordSample) as (seq_id, seq)
+	tuples.
+	'''
+
+	return [(record_id(record), record_sequence(record)) for record in records]
+
+
+def pairs_from_records(record_pairs):
+	'''
+	Returns the (record_R1, record_R2) tuples in a list (e.g. of a
+	RecordSample) as (seq_id, seq_R1, seq_R2) tuples.
+	'''
+
+	return [(record_id(record_R1), record_sequence(record_R1), record_sequence(record_R2))
+			for record_R1, record_R2 in record_pairs]
+
+###--------- MAIN ---------###
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Write a random sample of the "
+									"reads of a fastq file, or of a pair of fastq files.")
+	parser.add_argument("-f", "--file", help="FASTQ file")
+	parser.add_argument("-f1", "--file_1", help="FASTQ with read 1 sequences")
+	parser.add_argument("-f2", "--file_2", help="FASTQ with paired read 2 sequences")
+	parser.add_argument("-n", "--nr_of_reads", type=int, default=SAMPLE_SIZE,
+						help="nr of reads to sample")
+	parser.add_argument("-s", "--seed", type=int, default=SAMPLE_SEED,
+						help="seed of the random sample")
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+
+	if args.file:
+		sample, seeked = sample_records(args.file, args.nr_of_reads, rng)
+		with open("sampled_" + plain_fastq_name(args.file), 'wb') as f_out:
+			for record, position in sample:
+				f_out.write(b''.join(record))
+		print(f'Sampled {len(sample)} reads from {args.file}.')
+	elif (args.file_1 and args.file_2):
+		pairs = [(record_R1, record_R2) for record_R1, record_R2
+				in sample_pairs(args.file_1, args.file_2, args.nr_of_reads, rng)
+				if record_R2 is not None] # Keeping the two files in the same order
+		with (open("sampled_" + plain_fastq_name(args.file_1), 'wb') as f_out_1,
+			open("sampled_" + plain_fastq_name(args.file_2), 'wb') as f_out_2):
+			for record_R1, record_R2 in pairs:
+				f_out_1.write(b''.join(record_R1))
+				f_out_2.write(b''.join(record_R2))
+		print(f'Sampled {len(pairs)} pairs from {args.file_1} and {args.file_2}.')
+	else:
+		parser.error("Give either a FASTQ file or a pair of FASTQ files.")
+
+if __name__ == "__main__":
+	main()
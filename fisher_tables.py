@@ -0,0 +1,134 @@
+import argparse
+import os
+
+###--------- GLOBAL VARIABLES ---------###
+
+# Precomputed tables are loaded from this directory, if they are there. They
+# are written by running this file, see main.
+FISHER_TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fisher_tables')
+
+# Specify up to which total the tables written by main are computed, the
+# MAX_BLATS of the guesslib scripts.
+FISHER_TABLE_SIZE = 1000
+
+# The tables used by this process, by training data.
+FISHER_TABLES = {}
+
+###--------- FUNCTIONS ---------###
+
+class FisherTable:
+	'''
+	The p-values of Fisher's exact test of the training data (a list of two
+	counts) against [count, total-count], by total and count. Every p-value is
+	computed the first time it is looked up, and kept in a row of p-values per
+	total. Precomputed rows can be given in table, a 2D array with the p-value
+	of count out of total at [total, count] and NaN where it wasn't computed.
+	'''
+
+	def __init__(self, training_data, table=None):
+		self.training_data = list(training_data)
+		self.rows = {}
+		if table is not None:
+			self.rows = {total: row[:total+1] for total, row in enumerate(table)}
+
+	def p_value(self, count, total):
+		'''
+		Returns the p-value of count out of total.
+		'''
+
+		import numpy as np # Not at the top, so that the help of guesslib doesn't wait for it
+
+		row = self.rows.get(total)
+		if row is None:
+			row = self.rows[total] = np.full(total+1, np.nan)
+
+		p_value = row[count]
+		if np.isnan(p_value):
+			import scipy.stats as stats # Only when needed, it takes most of the startup time
+			p_value = row[count] = stats.fisher_exact([self.training_data,
+														[count, total-count]])[1]
+
+		return float(p_value)
+
+	def precompute(self, max_total):
+		'''
+		Computes the p-values of all counts out of all totals up to max_total.
+		'''
+
+		for total in range(max_total+1):
+			for count in range(total+1):
+				self.p_value(count, total)
+
+	def save(self, table_file, max_total):
+		'''
+		Writes the p-values of the totals up to max_total to the .npy file
+		table_file, in the form that FisherTable takes as table.
+		'''
+
+		import numpy as np
+
+		table = np.full((max_total+1, max_total+1), np.nan)
+		for total, row in self.rows.items():
+			if (total <= max_total):
+				table[total, :total+1] = row
+		np.save(table_file, table)
+
+
+def fisher_table_file(training_data):
+	'''
+	Returns the file that the precomputed table of the training data is
+	loaded from.
+	'''
+
+	return os.path.join(FISHER_TABLE_DIR, f'fisher_{training_data[0]}_{training_data[1]}.npy')
+
+
+def fisher_table(training_data):
+	'''
+	Returns the FisherTable of the training data, loading its precomputed
+	p-values (if there are any) the first time it is used by this process.
+	'''
+
+	key = tuple(training_data)
+	if key not in FISHER_TABLES:
+		table = None
+		if os.path.exists(fisher_table_file(key)):
+			import numpy as np
+			table = np.load(fisher_table_file(key))
+		FISHER_TABLES[key] = FisherTable(key, table)
+
+	return FISHER_TABLES[key]
+
+
+def fisher_p_value(training_data, count, total):
+	'''
+	Returns the p-value of Fisher's exact test of the training data against
+	[count, total-count], like stats.fisher_exact, from the table of the
+	training data.
+	'''
+
+	return fisher_table(training_data).p_value(count, total)
+
+
+###--------- MAIN ---------###
+
+def main():
+
+	parser = argparse.ArgumentParser(description="Precompute the p-values of Fisher's "
+									"exact test for training data of the guesslib scripts.")
+	parser.add_argument("-d", "--training_data", type=int, nargs=2, action="append",
+						required=True, help="the two counts of training data, "
+						"e.g. -d 995 2 -d 500 500")
+	parser.add_argument("-n", "--max_total", type=int, default=FISHER_TABLE_SIZE,
+						help="largest nr of reads (or pairs) to compute p-values for")
+	args = parser.parse_args()
+
+	os.makedirs(FISHER_TABLE_DIR, exist_ok=True)
+	for training_data in args.training_data:
+		table = FisherTable(training_data)
+		table.precompute(args.max_total)
+		table.save(fisher_table_file(training_data), args.max_total)
+		print(f'Wrote {fisher_table_file(training_data)}.')
+
+if __name__ == "__main__":
+	main()
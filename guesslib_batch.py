@@ -0,0 +1,192 @@
+import argparse
+import csv
+import importlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from aligners import ALIGNERS, ALIGNMENT_JOBS, ALIGNMENT_MEMO, prepare_aligner
+from decision import DECISION_MODES
+from fastq_sampler import SAMPLE_SEED
+from instrumentation import STAGE_TIMER
+from logging_config import LOG_LEVEL, LOG_LEVELS, configure_logging
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The logger of this program, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# The types of samples in a manifest, with the guesslib module and function
+# that determine their library type, and the names of the counts it returns
+# between the library type and the success.
+SAMPLE_TYPES = {
+	'single': ('guesslib_single', 'guesslib_single',
+				['forward', 'reverse', 'collected_reads']),
+	'pair': ('guesslib_pair', 'guesslib_pair',
+			['o_and_f', 'o_and_r', 'i_and_f', 'i_and_r', 'collected_pairs']),
+	'genomic': ('guesslib_genomic_pair', 'guesslib_genomic_pair',
+				['o_and_f', 'o_and_r', 'i_and_f', 'i_and_r', 'collected_pairs'])
+}
+
+# The columns of a manifest. file_2 is left empty for single samples.
+MANIFEST_FIELDS = ['sample', 'type', 'reference', 'file_1', 'file_2']
+
+# The columns of the results, one row per sample. The counts that a type of
+# sample doesn't have are left empty, error is only set if guesslib failed.
+RESULT_FIELDS = ['sample', 'type', 'reference', 'lib_type', 'forward', 'reverse',
+				'o_and_f', 'o_and_r', 'i_and_f', 'i_and_r', 'collected_reads',
+				'collected_pairs', 'success', 'analysis_time', 'error']
+
+###--------- FUNCTIONS ---------###
+
+def read_manifest(manifest_file):
+	'''
+	Returns the samples of a manifest, as a list of dictionaries with the
+	MANIFEST_FIELDS. A manifest is a TSV file with a header line naming the
+	columns, or, if its name ends with .json, a JSON list of objects.
+	'''
+
+	with open(manifest_file) as f_in:
+		if manifest_file.endswith('.json'):
+			samples = json.load(f_in)
+		else:
+			samples = list(csv.DictReader(f_in, delimiter='\t'))
+
+	for line_nr, sample in enumerate(samples, 1):
+		missing = [field for field in MANIFEST_FIELDS[:4] if not sample.get(field)]
+		if missing:
+			raise ValueError(f'Sample {line_nr} of {manifest_file} has no {", ".join(missing)}.')
+		if sample['type'] not in SAMPLE_TYPES:
+			raise ValueError(f'Sample {sample["sample"]} of {manifest_file} has the '
+							f'type {sample["type"]}, not one of {", ".join(SAMPLE_TYPES)}.')
+		if (sample['type'] != 'single' and not sample.get('file_2')):
+			raise ValueError(f'The {sample["type"]} sample {sample["sample"]} '
+							f'of {manifest_file} has no file_2.')
+
+	return samples
+
+
+def run_sample(sample, aligner, seed, jobs, decision_mode, memo_db=None, log_dir=None,
+				log_level=LOG_LEVEL):
+	'''
+	Determines the library type of one sample of a manifest, in a process of
+	the pool, and returns its row of results. What guesslib logs (at
+	log_level) and prints is written to <log_dir>/<sample>.log, or discarded
+	without a log_dir. The times of the stages (see instrumentation) are
+	those of this sample only.
+	'''
+
+	module, function, count_fields = SAMPLE_TYPES[sample['type']]
+	guesslib = getattr(importlib.import_module(module), function)
+	result = {'sample': sample['sample'], 'type': sample['type'],
+				'reference': sample['reference'], 'lib_type': 'N/A', 'success': False}
+
+	if (memo_db and ALIGNMENT_MEMO.connection is None): # Once per process
+		ALIGNMENT_MEMO.open_database(memo_db)
+	STAGE_TIMER.reset() # A process of the pool runs several samples
+
+	log_file = os.devnull
+	if log_dir:
+		log_file = os.path.join(log_dir, f'{sample["sample"]}.log')
+	with open(log_file, 'w') as f_log, redirect_stdout(f_log):
+		configure_logging(log_level, stream=f_log)
+		try:
+			files = [sample['file_1']]
+			if (sample['type'] != 'single'):
+				files.append(sample['file_2'])
+			(lib_type, *counts, success,
+				analysis_time) = guesslib(sample['reference'], *files, aligner,
+											seed=seed, jobs=jobs, decision_mode=decision_mode)
+			result.update(zip(count_fields, counts))
+			result.update({'lib_type': lib_type, 'success': success,
+							'analysis_time': analysis_time})
+		except Exception as error: # One failed sample doesn't stop the batch
+			logger.error('%s: %s', type(error).__name__, error)
+			result['error'] = f'{type(error).__name__}: {error}'
+
+	return result
+
+
+def run_batch(samples, results_file, aligner='blat', seed=SAMPLE_SEED, jobs=ALIGNMENT_JOBS,
+				decision_mode='fisher', processes=None, memo_db=None, log_dir=None,
+				log_level=LOG_LEVEL):
+	'''
+	Determines the library types of the samples from read_manifest, up to
+	processes of them at the same time, and writes one row of results
+	(RESULT_FIELDS) per sample to results_file, in the order of the samples,
+	as soon as it is known. The results are written as TSV, or as JSON lines if
+	the name of results_file ends with .jsonl. Every reference is prepared for
+	the aligner once, see prepare_aligner, before the samples are started,
+	so the samples share it. Returns the rows.
+	'''
+
+	for ref in dict.fromkeys(sample['reference'] for sample in samples):
+		prepare_aligner(aligner, ref)
+	if log_dir:
+		os.makedirs(log_dir, exist_ok=True)
+
+	results = []
+	with (ProcessPoolExecutor(processes) as executor,
+		open(results_file, 'w', newline='') as f_out):
+		writer = None
+		if not results_file.endswith('.jsonl'):
+			writer = csv.DictWriter(f_out, RESULT_FIELDS, delimiter='\t')
+			writer.writeheader()
+
+		n = len(samples)
+		for result in executor.map(run_sample, samples, [aligner] * n, [seed] * n, [jobs] * n,
+									[decision_mode] * n, [memo_db] * n, [log_dir] * n,
+									[log_level] * n):
+			if writer is not None:
+				writer.writerow(result)
+			else:
+				f_out.write(json.dumps(result) + '\n')
+			f_out.flush()
+			logger.info('%s: %s, success: %s', result["sample"], result["lib_type"],
+						result["success"])
+			results.append(result)
+
+	return results
+
+###--------- MAIN ---------###
+
+def main(argv=None, prog=None):
+
+	parser = argparse.ArgumentParser(prog=prog, description="Determine the library "
+									"types of all the samples of a manifest.")
+	parser.add_argument("-i", "--manifest", required=True,
+						help="TSV (or .json) file with the columns " + ", ".join(MANIFEST_FIELDS))
+	parser.add_argument("-o", "--results", default="guesslib_results.tsv",
+						help="TSV (or .jsonl) file with one row of results per sample")
+	parser.add_argument("-a", "--aligner", choices=ALIGNERS, default="blat",
+						help="blat, a gfServer that keeps the reference loaded, "
+						"or an in-process k-mer index")
+	parser.add_argument("-P", "--processes", type=int,
+						help="nr of samples to run at the same time, by default one per core")
+	parser.add_argument("-s", "--seed", type=int, default=SAMPLE_SEED,
+						help="seed of the random sample of reads")
+	parser.add_argument("-j", "--jobs", type=int, default=ALIGNMENT_JOBS,
+						help="nr of read batches of a sample to align at the same time")
+	parser.add_argument("-d", "--decision", choices=DECISION_MODES, default="fisher",
+						help="Fisher's exact test, or a sequential test that stops "
+						"as soon as the library type is clear")
+	parser.add_argument("-m", "--memo_db",
+						help="SQLite file that alignment results are kept in between runs")
+	parser.add_argument("-l", "--log_dir", help="folder for the output of every sample")
+	parser.add_argument("-v", "--log_level", choices=LOG_LEVELS, default=LOG_LEVEL,
+						help="level of the output of every sample, debug also logs every read")
+	args = parser.parse_args(argv)
+
+	configure_logging()
+
+	try:
+		samples = read_manifest(args.manifest)
+	except (IOError, ValueError) as error:
+		parser.error(str(error))
+
+	run_batch(samples, args.results, args.aligner, args.seed, args.jobs, args.decision,
+				args.processes, args.memo_db, args.log_dir, args.log_level)
+
+if __name__ == "__main__":
+	main()
@@ -1,14 +1,25 @@
-import subprocess
-import csv
 import argparse
+import logging
 import time
-import numpy as np
-import scipy.stats as stats
+from aligners import ALIGNERS, ALIGNMENT_JOBS, ALIGNMENT_MEMO, blat_pairs_in_batches
+from decision import DECISION_MODES, sequential_test
+from fastq_sampler import SAMPLE_SEED, first_pairs, random_pairs
+from fisher_tables import fisher_p_value
+from instrumentation import STAGE_TIMER, profiled
+from logging_config import LOG_LEVEL, LOG_LEVELS, TRACE, configure_logging, trace
 
 ###--------- GLOBAL VARIABLES ---------###
 
+# The logger of this program, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# Specify if the pairs to align should be sampled from the whole files
+# (see fastq_sampler.py), or taken in file order.
+SAMPLE_READS = True
+
 # Specify from what line of the user's transcripts
-# that sequences should be aligned from. Index from zero.
+# that sequences should be aligned from, when they are taken in file order.
+# Index from zero.
 START_FROM_SEQUENCE_NR = 0
 
 # Specify from how many paired alignments data
@@ -45,22 +56,34 @@ INWARD_DATA = ([1000, 5])
 # nr of collected pairs
 OUTWARD_DATA = ([900, 100])
 
+# The probabilities of the pair types in every library type, from the data above,
+# used by the sequential decision modes (see decision.py)
+PAIR_TYPE_PROBABILITIES = {
+	"I": {"IF": INWARD_DATA[0]/sum(INWARD_DATA)/2, "IR": INWARD_DATA[0]/sum(INWARD_DATA)/2,
+		"OF": INWARD_DATA[1]/sum(INWARD_DATA)/2, "OR": INWARD_DATA[1]/sum(INWARD_DATA)/2},
+	"O": {"OF": OUTWARD_DATA[0]/sum(OUTWARD_DATA)/2, "OR": OUTWARD_DATA[0]/sum(OUTWARD_DATA)/2,
+		"IF": OUTWARD_DATA[1]/sum(OUTWARD_DATA)/2, "IR": OUTWARD_DATA[1]/sum(OUTWARD_DATA)/2}
+}
+
 
 ###--------- FUNCTIONS ---------###
 
-def guesslib_genomic_pair(ref, user_transcripts_f1, user_transcripts_f2):
+def guesslib_genomic_pair(ref, user_transcripts_f1, user_transcripts_f2, aligner='blat',
+							sample_reads=SAMPLE_READS, seed=SAMPLE_SEED, jobs=ALIGNMENT_JOBS,
+							decision_mode='fisher', pairs=None):
 	'''
 	Finds NR_OF_PAIRS pairs and
-	determines if the library is forward, reverse or unstranded
+	determines if the library is forward, reverse or unstranded.
+	With the decision_mode 'sprt' or 'bayes', the pairs are collected until
+	a sequential test decides instead, see decision.py. The pairs are taken
+	from the user_transcripts files, unless they are given in pairs, as
+	(seq_id, seq_R1, seq_R2) tuples (see fastq_sampler.pairs_from_records).
 	'''
 
 	# Initializing variables
 	start_time = time.time()
-	# Naming tmp fasta file according to input file name
-	tmp_fasta_1 = "tmp/tmp_blat_inpt_1_" + user_transcripts_f1
 	lib_type = "N/A"
 	succesful_lib_determination = False
-	read_start = START_FROM_SEQUENCE_NR * 4
 	seqs_searched = 0
 	collected_pairs = 0
 	o_and_f = 0
@@ -69,83 +92,105 @@ def guesslib_genomic_pair(ref, user_transcripts_f1, user_transcripts_f2):
 	i_and_r = 0
 	invalid_orientation = 0
 	p_value = 0.99
+	significant_p = SIGNIFICANT_P
+	min_pairs = NR_OF_PAIRS
+	test = None
+	if (decision_mode != 'fisher'): # Stopping as soon as the test has decided
+		test = sequential_test(decision_mode, PAIR_TYPE_PROBABILITIES)
+		significant_p = test.error_budget
+		min_pairs = 1
+
+	if (pairs is None and sample_reads):
+		pairs = random_pairs(user_transcripts_f1, user_transcripts_f2, MAX_BLATS, seed)
+	elif pairs is None:
+		pairs = first_pairs(user_transcripts_f1, user_transcripts_f2,
+							START_FROM_SEQUENCE_NR, MAX_BLATS)
+	blat_results = blat_pairs_in_batches(ref, pairs, aligner, jobs)
 
 	try:
-		with open (user_transcripts_f1) as f_in:
-			for i in range(read_start): # Skipping to START_FROM_SEQUENCE_NR
-				next(f_in)
-			while ((collected_pairs < NR_OF_PAIRS or p_value > SIGNIFICANT_P)
-				and seqs_searched < MAX_BLATS):
-				pair_type = "N/A" # Resetting variables for new search
-				nr_of_results_R1 = 0
-				nr_of_results_R2 = 0
-
-				print(f"Collected pairs: {collected_pairs}. Collecting at least {NR_OF_PAIRS} pairs.")
-				seq_id_R1 = write_tmp_fasta(tmp_fasta_1, f_in)
-				(seq_start_R1, seq_end_R1, nr_of_results_R1,
-					ref_transcript_id_R1) = run_blat(ref, tmp_fasta_1)
-				seqs_searched += 1
-
-				if (nr_of_results_R1 == 1):
-					(seq_start_R2, seq_end_R2, nr_of_results_R2,
-	            		ref_transcript_id_R2) = blat_corresponding_seq_in_f2(ref,
-	                                                user_transcripts_f2,
-	                                                seq_id_R1)
-
-					if (nr_of_results_R2 == 1 and ref_transcript_id_R1 == ref_transcript_id_R2):
-						pair_type = pair_analysis(seq_start_R1,
-					                                seq_end_R1,
-					                                seq_start_R2,
-					                                seq_end_R2)
-						collected_pairs += 1
-					
-						# Incrementing corresponding pair type
-						if (pair_type == "OF"):
-							o_and_f += 1
-							print("Added to OF.\n")
-						elif (pair_type == "OR" ):
-							o_and_r += 1
-							print("Added to OR.\n")
-						elif (pair_type == "IF"):
-							i_and_f += 1
-							print("Added to IF.\n")
-						elif (pair_type == "IR"):
-							i_and_r += 1
-							print("Added to IR.\n")
-						else:
-							invalid_orientation += 1
-							print("Added to invalid orientation.\n")
-
-						if (collected_pairs > NR_OF_PAIRS-1):
+		while ((collected_pairs < min_pairs or p_value > significant_p)
+			and seqs_searched < MAX_BLATS):
+			pair_type = "N/A" # Resetting variables for new search
+			nr_of_results_R1 = 0
+			nr_of_results_R2 = 0
+
+			logger.debug('Collected pairs: %d. Collecting at least %d pairs.',
+						collected_pairs, NR_OF_PAIRS)
+			(seq_id_R1, (seq_start_R1, seq_end_R1, nr_of_results_R1,
+				ref_transcript_id_R1), results_R2) = next(blat_results)
+			seqs_searched += 1
+			logger.debug('%s had %s blat results, the first one against %s.',
+						seq_id_R1, nr_of_results_R1, ref_transcript_id_R1)
+
+			if (nr_of_results_R1 == 1):
+				(seq_start_R2, seq_end_R2, nr_of_results_R2,
+					ref_transcript_id_R2) = results_R2
+
+				if (nr_of_results_R2 == 1 and ref_transcript_id_R1 == ref_transcript_id_R2):
+					pair_type = pair_analysis(seq_start_R1,
+				                                seq_end_R1,
+				                                seq_start_R2,
+				                                seq_end_R2)
+					collected_pairs += 1
+				
+					# Incrementing corresponding pair type
+					if (pair_type == "OF"):
+						o_and_f += 1
+					elif (pair_type == "OR" ):
+						o_and_r += 1
+					elif (pair_type == "IF"):
+						i_and_f += 1
+					elif (pair_type == "IR"):
+						i_and_r += 1
+					else:
+						invalid_orientation += 1
+					logger.debug('Added to %s.', pair_type)
+
+					with STAGE_TIMER.stage('statistics'):
+						if test is not None:
+							test.update(pair_type)
+							lib_type, p_value = test.decision()
+							logger.debug('The library type appears to be: %s, with the error %s.',
+										lib_type, p_value)
+						elif (collected_pairs > NR_OF_PAIRS-1):
 							(lib_type,
 								p_value) = get_libtype_and_pvalue(o_and_f, o_and_r,
 																	i_and_f, i_and_r,
 																	collected_pairs)
 
+			if TRACE.isEnabledFor(logging.DEBUG): # Costs nothing without a trace file
+				trace('pair', seq_id=seq_id_R1, seq_start_R1=seq_start_R1, seq_end_R1=seq_end_R1,
+					nr_of_results_R1=nr_of_results_R1, ref_transcript_id_R1=ref_transcript_id_R1,
+					result_R2=results_R2, pair_type=pair_type)
+
 	except StopIteration:
 		pass
-
-	subprocess.run(['rm', tmp_fasta_1]) # Removing the tmp FASTA file
-
-	if (seqs_searched == MAX_BLATS or lib_type == "N/A"):
-		print(f'Guesslib could not determine the library type.\n'
-			f'Tried to align {MAX_BLATS} sequences. With this, '
-			f'{collected_pairs} pairs were collected.\n'
-			f'Possibly, the wrong reference sequence was used.')
+	finally:
+		blat_results.close() # Cancelling the batches that are not needed anymore
+
+	if (collected_pairs < min_pairs or p_value > significant_p): # Also if the pairs ran out
+		logger.warning('Guesslib could not determine the library type.\n'
+						'Tried to align %d sequences. With this, '
+						'%d pairs were collected.\n'
+						'Possibly, the wrong reference sequence was used.',
+						seqs_searched, collected_pairs)
 	else:
 		succesful_lib_determination = True
 
-		print(f'\nThe library type determination was succesful\n'
-			f'OF: {o_and_f}, OR: {o_and_r}, '
-			f'IF: {i_and_f}, IR: {i_and_r}, '
-			f'Neither: {invalid_orientation}.\n'
-			f'The most likely lib type is {lib_type}.')
+		logger.info('The library type determination was succesful\n'
+					'OF: %d, OR: %d, IF: %d, IR: %d, Neither: %d.\n'
+					'The most likely lib type is %s.', o_and_f, o_and_r,
+					i_and_f, i_and_r, invalid_orientation, lib_type)
 
 	end_time = time.time()
 	analysis_time = round(((end_time - start_time)/60), 2)
 
-	print(f'Guesslib took {int(analysis_time)} minutes and'
-		f' {int((analysis_time-int(analysis_time))*60)} seconds to do the analysis.')
+	logger.info('Guesslib took %d minutes and %d seconds to do the analysis.',
+				int(analysis_time), int((analysis_time-int(analysis_time))*60))
+	trace('summary', logging.INFO, lib_type=lib_type, o_and_f=o_and_f, o_and_r=o_and_r,
+		i_and_f=i_and_f, i_and_r=i_and_r, invalid_orientation=invalid_orientation,
+		collected_pairs=collected_pairs, success=succesful_lib_determination,
+		analysis_time=analysis_time, stages=STAGE_TIMER.statistics())
 
 	return (lib_type, o_and_f, o_and_r, i_and_f, i_and_r, collected_pairs,
 			succesful_lib_determination, analysis_time)
@@ -164,19 +209,17 @@ def get_libtype_and_pvalue(o_and_f, o_and_r, i_and_f, i_and_r, collected_pairs):
 	inwards = i_and_f + i_and_r
 	outwards = o_and_f + o_and_r
 
-	p_values.append(stats.fisher_exact([INWARD_DATA,
-		[inwards, collected_pairs-inwards]])[1])
-	p_values.append(stats.fisher_exact([OUTWARD_DATA,
-		[outwards, collected_pairs-outwards]])[1])
+	p_values.append(fisher_p_value(INWARD_DATA, inwards, collected_pairs))
+	p_values.append(fisher_p_value(OUTWARD_DATA, outwards, collected_pairs))
 
 	# This is the lowest of the two p values.
 	p_value = min(p_values)
 	# Retrieving orientation corresponding to highest p_val, from dictionary
 	lib_type = LIB_TYPE_DICT.get(p_values.index(max(p_values))) 
 
-	print(f'The list of p-values ["I", "O"] = {p_values}\n'
-	f'The library type appears to be: {lib_type}.\n'
-	f'The second to highest p-value is: {p_value}')
+	logger.debug('The list of p-values ["I", "O"] = %s\n'
+		'The library type appears to be: %s.\n'
+		'The second to highest p-value is: %s', p_values, lib_type, p_value)
 
 	return lib_type, p_value
 
@@ -203,120 +246,59 @@ def pair_analysis(seq_start_R1, seq_end_R1, seq_start_R2, seq_end_R2):
 		elif (seq_start_R1 < seq_start_R2): # If R1 starts upstream of R2
 			pair_type = "OR"
 
-	print(f'(Midpoint of R2) - (Midpoint of R1) is: {distance_r2_r1}')
+	logger.debug('(Midpoint of R2) - (Midpoint of R1) is: %s', distance_r2_r1)
 
 	return pair_type
 
-def blat_corresponding_seq_in_f2(ref, user_transcripts, seq_id_R1):
-    '''
-    This function finds the corresponding seq to the id of the input in the
-    reference fastq file specified as ref. It then performs a blat and returns
-    the start, end and e-value of this hit.
-    '''
-
-    seq_id_R2 = "N/A"
-    iterations = 0
-    ref_transcript_id = "N/A"
-    tmp_in_2 = "tmp/tmp_blat_inpt_2_" + user_transcripts # Naming temp fasta file
-
-    with open(user_transcripts) as f_in:
-        first_line = '>' + f_in.readline()[1:] # First line of FASTA file
-        seq_id_R2 = first_line.split(" ")[0]
-
-        while (seq_id_R2 != seq_id_R1): # Looking for match to seq_id_R1
-            next(f_in)
-            next(f_in)
-            next(f_in)
-            first_line = '>' + f_in.readline()[1:] # First line of FASTA
-            seq_id_R2 = first_line.split(" ")[0]
-            iterations += 1
-
-        # Writing out tmp FASTA
-        with open(tmp_in_2, "w+") as f_out:
-            f_out.write(first_line)
-            f_out.write(f_in.readline())
-
-    print("Now blatting the corresponding sequence in file 2.")
-
-    (seq_start, seq_end, nr_of_results,
-        ref_transcript_id) = run_blat(ref, tmp_in_2)
-
-    subprocess.run(['rm', tmp_in_2]) # Removing the tmp file
-
-    return (seq_start, seq_end,
-            nr_of_results, ref_transcript_id)
-
-def write_tmp_fasta(tmp_fasta, fastq):
-	'''
-	Writes a temporary fasta file, taking in a fastq-file.
-	'''
-
-	with open(tmp_fasta, "w+") as f_out: # Creating FASTA tmp
-		first_line = '>' + fastq.readline()[1:]
-		seq_id = first_line.split(" ")[0]
-		print(seq_id)
-		f_out.write(first_line)  # Writes the header into f_out.
-		f_out.write(fastq.readline()) # Writes the sequence into f_out.
-		next(fastq) # Skipping past the +, and phred lines.
-		next(fastq)
-
-	return seq_id
-
-def run_blat(ref, seq):
-    ''' This function calls blat with a single sequence seq.fa as
-        input against the reference ref.fa and returns seq_identity,
-        seq_start, seq_end'''
-
-    nr_of_results = 0
-    seq_identity = "0"
-    seq_start = "0"
-    seq_end = "0"
-    second_hit_e_value = "0"
-    e_value = "0"
-    ref_transcript_id = "N/A"
-    tmp_rslt = seq + "_rslt"
-    ref = 'reference_sequences/' + ref
-
-    # Blatting, and creating tmp blat result file
-    subprocess.run(['./blat', ref, seq, '-out=blast8', tmp_rslt])
-    for line in open(tmp_rslt):
-        nr_of_results += 1 # Each row represents an alignment
-    if (nr_of_results > 0):
-        with open(tmp_rslt, 'r') as f_in:
-            first_hit = next(csv.reader(f_in, delimiter='\t'))
-            ref_transcript_id = first_hit[1]
-            seq_identity = first_hit[2]
-            seq_start = first_hit[8]
-            seq_end = first_hit[9]
-            e_value = first_hit[10]
-            if (nr_of_results > 1):
-                second_hit = next(csv.reader(f_in, delimiter='\t'))
-                second_hit_e_value = second_hit[10]
-
-    print(f'the identity is: {seq_identity}')
-    print(f'the E value of the first hit is: {e_value}')
-    print(f'the seq start is: {seq_start}')
-    print(f'the seq end is: {seq_end}')
-    print(f"the second hit's E value is: {second_hit_e_value}")
-    print(f'the reference transcript id is: {ref_transcript_id}')
-    print(f'the number of results for this blat is: {nr_of_results}\n')
-
-    subprocess.run(['rm', tmp_rslt]) # Removing the tmp blat rslt file
-
-    return (int(seq_start), int(seq_end),
-            nr_of_results, ref_transcript_id)
-
 ###--------- MAIN ---------###
 
-def main():
+def main(argv=None, prog=None):
 	
-	parser = argparse.ArgumentParser()
+	parser = argparse.ArgumentParser(prog=prog)
 	parser.add_argument("-r", "--reference", required=True, help="reference sequence")
 	parser.add_argument("-f1", "--file_1", required=True, help="FASTQ with read 1 sequences")
 	parser.add_argument("-f2", "--file_2", required=True, help="FASTQ with paired read 2 sequences")
-	args = parser.parse_args()
-
-	guesslib_pair(args.reference, args.file_1, args.file_2)
+	parser.add_argument("-a", "--aligner", choices=ALIGNERS, default="blat",
+						help="blat, a gfServer that keeps the reference loaded, "
+						"or an in-process k-mer index")
+	parser.add_argument("-s", "--seed", type=int, default=SAMPLE_SEED,
+						help="seed of the random sample of pairs")
+	parser.add_argument("--in_order", action="store_true",
+						help="align the pairs in file order instead of sampling them")
+	parser.add_argument("-j", "--jobs", type=int, default=ALIGNMENT_JOBS,
+						help="nr of read batches to align at the same time")
+	parser.add_argument("-d", "--decision", choices=DECISION_MODES, default="fisher",
+						help="Fisher's exact test, or a sequential test that stops "
+						"as soon as the library type is clear")
+	parser.add_argument("-m", "--memo_db",
+						help="SQLite file that alignment results are kept in between runs")
+	parser.add_argument("--metrics",
+						help="file to write the time spent in every stage to, as JSON, "
+						"or in the Prometheus text format if it ends with .prom")
+	parser.add_argument("--profile",
+						help="file to write a cProfile profile to, or a pyinstrument "
+						"report if it ends with .html")
+	parser.add_argument("-v", "--log_level", choices=LOG_LEVELS, default=LOG_LEVEL,
+						help="debug also logs every read")
+	parser.add_argument("--trace",
+						help="JSON lines file to write a record of every read and a summary to")
+	args = parser.parse_args(argv)
+
+	configure_logging(args.log_level, args.trace)
+
+	if args.memo_db:
+		ALIGNMENT_MEMO.open_database(args.memo_db)
+
+	with profiled(args.profile):
+		guesslib_genomic_pair(args.reference, args.file_1, args.file_2, args.aligner,
+			not args.in_order, args.seed, args.jobs, args.decision)
+	if args.metrics:
+		STAGE_TIMER.write(args.metrics)
+	memo_statistics = ALIGNMENT_MEMO.statistics()
+	logger.info('%d alignments were looked up in the alignment memo, %d were aligned '
+				'and %d were evicted from memory.', memo_statistics["hits"],
+				memo_statistics["misses"], memo_statistics["evictions"])
+	ALIGNMENT_MEMO.close()
 		
 if __name__ == "__main__":
 	main()
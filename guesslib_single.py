@@ -1,14 +1,28 @@
-import subprocess
-import csv
 import argparse
+import logging
+import os
 import time
-import numpy as np
-import scipy.stats as stats
+from contextlib import closing
+from itertools import islice
+from aligners import (ALIGNERS, ALIGNMENT_JOBS, ALIGNMENT_MEMO, BLAT_BATCH_SIZE,
+	align_batch, alignment_workspace, map_in_order)
+from decision import DECISION_MODES, sequential_test
+from fastq_sampler import SAMPLE_SEED, first_reads, random_reads
+from fisher_tables import fisher_p_value
+from instrumentation import STAGE_TIMER, profiled
+from logging_config import LOG_LEVEL, LOG_LEVELS, TRACE, configure_logging, trace
 
 ###--------- GLOBAL VARIABLES ---------###
 
+# The logger of this program, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# Specify if the reads to align should be sampled from the whole file
+# (see fastq_sampler.py), or taken in file order.
+SAMPLE_READS = True
+
 # Specify from what line of the user's transcripts
-# that sequences should be aligned from.
+# that sequences should be aligned from, when they are taken in file order.
 START_FROM_SEQUENCE_NR = 0
 
 # Specify from how many alignments that data
@@ -44,76 +58,115 @@ UNSTRANDED_DATA = ([500,500])
 # First element represents forwards or reverses, the second one is 'other types'
 STRANDED_DATA = ([995, 2])
 
+# The probabilities of the read types in every library type, from the data above,
+# used by the sequential decision modes (see decision.py)
+READ_TYPE_PROBABILITIES = {
+	"SF": {"F": STRANDED_DATA[0]/sum(STRANDED_DATA), "R": STRANDED_DATA[1]/sum(STRANDED_DATA)},
+	"SR": {"F": STRANDED_DATA[1]/sum(STRANDED_DATA), "R": STRANDED_DATA[0]/sum(STRANDED_DATA)},
+	"U": {"F": UNSTRANDED_DATA[0]/sum(UNSTRANDED_DATA),
+		"R": UNSTRANDED_DATA[1]/sum(UNSTRANDED_DATA)}
+}
+
 ###--------- FUNCTIONS ---------###
 
-def guesslib_single(ref, user_transcripts):
+def guesslib_single(ref, user_transcripts, aligner='blat', sample_reads=SAMPLE_READS,
+					seed=SAMPLE_SEED, jobs=ALIGNMENT_JOBS, decision_mode='fisher',
+					reads=None):
 	'''
 	Finds NR_OF_READS pairs and
-	determines if the library is forward, reverse or unstranded
+	determines if the library is forward, reverse or unstranded.
+	With the decision_mode 'sprt' or 'bayes', the reads are collected until
+	a sequential test decides instead, see decision.py. The reads are taken
+	from user_transcripts, unless they are given in reads, as (seq_id, seq)
+	tuples (see fastq_sampler.reads_from_records).
 	'''
 
 	# Initializing variables
 	start_time = time.time()
-	# Naming tmp fasta file according to input file name
-	tmp_fasta = "tmp/tmp_blat_inpt_" + user_transcripts
 	lib_type = "N/A"
 	succesful_lib_determination = False
-	read_start = START_FROM_SEQUENCE_NR * 4
 	seqs_searched = 0
 	collected_reads = 0
 	forward = 0
 	reverse = 0
 	p_value = 0.99
+	significant_p = SIGNIFICANT_P
+	min_reads = NR_OF_READS
+	test = None
+	if (decision_mode != 'fisher'): # Stopping as soon as the test has decided
+		test = sequential_test(decision_mode, READ_TYPE_PROBABILITIES)
+		significant_p = test.error_budget
+		min_reads = 1
+
+	if (reads is None and sample_reads):
+		reads = random_reads(user_transcripts, MAX_BLATS, seed)
+	elif reads is None:
+		reads = first_reads(user_transcripts, START_FROM_SEQUENCE_NR, MAX_BLATS)
+	blat_results = blat_in_batches(ref, reads, aligner, jobs)
 
 	try:
-		with open (user_transcripts) as f_in:
-			for i in range(read_start): # Skipping to START_FROM_SEQUENCE_NR
-				next(f_in)
-			while ((collected_reads < NR_OF_READS or p_value > SIGNIFICANT_P)
-				and seqs_searched < MAX_BLATS):
-				read_type = "N/A"
-				nr_of_results = 0
-
-				print(f"Collected reads: {collected_reads}. Collecting at least {NR_OF_READS} reads.")
-				write_tmp_fasta(tmp_fasta, f_in)
-				(seq_start, seq_end, nr_of_results,
-					ref_transcript_id) = run_blat(ref, tmp_fasta)
-				seqs_searched += 1
-		
-				if (nr_of_results == 1):
-					read_type = orientation_analysis(seq_start, seq_end)
-					if (read_type == "F"):
-						forward += 1
-					elif (read_type == "R"):
-						reverse += 1
-					collected_reads += 1
-
-					if (collected_reads > (NR_OF_READS-1)):
+		while ((collected_reads < min_reads or p_value > significant_p)
+			and seqs_searched < MAX_BLATS):
+			read_type = "N/A"
+			nr_of_results = 0
+
+			logger.debug('Collected reads: %d. Collecting at least %d reads.',
+						collected_reads, NR_OF_READS)
+			(seq_id, seq_start, seq_end, nr_of_results,
+				ref_transcript_id) = next(blat_results)
+			seqs_searched += 1
+			logger.debug('%s had %s blat results, the first one against %s.',
+						seq_id, nr_of_results, ref_transcript_id)
+	
+			if (nr_of_results == 1):
+				read_type = orientation_analysis(seq_start, seq_end)
+				if (read_type == "F"):
+					forward += 1
+				elif (read_type == "R"):
+					reverse += 1
+				collected_reads += 1
+
+				with STAGE_TIMER.stage('statistics'):
+					if test is not None:
+						test.update(read_type)
+						lib_type, p_value = test.decision()
+						logger.debug('The library type appears to be: %s, with the error %s.',
+									lib_type, p_value)
+					elif (collected_reads > (NR_OF_READS-1)):
 						(lib_type,
 							p_value) = get_libtype_and_pvalue(forward, reverse,
 																collected_reads)
+
+			if TRACE.isEnabledFor(logging.DEBUG): # Costs nothing without a trace file
+				trace('read', seq_id=seq_id, seq_start=seq_start, seq_end=seq_end,
+					nr_of_results=nr_of_results, ref_transcript_id=ref_transcript_id,
+					read_type=read_type)
 	except StopIteration:
 		pass
-	
-	subprocess.run(['rm', tmp_fasta]) # Removing the tmp FASTA file
-
-	if (seqs_searched == MAX_BLATS or lib_type == "N/A"):
-		print(f'Guesslib could not determine the library type.\n'
-			f'Tried to align {MAX_BLATS} sequences. With this, '
-			f'{collected_reads} reads were collected.\n'
-			f'Possibly, the wrong reference sequence was used.')
+	finally:
+		blat_results.close() # Cancelling the batches that are not needed anymore
+
+	if (collected_reads < min_reads or p_value > significant_p): # Also if the reads ran out
+		logger.warning('Guesslib could not determine the library type.\n'
+						'Tried to align %d sequences. With this, '
+						'%d reads were collected.\n'
+						'Possibly, the wrong reference sequence was used.',
+						seqs_searched, collected_reads)
 	else:
 		succesful_lib_determination = True
 
-		print(f'\nThe library type determination was succesful\n'
-			f'Forwards: {forward}, reverses: {reverse}, '
-			f'The most likely lib type is {lib_type}.')
+		logger.info('The library type determination was succesful\n'
+					'Forwards: %d, reverses: %d, '
+					'The most likely lib type is %s.', forward, reverse, lib_type)
 
 	end_time = time.time()
 	analysis_time = round(((end_time - start_time)/60), 2)
-	print(f'Guesslib took {int(analysis_time)} minutes and'
-		f' {int((analysis_time-int(analysis_time))*60)} seconds to do the analysis.')
-	
+	logger.info('Guesslib took %d minutes and %d seconds to do the analysis.',
+				int(analysis_time), int((analysis_time-int(analysis_time))*60))
+	trace('summary', logging.INFO, lib_type=lib_type, forward=forward, reverse=reverse,
+		collected_reads=collected_reads, success=succesful_lib_determination,
+		analysis_time=analysis_time, stages=STAGE_TIMER.statistics())
+
 	return (lib_type, forward, reverse, collected_reads,
 			succesful_lib_determination, analysis_time)
 
@@ -124,22 +177,22 @@ def get_libtype_and_pvalue(forward, reverse, collected_reads):
 	second to most likely library type.
 	'''
 
-	p_values = 0.99
+	p_value = 0.99
 	lib_type = "N/A"
 	p_values = []
 
-	p_values.append(stats.fisher_exact([STRANDED_DATA, [forward, collected_reads-forward]])[1])
-	p_values.append(stats.fisher_exact([STRANDED_DATA, [reverse, collected_reads-reverse]])[1])
-	p_values.append(stats.fisher_exact([UNSTRANDED_DATA, [forward, collected_reads-forward]])[1])
+	p_values.append(fisher_p_value(STRANDED_DATA, forward, collected_reads))
+	p_values.append(fisher_p_value(STRANDED_DATA, reverse, collected_reads))
+	p_values.append(fisher_p_value(UNSTRANDED_DATA, forward, collected_reads))
 
 	if (max(p_values) > NULL_P):
 		p_value = sorted(p_values, reverse=True)[1] # This is the second to highest p_value.
 
 		lib_type = LIB_TYPE_DICT.get(p_values.index(max(p_values)))
 	
-	print(f'The list of p-values ["SF", "SR", "U"] = {p_values}\n'
-		f'The library type appears to be: {lib_type}.\n'
-		f'The second to highest p-value is: {p_value}\n') 
+	logger.debug('The list of p-values ["SF", "SR", "U"] = %s\n'
+				'The library type appears to be: %s.\n'
+				'The second to highest p-value is: %s', p_values, lib_type, p_value)
 
 	return lib_type, p_value
 
@@ -151,87 +204,97 @@ def orientation_analysis(seq_start, seq_end):
 
 	read_type = "N/A"
 
-	print(f'The read start and end is ({seq_start}, {seq_end}).')
 	if (seq_start < seq_end):
 		read_type = "F"
-		print("The read type is F.\n")
 	elif (seq_start > seq_end):
 		read_type = "R"
-		print("The read type is R.\n")
+	logger.debug('The read start and end is (%s, %s), the read type is %s.',
+				seq_start, seq_end, read_type)
 
 	return read_type
 
-def write_tmp_fasta(tmp_fasta, fastq):
+def blat_batch(ref, tmp_fasta, batch, aligner):
 	'''
-	Writes a temporary fasta file, taking in a fastq-file
+	Blats the (seq_id, seq) tuples in batch and returns a list of (seq_id,
+	seq_start, seq_end, nr_of_results, ref_transcript_id) tuples.
 	'''
 
-	with open(tmp_fasta, "w+") as f_out: # Creating FASTA tmp
-		first_line = '>' + fastq.readline()[1:]
-		seq_id = first_line.split(" ")[0]
-		print(seq_id)
-		f_out.write(first_line)  # Writes the header into f_out.
-		f_out.write(fastq.readline()) # Writes the sequence into f_out.
-		next(fastq) # Skipping past the +, and phred lines.
-		next(fastq)
-
-def run_blat(ref, seq):
-    '''
-    This function calls blat with a single sequence seq.fa as
-    input against the reference ref.fa and returns seq_identity,
-    seq_start, seq_end
-    '''
-        
-    nr_of_results = 0
-    seq_identity = "0"
-    seq_start = "0"
-    seq_end = "0"
-    second_hit_e_value = "0"
-    e_value = "0"
-    ref_transcript_id = "N/A"
-    tmp_rslt = seq + "_rslt"
-    ref = 'reference_sequences/' + ref
-
-    # Blatting, and creating tmp blat result file
-    subprocess.run(['./blat', ref, seq, '-out=blast8', tmp_rslt])
-    for line in open(tmp_rslt):
-        nr_of_results += 1 # Each row represents an alignment
-    if (nr_of_results > 0):
-        with open(tmp_rslt, 'r') as f_in:
-            first_hit = next(csv.reader(f_in, delimiter='\t'))
-            ref_transcript_id = first_hit[1]
-            seq_identity = first_hit[2]
-            seq_start = first_hit[8]
-            seq_end = first_hit[9]
-            e_value = first_hit[10]
-            if (nr_of_results > 1):
-                second_hit = next(csv.reader(f_in, delimiter='\t'))
-                second_hit_e_value = second_hit[10]
-
-    print(f'the identity is: {seq_identity}')
-    print(f'the E value of the first hit is: {e_value}')
-    print(f'the seq start is: {seq_start}')
-    print(f'the seq end is: {seq_end}')
-    print(f"the second hit's E value is: {second_hit_e_value}")
-    print(f'the reference transcript id is: {ref_transcript_id}')
-    print(f'the number of results for this blat is: {nr_of_results}\n')
-
-    subprocess.run(['rm', tmp_rslt]) # Removing the tmp blat rslt file
-
-    return (int(seq_start), int(seq_end),
-            nr_of_results, ref_transcript_id)
+	results = align_batch(aligner, ref, tmp_fasta, [seq for seq_id, seq in batch])
+
+	return [(seq_id,) + result for (seq_id, seq), result in zip(batch, results)]
+
+
+def blat_in_batches(ref, reads, aligner, jobs=ALIGNMENT_JOBS):
+	'''
+	Generator that blats the (seq_id, seq) tuples in reads BLAT_BATCH_SIZE at
+	a time, up to jobs batches at the same time, and yields (seq_id,
+	seq_start, seq_end, nr_of_results, ref_transcript_id) for one read at a
+	time, in the order of reads. The tmp files are kept in a private
+	workspace, see alignment_workspace, that is removed when the generator
+	is closed.
+	'''
+
+	reads = iter(reads)
+	batches = iter(lambda: list(islice(reads, BLAT_BATCH_SIZE)), [])
+
+	with alignment_workspace() as workspace:
+		# Every batch gets its own tmp file, as they may be blatted at the same time
+		batch_args = ((ref, os.path.join(workspace, f'{batch_nr}.fa'), batch, aligner)
+						for batch_nr, batch in enumerate(batches))
+		# Closed first, so that no batch is still running when the workspace is removed
+		with closing(map_in_order(blat_batch, batch_args, jobs)) as batch_results:
+			for results in batch_results:
+				yield from results
 
 
 ###--------- MAIN ---------###
 
-def main():
+def main(argv=None, prog=None):
 	
-	parser = argparse.ArgumentParser()
+	parser = argparse.ArgumentParser(prog=prog)
 	parser.add_argument("-r", "--reference", required=True, help="reference sequence")
 	parser.add_argument("-f", "--user_transcripts", required=True, help="FASTQ library")
-	args = parser.parse_args()
-
-	guesslib_single(args.reference, args.user_transcripts)
+	parser.add_argument("-a", "--aligner", choices=ALIGNERS, default="blat",
+						help="blat, a gfServer that keeps the reference loaded, "
+						"or an in-process k-mer index")
+	parser.add_argument("-s", "--seed", type=int, default=SAMPLE_SEED,
+						help="seed of the random sample of reads")
+	parser.add_argument("--in_order", action="store_true",
+						help="align the reads in file order instead of sampling them")
+	parser.add_argument("-j", "--jobs", type=int, default=ALIGNMENT_JOBS,
+						help="nr of read batches to align at the same time")
+	parser.add_argument("-d", "--decision", choices=DECISION_MODES, default="fisher",
+						help="Fisher's exact test, or a sequential test that stops "
+						"as soon as the library type is clear")
+	parser.add_argument("-m", "--memo_db",
+						help="SQLite file that alignment results are kept in between runs")
+	parser.add_argument("--metrics",
+						help="file to write the time spent in every stage to, as JSON, "
+						"or in the Prometheus text format if it ends with .prom")
+	parser.add_argument("--profile",
+						help="file to write a cProfile profile to, or a pyinstrument "
+						"report if it ends with .html")
+	parser.add_argument("-v", "--log_level", choices=LOG_LEVELS, default=LOG_LEVEL,
+						help="debug also logs every read")
+	parser.add_argument("--trace",
+						help="JSON lines file to write a record of every read and a summary to")
+	args = parser.parse_args(argv)
+
+	configure_logging(args.log_level, args.trace)
+
+	if args.memo_db:
+		ALIGNMENT_MEMO.open_database(args.memo_db)
+
+	with profiled(args.profile):
+		guesslib_single(args.reference, args.user_transcripts, args.aligner,
+						not args.in_order, args.seed, args.jobs, args.decision)
+	if args.metrics:
+		STAGE_TIMER.write(args.metrics)
+	memo_statistics = ALIGNMENT_MEMO.statistics()
+	logger.info('%d alignments were looked up in the alignment memo, %d were aligned '
+				'and %d were evicted from memory.', memo_statistics["hits"],
+				memo_statistics["misses"], memo_statistics["evictions"])
+	ALIGNMENT_MEMO.close()
 
 if __name__ == "__main__":
 	main()
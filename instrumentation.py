@@ -0,0 +1,152 @@
+import cProfile
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The logger of this module, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# The stages that guesslib is timed in:
+# fastq_read: reading (and sampling) reads from the fastq files
+# r2_lookup: finding the mates of R1 reads in the R2 file
+# temp_write: writing the batches of reads to tmp fasta files
+# aligner_spawn: starting blat or gfClient
+# aligner_runtime: waiting for the aligner (or classifying with the k-mer index)
+# result_parse: reading the blast8 results of the aligner
+# statistics: deciding on the library type, see get_libtype_and_pvalue
+STAGES = ('fastq_read', 'r2_lookup', 'temp_write', 'aligner_spawn',
+			'aligner_runtime', 'result_parse', 'statistics')
+
+# The prefix of the names of the metrics in the Prometheus text format.
+METRIC_PREFIX = 'guesslib'
+
+###--------- FUNCTIONS ---------###
+
+class StageTimer:
+	'''
+	Adds up the wall time spent in, and the nr of items handled by, every
+	stage (see STAGES). Stages can be timed from several threads at once, so
+	with more than one alignment job their times add up to more than the
+	wall time of the run.
+	'''
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.seconds = {}
+		self.counts = {}
+
+	@contextmanager
+	def stage(self, name, count=1):
+		'''
+		Context manager that adds the time spent in it, and count items, to
+		the stage name.
+		'''
+
+		start_time = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add(name, time.perf_counter() - start_time, count)
+
+	def add(self, name, seconds, count=1):
+		'''
+		Adds seconds and count items to the stage name.
+		'''
+
+		with self.lock:
+			self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+			self.counts[name] = self.counts.get(name, 0) + count
+
+	def reset(self):
+		'''
+		Forgets the times and counts of all stages.
+		'''
+
+		with self.lock:
+			self.seconds.clear()
+			self.counts.clear()
+
+	def statistics(self):
+		'''
+		Returns a dictionary from every stage that was timed to its seconds
+		and count.
+		'''
+
+		with self.lock:
+			return {name: {'seconds': self.seconds[name], 'count': self.counts[name]}
+					for name in self.seconds}
+
+	def prometheus_text(self):
+		'''
+		Returns the times and counts in the Prometheus text exposition format.
+		'''
+
+		statistics = self.statistics()
+		lines = [f'# HELP {METRIC_PREFIX}_stage_seconds_total Wall time spent in a stage.',
+				f'# TYPE {METRIC_PREFIX}_stage_seconds_total counter']
+		lines += [f'{METRIC_PREFIX}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]}'
+					for name, stage in statistics.items()]
+		lines += [f'# HELP {METRIC_PREFIX}_stage_items_total Nr of items handled in a stage.',
+				f'# TYPE {METRIC_PREFIX}_stage_items_total counter']
+		lines += [f'{METRIC_PREFIX}_stage_items_total{{stage="{name}"}} {stage["count"]}'
+					for name, stage in statistics.items()]
+
+		return '\n'.join(lines) + '\n'
+
+	def write(self, metrics_file):
+		'''
+		Writes the times and counts to metrics_file, in the Prometheus text
+		format if its name ends with .prom, and as JSON otherwise.
+		'''
+
+		with open(metrics_file, 'w') as f_out:
+			if metrics_file.endswith('.prom'):
+				f_out.write(self.prometheus_text())
+			else:
+				json.dump(self.statistics(), f_out, indent=1)
+
+
+# The stage timer that guesslib reports to
+STAGE_TIMER = StageTimer()
+
+
+@contextmanager
+def profiled(profile_file=None):
+	'''
+	Context manager that profiles the code in it, if profile_file is given.
+	If its name ends with .html and pyinstrument is installed, the profile is
+	a pyinstrument report, otherwise a cProfile file that can be read with
+	the pstats module or e.g. snakeviz.
+	'''
+
+	if not profile_file:
+		yield
+		return
+
+	if profile_file.endswith('.html'):
+		try:
+			from pyinstrument import Profiler
+		except ImportError:
+			logger.warning('pyinstrument is not installed, writing a cProfile profile instead.')
+		else:
+			profiler = Profiler()
+			profiler.start()
+			try:
+				yield
+			finally:
+				profiler.stop()
+				with open(profile_file, 'w') as f_out:
+					f_out.write(profiler.output_html())
+			return
+
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		yield
+	finally:
+		profiler.disable()
+		profiler.dump_stats(profile_file)
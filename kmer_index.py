@@ -0,0 +1,274 @@
+import os
+import threading
+import numpy as np
+from reference_cache import reference_form
+
+###--------- GLOBAL VARIABLES ---------###
+
+# Specify the length of the k-mers that reads are matched to the reference
+# with, at most 32 (two bits per base in 64 bits).
+KMER_SIZE = 20
+
+# Only the k-mers starting at every KMER_STRIDE'th base of the reference are
+# indexed, to keep the index small. All of the k-mers of a read are looked up,
+# so a read still gets a hit every KMER_STRIDE bases where it matches.
+KMER_STRIDE = 8
+
+# K-mers that occur more often than this in the reference are left out of the
+# index, like the over-occurring tiles of blat.
+MAX_KMER_OCCURRENCES = 64
+
+# Specify how many k-mers of a read must hit a transcript, on the same
+# diagonal, for the transcript to count as a result of the read.
+MIN_KMER_VOTES = 2
+
+# The reference is indexed this many bases at a time, to bound the memory
+# used while the index is built.
+INDEX_CHUNK_SIZE = 1 << 24
+
+# The 2-bit code of every base, 4 for anything that is not a base.
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, bases in enumerate([b'Aa', b'Cc', b'Gg', b'Tt']):
+	for base in bases:
+		BASE_CODES[base] = code
+
+# The k-mer indexes used by this process, by reference.
+KMER_INDEXES = {}
+KMER_INDEXES_LOCK = threading.Lock()
+
+###--------- FUNCTIONS ---------###
+
+def read_fasta(fasta_file):
+	'''
+	Reads a fasta file and returns a list of the names of its sequences, the
+	first word of their headers, and a list of the sequences, as bytes.
+	'''
+
+	names = []
+	seqs = []
+
+	with open(fasta_file, 'rb') as f_in:
+		seq_lines = None
+		for line in f_in:
+			if line.startswith(b'>'):
+				if seq_lines is not None:
+					seqs.append(b''.join(seq_lines))
+				names.append(line[1:].split()[0].decode())
+				seq_lines = []
+			elif seq_lines is not None:
+				seq_lines.append(line.strip())
+		if seq_lines is not None:
+			seqs.append(b''.join(seq_lines))
+
+	return names, seqs
+
+
+def encode_kmers(codes):
+	'''
+	Returns the k-mers of length KMER_SIZE starting at every position of an
+	array of base codes, as 2-bit encoded integers, and an array that is True
+	for the k-mers without any other character than A, C, G and T.
+	'''
+
+	nr_of_kmers = len(codes) - KMER_SIZE + 1
+	if (nr_of_kmers <= 0):
+		return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+
+	kmers = np.zeros(nr_of_kmers, dtype=np.uint64)
+	bases = codes & 3
+	for i in range(KMER_SIZE):
+		kmers <<= np.uint64(2)
+		kmers |= bases[i:i + nr_of_kmers]
+
+	nr_of_invalid = np.concatenate(([0], np.cumsum(codes > 3)))
+	valid = (nr_of_invalid[KMER_SIZE:] == nr_of_invalid[:nr_of_kmers])
+
+	return kmers, valid
+
+
+class KmerIndex:
+	'''
+	An index of the k-mers of a reference transcriptome, see
+	build_kmer_index, that classifies reads by the transcript and strand that
+	most of their k-mers hit, without aligning them.
+	'''
+
+	def __init__(self, names, starts, kmers, positions):
+		self.names = names # The names of the transcripts
+		self.starts = starts # The offsets of the transcripts in the concatenated reference
+		self.kmers = kmers # The sorted k-mers of the reference
+		self.positions = positions # The offsets of the k-mers in the concatenated reference
+
+	def find_hits(self, codes, read_starts):
+		'''
+		Looks up the k-mers of the reads in an array of base codes, starting
+		at read_starts, and returns arrays with the read, the transcript and
+		the diagonal (the offset in the concatenated reference where the
+		read starts) of every hit.
+		'''
+
+		kmers, valid = encode_kmers(codes)
+		query_offsets = np.flatnonzero(valid)
+		kmers = kmers[query_offsets]
+
+		first = np.searchsorted(self.kmers, kmers, 'left')
+		nr_of_hits = np.searchsorted(self.kmers, kmers, 'right') - first
+		hit_queries = np.repeat(np.arange(len(kmers)), nr_of_hits)
+		# The index of every hit, counting up from the first hit of its k-mer
+		hit_indices = (np.arange(len(hit_queries)) + np.repeat(first - np.cumsum(nr_of_hits)
+																+ nr_of_hits, nr_of_hits))
+
+		query_offsets = query_offsets[hit_queries]
+		reads = np.searchsorted(read_starts, query_offsets, 'right') - 1
+		positions = self.positions[hit_indices]
+		transcripts = np.searchsorted(self.starts, positions, 'right') - 1
+		diagonals = positions - (query_offsets - read_starts[reads])
+
+		return reads, transcripts, diagonals
+
+	def align_batch(self, seqs):
+		'''
+		Classifies all of the sequences in seqs and returns a list with one
+		(seq_start, seq_end, nr_of_results, ref_transcript_id) tuple per
+		sequence, like run_blat_batch does. Every transcript and strand that
+		at least MIN_KMER_VOTES k-mers of a read hit on the same diagonal is
+		one result, the one with the most hits is the first. seq_start and
+		seq_end are where the read would align in that transcript, from one,
+		with seq_start > seq_end for a reverse read.
+		'''
+
+		results = [(0, 0, 0, "N/A")] * len(seqs)
+		if not seqs:
+			return results
+
+		# The reads are concatenated, separated by an 'N', and looked up both
+		# as they are and reverse complemented
+		batch = b'N'.join(seq.encode() for seq in seqs)
+		codes = BASE_CODES[np.frombuffer(batch, dtype=np.uint8)]
+		reverse_codes = np.where(codes < 4, 3 - codes, 4).astype(np.uint8)[::-1]
+		read_lengths = np.array([len(seq) for seq in seqs])
+		read_starts = np.concatenate(([0], np.cumsum(read_lengths + 1)[:-1]))
+		# The reverse complements of the reads are in reverse order
+		reverse_starts = len(batch) - (read_starts + read_lengths)[::-1]
+
+		reads, transcripts, diagonals = self.find_hits(codes, read_starts)
+		reverse_reads, reverse_transcripts, reverse_diagonals = self.find_hits(reverse_codes,
+																				reverse_starts)
+		hits = np.stack([np.concatenate((reads, len(seqs) - 1 - reverse_reads)),
+						np.repeat([0, 1], [len(reads), len(reverse_reads)]), # The strand
+						np.concatenate((transcripts, reverse_transcripts)),
+						np.concatenate((diagonals, reverse_diagonals))])
+		diagonal_hits, votes = np.unique(hits, axis=1, return_counts=True)
+
+		# The votes of the best diagonal of every transcript and strand of a read
+		candidates = [{} for seq in seqs]
+		for (read, strand, transcript, diagonal), nr_of_votes in zip(diagonal_hits.T.tolist(),
+																	votes.tolist()):
+			if (nr_of_votes >= MIN_KMER_VOTES
+				and nr_of_votes > candidates[read].get((strand, transcript), (0, 0))[0]):
+				candidates[read][(strand, transcript)] = (nr_of_votes, diagonal)
+
+		for read, read_candidates in enumerate(candidates):
+			if not read_candidates:
+				continue
+			(strand, transcript), (nr_of_votes, diagonal) = max(read_candidates.items(),
+																key=lambda item: item[1][0])
+			seq_start = diagonal - int(self.starts[transcript]) + 1
+			seq_end = seq_start + len(seqs[read]) - 1
+			if (strand == 1):
+				seq_start, seq_end = seq_end, seq_start
+			results[read] = (seq_start, seq_end, len(read_candidates), self.names[transcript])
+
+		return results
+
+
+def build_kmer_index(fasta_file):
+	'''
+	Builds the k-mer index of a reference transcriptome. The transcripts are
+	concatenated, separated by an 'N' so that no k-mer spans two of them, and
+	every KMER_STRIDE'th k-mer is indexed with its offset in the
+	concatenation. K-mers occurring more than MAX_KMER_OCCURRENCES times are
+	left out.
+	'''
+
+	names, seqs = read_fasta(fasta_file)
+	reference = b'N'.join(seqs)
+	starts = np.concatenate(([0], np.cumsum([len(seq) + 1 for seq in seqs])[:-1])).astype(np.int64)
+
+	kmer_chunks = []
+	position_chunks = []
+	for chunk_start in range(0, len(reference), INDEX_CHUNK_SIZE):
+		chunk = np.frombuffer(reference, dtype=np.uint8, offset=chunk_start,
+							count=min(INDEX_CHUNK_SIZE + KMER_SIZE - 1,
+										len(reference) - chunk_start))
+		kmers, valid = encode_kmers(BASE_CODES[chunk])
+		positions = np.arange(chunk_start, chunk_start + len(kmers), dtype=np.int64)
+		indexed = valid & (positions % KMER_STRIDE == 0)
+		kmer_chunks.append(kmers[indexed])
+		position_chunks.append(positions[indexed])
+
+	kmers = np.concatenate(kmer_chunks or [np.zeros(0, dtype=np.uint64)])
+	positions = np.concatenate(position_chunks or [np.zeros(0, dtype=np.int64)])
+	order = np.argsort(kmers, kind='stable')
+	kmers = kmers[order]
+	positions = positions[order]
+
+	unique_kmers, nr_of_occurrences = np.unique(kmers, return_counts=True)
+	common = np.repeat(nr_of_occurrences > MAX_KMER_OCCURRENCES, nr_of_occurrences)
+
+	return KmerIndex(names, starts, kmers[~common], positions[~common])
+
+
+def kmer_index_parameters():
+	'''
+	Returns the parameters that the k-mer index is built with.
+	'''
+
+	return {'kmer_size': KMER_SIZE, 'kmer_stride': KMER_STRIDE,
+			'max_kmer_occurrences': MAX_KMER_OCCURRENCES}
+
+
+def save_kmer_index(fasta_file, directory):
+	'''
+	Builds the k-mer index of the reference and saves it in directory, see
+	reference_cache.reference_form.
+	'''
+
+	kmer_index = build_kmer_index(fasta_file)
+	np.save(os.path.join(directory, 'kmers.npy'), kmer_index.kmers)
+	np.save(os.path.join(directory, 'positions.npy'), kmer_index.positions)
+	np.save(os.path.join(directory, 'starts.npy'), kmer_index.starts)
+	with open(os.path.join(directory, 'names.txt'), 'w') as f_out:
+		f_out.writelines(f'{name}\n' for name in kmer_index.names)
+
+
+def load_kmer_index(fasta_file):
+	'''
+	Returns the k-mer index of the reference, from its cache (see
+	reference_cache.reference_form), building it first if needed. The k-mer
+	arrays are memory mapped, so that the runs using the same reference at
+	the same time share them, and only the parts that are looked up are read.
+	'''
+
+	directory = reference_form(fasta_file, 'kmer_index', save_kmer_index,
+								kmer_index_parameters())
+
+	with open(os.path.join(directory, 'names.txt')) as f_in:
+		names = f_in.read().splitlines()
+
+	return KmerIndex(names, np.load(os.path.join(directory, 'starts.npy')),
+					np.load(os.path.join(directory, 'kmers.npy'), mmap_mode='r'),
+					np.load(os.path.join(directory, 'positions.npy'), mmap_mode='r'))
+
+
+def get_kmer_index(ref):
+	'''
+	Returns the k-mer index of the reference 'reference_sequences/' + ref,
+	loading it the first time it is used by this process.
+	'''
+
+	with KMER_INDEXES_LOCK: # Alignment jobs running at the same time share the index
+		if ref not in KMER_INDEXES:
+			KMER_INDEXES[ref] = load_kmer_index(os.path.join('reference_sequences', ref))
+
+		return KMER_INDEXES[ref]
@@ -0,0 +1,87 @@
+import json
+import logging
+import logging.handlers
+import sys
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The log levels of the programs. At info, the default, guesslib logs what it
+# does per batch of reads and its result, at debug also what it found for
+# every read.
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+LOG_LEVEL = 'info'
+
+# The per-read trace is written to its file through a buffer of this many
+# records, see configure_logging.
+TRACE_BUFFER_SIZE = 1000
+
+# The logger of the per-read trace and the summary of a run. It only logs
+# when configure_logging is given a trace file, and never to the screen.
+TRACE = logging.getLogger('guesslib.trace')
+TRACE.propagate = False
+TRACE.setLevel(logging.CRITICAL)
+
+###--------- FUNCTIONS ---------###
+
+class JsonLinesFormatter(logging.Formatter):
+	'''
+	Formats a log record as one line of JSON, with its time, level, logger
+	and message (the event), and the fields it was logged with, see trace.
+	'''
+
+	def format(self, record):
+		line = {'time': record.created, 'level': record.levelname,
+				'logger': record.name, 'event': record.getMessage()}
+		line.update(getattr(record, 'fields', {}))
+
+		return json.dumps(line)
+
+
+def trace(event, level=logging.DEBUG, **fields):
+	'''
+	Logs an event with its fields to the trace. Per-read events should only
+	be traced if TRACE.isEnabledFor(logging.DEBUG), so that they cost nothing
+	without a trace file.
+	'''
+
+	TRACE.log(level, event, extra={'fields': fields})
+
+
+def remove_handlers(logger):
+	'''
+	Removes and closes the handlers of a logger, flushing the buffered ones.
+	'''
+
+	for handler in logger.handlers[:]:
+		logger.removeHandler(handler)
+		target = getattr(handler, 'target', None)
+		handler.close()
+		if target is not None:
+			target.close()
+
+
+def configure_logging(level=LOG_LEVEL, trace_file=None, stream=None):
+	'''
+	Sets up the logging of a program: messages of level (see LOG_LEVELS) and
+	up are written to stream, stdout by default, as plain text. If trace_file
+	is given, the per-read trace and the summary of every run are written to
+	it as JSON lines, through a buffer of TRACE_BUFFER_SIZE records. Can be
+	called again, e.g. for every sample of a batch, to replace the handlers.
+	'''
+
+	root = logging.getLogger()
+	remove_handlers(root)
+	handler = logging.StreamHandler(stream or sys.stdout)
+	handler.setFormatter(logging.Formatter('%(message)s'))
+	root.addHandler(handler)
+	root.setLevel(level.upper())
+
+	remove_handlers(TRACE)
+	TRACE.setLevel(logging.CRITICAL)
+	if trace_file:
+		file_handler = logging.FileHandler(trace_file, 'w')
+		file_handler.setFormatter(JsonLinesFormatter())
+		TRACE.addHandler(logging.handlers.MemoryHandler(TRACE_BUFFER_SIZE,
+														flushLevel=logging.CRITICAL,
+														target=file_handler))
+		TRACE.setLevel(logging.DEBUG)
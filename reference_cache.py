@@ -0,0 +1,219 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The logger of this module, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# The preprocessed forms of a reference (a .2bit file, a k-mer index, ...)
+# are cached in a directory next to it, named after it with this suffix.
+# Every form has its own subdirectory, with a key file describing the version
+# of the reference and the parameters it was built from.
+CACHE_SUFFIX = '.cache'
+CACHE_KEY_FILE = 'key.json'
+
+# Specify how many bytes of the reference are hashed at a time.
+HASH_CHUNK_SIZE = 1 << 20
+
+# Only one thread of this process builds a form at a time.
+CACHE_LOCK = threading.Lock()
+
+# The forms that could not be cached, because the directory of their
+# reference is read-only, built in a temporary directory for this process
+# only, by reference, name and key. They are removed when the process exits.
+PROCESS_FORMS = {}
+
+# The sha256 hashes of the references, by reference, size and mtime, so that
+# they are only read from their cache (or computed) once per process.
+REFERENCE_HASHES = {}
+
+###--------- FUNCTIONS ---------###
+
+def cache_path(fasta_file, name):
+	'''
+	Returns the directory where the form name of the reference fasta_file is
+	cached.
+	'''
+
+	return os.path.join(fasta_file + CACHE_SUFFIX, name)
+
+
+def file_hash(file_name):
+	'''
+	Returns the sha256 hash of the contents of a file.
+	'''
+
+	sha256 = hashlib.sha256()
+	with open(file_name, 'rb') as f_in:
+		for chunk in iter(lambda: f_in.read(HASH_CHUNK_SIZE), b''):
+			sha256.update(chunk)
+
+	return sha256.hexdigest()
+
+
+def read_cache_key(directory):
+	'''
+	Returns the key a cached form was stored with, or None if there is none.
+	'''
+
+	try:
+		with open(os.path.join(directory, CACHE_KEY_FILE)) as f_in:
+			return json.load(f_in)
+	except (IOError, ValueError):
+		return None
+
+
+def write_cache_key(directory, key):
+	'''
+	Writes the key of a cached form.
+	'''
+
+	with open(os.path.join(directory, CACHE_KEY_FILE), 'w') as f_out:
+		json.dump(key, f_out)
+
+
+def is_cached(directory, key, fasta_file):
+	'''
+	Returns True if the form cached in directory was built from the current
+	version of the reference with the parameters of key. A reference with the
+	size and mtime of the cached form is assumed to be unchanged, otherwise
+	its contents are hashed. If only its mtime had changed, the cached form
+	is kept and its key is updated.
+	'''
+
+	cached_key = read_cache_key(directory)
+	if (cached_key is None or cached_key['size'] != key['size']
+		or cached_key['parameters'] != key['parameters']):
+		return False
+	if (cached_key['mtime_ns'] == key['mtime_ns']):
+		return True
+
+	key['sha256'] = file_hash(fasta_file)
+	if (cached_key['sha256'] != key['sha256']):
+		return False
+	try:
+		write_cache_key(directory, key)
+	except IOError: # The form is still used, the reference is just hashed again next time
+		pass
+
+	return True
+
+
+def cached_reference(fasta_file, name, build, parameters=None):
+	'''
+	Returns the directory with the form name of the reference fasta_file,
+	building it first, with build(fasta_file, directory), if it hasn't been
+	built yet for the current version of the reference (its size, mtime and
+	hash) and parameters. A form is built in a directory of its own and then
+	renamed into place, so that runs at the same time never see half of one,
+	and runs that still use the files of a replaced form can keep using them.
+	Returns None if the form isn't cached and can't be, because the directory
+	of the reference is read-only, see reference_form.
+	'''
+
+	directory = cache_path(fasta_file, name)
+	fasta_stat = os.stat(fasta_file)
+	key = {
+		'size': fasta_stat.st_size,
+		'mtime_ns': fasta_stat.st_mtime_ns,
+		'parameters': parameters
+	}
+
+	with CACHE_LOCK:
+		if is_cached(directory, key, fasta_file):
+			return directory
+
+		new_directory = f'{directory}.{os.getpid()}.new'
+		shutil.rmtree(new_directory, ignore_errors=True)
+		try:
+			os.makedirs(new_directory)
+		except OSError: # The directory of the reference is read-only
+			return None
+		logger.info('Caching the %s form of %s.', name, fasta_file)
+		if 'sha256' not in key:
+			key['sha256'] = file_hash(fasta_file)
+		try:
+			build(fasta_file, new_directory)
+			write_cache_key(new_directory, key)
+			if os.path.exists(directory): # Replacing a form of an older version
+				old_directory = f'{directory}.{os.getpid()}.old'
+				os.rename(directory, old_directory)
+				shutil.rmtree(old_directory, ignore_errors=True)
+			os.rename(new_directory, directory)
+		except OSError: # Another run cached the form in the meantime
+			shutil.rmtree(new_directory, ignore_errors=True)
+			if not is_cached(directory, key, fasta_file):
+				raise
+		except BaseException:
+			shutil.rmtree(new_directory, ignore_errors=True)
+			raise
+
+	return directory
+
+
+def reference_form(fasta_file, name, build, parameters=None):
+	'''
+	Returns the directory with the form name of the reference fasta_file, see
+	cached_reference. If it can't be cached, it is built in a temporary
+	directory instead, once per process.
+	'''
+
+	directory = cached_reference(fasta_file, name, build, parameters)
+	if directory is not None:
+		return directory
+
+	fasta_stat = os.stat(fasta_file)
+	key = (fasta_file, name, fasta_stat.st_size, fasta_stat.st_mtime_ns, json.dumps(parameters))
+	with CACHE_LOCK:
+		if key not in PROCESS_FORMS:
+			logger.warning('The %s form of %s can not be cached, it is built for this run only.',
+							name, fasta_file)
+			directory = tempfile.mkdtemp(prefix=f'{name}_')
+			try:
+				build(fasta_file, directory)
+			except BaseException:
+				shutil.rmtree(directory, ignore_errors=True)
+				raise
+			PROCESS_FORMS[key] = directory
+
+		return PROCESS_FORMS[key]
+
+
+def remove_process_forms():
+	'''
+	Removes the forms that were built for this process only, see
+	reference_form.
+	'''
+
+	for directory in PROCESS_FORMS.values():
+		shutil.rmtree(directory, ignore_errors=True)
+	PROCESS_FORMS.clear()
+
+atexit.register(remove_process_forms)
+
+
+def reference_hash(fasta_file):
+	'''
+	Returns the sha256 hash of the contents of the reference fasta_file. It is
+	cached like a form of the reference, so it is only computed again when
+	the reference has changed, or else, if the directory of the reference is
+	read-only, computed once per process.
+	'''
+
+	fasta_stat = os.stat(fasta_file)
+	key = (fasta_file, fasta_stat.st_size, fasta_stat.st_mtime_ns)
+	if key not in REFERENCE_HASHES:
+		directory = cached_reference(fasta_file, 'sha256', lambda fasta_file, directory: None)
+		if directory is None:
+			REFERENCE_HASHES[key] = file_hash(fasta_file)
+		else:
+			REFERENCE_HASHES[key] = read_cache_key(directory)['sha256']
+
+	return REFERENCE_HASHES[key]
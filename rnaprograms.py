@@ -0,0 +1,184 @@
+import argparse
+import importlib
+import logging
+from itertools import islice
+
+###--------- GLOBAL VARIABLES ---------###
+
+# The logger of this program, see logging_config.py
+logger = logging.getLogger(__name__)
+
+# The subcommands of rnaprograms, with the module that runs them and a
+# description. The modules are only imported when their subcommand is run,
+# so that starting rnaprograms, or asking for its help, doesn't wait for
+# numpy and scipy to be imported.
+COMMANDS = {
+	'check-single': ('fastq_checker_single',
+					"check a FASTQ file and write its best reads"),
+	'check-pair': ('fastq_checker_pair',
+					"check a pair of FASTQ files and write their best pairs"),
+	'guess-single': ('guesslib_single',
+					"determine the library type of single reads"),
+	'guess-pair': ('guesslib_pair',
+					"determine the library type of paired reads"),
+	'guess-genomic': ('guesslib_genomic_pair',
+					"determine the orientation of paired reads against a genome"),
+	'guess-batch': ('guesslib_batch',
+					"determine the library types of the samples of a manifest"),
+	'check-guess-single': ('guesslib_single',
+							"check-single and guess-single in one process"),
+	'check-guess-pair': ('guesslib_pair',
+						"check-pair and guess-pair in one process"),
+	'check-guess-genomic': ('guesslib_genomic_pair',
+							"check-pair and guess-genomic in one process")
+}
+
+###--------- FUNCTIONS ---------###
+
+def check_and_guess(command, argv=None, prog=None):
+	'''
+	Runs the fastq checker and then guesslib (the module of the check-guess
+	command, see COMMANDS) in one process. A sample of the reads selected by
+	the checker is kept in memory (see fastq_sampler.RecordSample) and
+	aligned by guesslib, so the checked FASTQ files are never written and
+	read back. With --stream, the reads
+	that pass a fixed quality threshold are aligned in file order as they are
+	read instead, see stream_checked_reads, and no more of the files is read
+	once the library type is determined.
+	'''
+
+	# Imported here, like the modules of the other commands
+	from aligners import ALIGNERS, ALIGNMENT_JOBS, ALIGNMENT_MEMO
+	from decision import DECISION_MODES
+	from fastq_io import record_id, record_sequence
+	from fastq_qc import (PHRED_OFFSET, STREAM_QUALITY_THRESHOLD, FastqFormatError,
+		stream_checked_reads)
+	from fastq_sampler import SAMPLE_SEED
+	from logging_config import LOG_LEVEL, LOG_LEVELS, configure_logging
+
+	parser = argparse.ArgumentParser(prog=prog, description=COMMANDS[command][1])
+	parser.add_argument("-r", "--reference", required=True, help="reference sequence")
+	if (command == 'check-guess-single'):
+		parser.add_argument("-f", "--user_transcripts", required=True, help="FASTQ library")
+	else:
+		parser.add_argument("-f1", "--file_1", required=True, help="FASTQ file one")
+		parser.add_argument("-f2", "--file_2", required=True,
+							help="corresponding FASTQ of paired sequences")
+	parser.add_argument("-p", "--phred_offset", type=int, choices=[33, 64],
+						default=PHRED_OFFSET, help="ascii offset of the quality scores")
+	parser.add_argument("--stream", action="store_true",
+						help="align the reads above the quality threshold while "
+						"the files are read, instead of checking the whole files first")
+	parser.add_argument("-q", "--quality_threshold", type=int,
+						default=STREAM_QUALITY_THRESHOLD,
+						help="quality threshold of the streamed reads")
+	parser.add_argument("-a", "--aligner", choices=ALIGNERS, default="blat",
+						help="blat, a gfServer that keeps the reference loaded, "
+						"or an in-process k-mer index")
+	parser.add_argument("-s", "--seed", type=int, default=SAMPLE_SEED,
+						help="seed of the random sample of reads")
+	parser.add_argument("--in_order", action="store_true",
+						help="align the checked reads in file order instead of sampling them")
+	parser.add_argument("-j", "--jobs", type=int, default=ALIGNMENT_JOBS,
+						help="nr of read batches to align at the same time")
+	parser.add_argument("-d", "--decision", choices=DECISION_MODES, default="fisher",
+						help="Fisher's exact test, or a sequential test that stops "
+						"as soon as the library type is clear")
+	parser.add_argument("-m", "--memo_db",
+						help="SQLite file that alignment results are kept in between runs")
+	parser.add_argument("-v", "--log_level", choices=LOG_LEVELS, default=LOG_LEVEL,
+						help="debug also logs every read")
+	parser.add_argument("--trace",
+						help="JSON lines file to write a record of every read and a summary to")
+	args = parser.parse_args(argv)
+
+	configure_logging(args.log_level, args.trace)
+
+	guesslib = importlib.import_module(COMMANDS[command][0])
+
+	if (args.stream and command == 'check-guess-single'):
+		checked_reads = stream_checked_reads([args.user_transcripts], args.quality_threshold,
+											args.phred_offset)
+		reads = islice(((record_id(record), record_sequence(record))
+						for record, in checked_reads), guesslib.MAX_BLATS)
+	elif args.stream:
+		checked_reads = stream_checked_reads([args.file_1, args.file_2], args.quality_threshold,
+											args.phred_offset)
+		pairs = islice(((record_id(record_R1), record_sequence(record_R1),
+							record_sequence(record_R2))
+						for record_R1, record_R2 in checked_reads), guesslib.MAX_BLATS)
+	elif (command == 'check-guess-single'):
+		from fastq_checker_single import check_format_and_remove_low_quality_reads_single
+		from fastq_sampler import RecordSample, reads_from_records
+
+		selected_reads = RecordSample(guesslib.MAX_BLATS, not args.in_order, args.seed)
+		proper_format = check_format_and_remove_low_quality_reads_single(args.user_transcripts,
+																		args.phred_offset,
+																		selected_reads)[0]
+		if not proper_format:
+			return
+		reads = reads_from_records(selected_reads.records())
+	else:
+		from fastq_checker_pair import check_format_and_remove_low_quality_reads_pair
+		from fastq_sampler import RecordSample, pairs_from_records
+
+		selected_pairs = RecordSample(guesslib.MAX_BLATS, not args.in_order, args.seed)
+		proper_formats = check_format_and_remove_low_quality_reads_pair(args.file_1, args.file_2,
+																		args.phred_offset,
+																		selected_pairs)[0]
+		if not proper_formats:
+			return
+		pairs = pairs_from_records(selected_pairs.records())
+
+	if args.memo_db:
+		ALIGNMENT_MEMO.open_database(args.memo_db)
+
+	try:
+		if (command == 'check-guess-single'):
+			guesslib.guesslib_single(args.reference, args.user_transcripts, args.aligner,
+									not args.in_order, args.seed, args.jobs, args.decision,
+									reads)
+		elif (command == 'check-guess-pair'):
+			guesslib.guesslib_pair(args.reference, args.file_1, args.file_2, args.aligner,
+									not args.in_order, args.seed, args.jobs, args.decision,
+									pairs)
+		else:
+			guesslib.guesslib_genomic_pair(args.reference, args.file_1, args.file_2,
+											args.aligner, not args.in_order, args.seed,
+											args.jobs, args.decision, pairs)
+	except FastqFormatError as error: # Only found while streaming
+		logger.error(error)
+	finally:
+		if args.stream:
+			checked_reads.close() # Not reading the rest of the files
+	memo_statistics = ALIGNMENT_MEMO.statistics()
+	logger.info('%d alignments were looked up in the alignment memo, %d were aligned '
+				'and %d were evicted from memory.', memo_statistics["hits"],
+				memo_statistics["misses"], memo_statistics["evictions"])
+	ALIGNMENT_MEMO.close()
+
+
+###--------- MAIN ---------###
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description="Check FASTQ files and determine "
+									"their library type, see rnaprograms <command> -h.",
+									epilog="\n".join(f'{command}: {description}'
+														for command, (module, description)
+														in COMMANDS.items()),
+									formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("command", choices=COMMANDS, metavar="command",
+						help="one of the commands below")
+	parser.add_argument("arguments", nargs=argparse.REMAINDER,
+						help="the arguments of the command")
+	args = parser.parse_args(argv)
+
+	prog = f'{parser.prog} {args.command}'
+	if args.command.startswith('check-guess-'):
+		check_and_guess(args.command, args.arguments, prog)
+	else:
+		importlib.import_module(COMMANDS[args.command][0]).main(args.arguments, prog)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aligners
+
+
+def slow_square(i):
+	'''
+	Squares i, taking longer for the first values, so that later calls end
+	first.
+	'''
+
+	time.sleep(0.01 * (10 - i % 10))
+	return i * i
+
+
+def align_or_wait(i):
+	'''
+	Returns i at once for the first call, the others run an aligner that
+	would take a minute.
+	'''
+
+	if (i > 0):
+		aligners.run_aligner(['sleep', '60'], 1)
+	return i
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_results_in_order(jobs):
+	assert list(aligners.map_in_order(slow_square, ((i,) for i in range(30)), jobs)) == [
+		i * i for i in range(30)]
+
+
+def test_args_only_read_as_needed():
+	read = []
+	args_list = ((read.append(i) or i,) for i in range(100))
+
+	results = aligners.map_in_order(slow_square, args_list, 4)
+	assert next(results) == 0
+	results.close()
+
+	assert len(read) <= 5
+
+
+@pytest.mark.skipif(shutil.which('sleep') is None, reason='needs sleep')
+def test_close_kills_running_aligners():
+	start_time = time.time()
+
+	results = aligners.map_in_order(align_or_wait, ((i,) for i in range(10)), 4)
+	assert next(results) == 0
+	time.sleep(0.5) # Letting the other jobs start their aligners
+	results.close()
+
+	assert time.time() - start_time < 10
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import alignment_memo
+from alignment_memo import AlignmentMemo
+
+RESULTS = {f'ACGT{i}': (1, 100 + i, 1, f't{i}') for i in range(5)}
+
+
+@pytest.fixture
+def memo():
+	memo = AlignmentMemo(max_size=3)
+	yield memo
+	memo.close()
+
+
+def test_least_recently_used_results_are_evicted(memo):
+	memo.store('key', dict(list(RESULTS.items())[:3]))
+	memo.lookup('key', ['ACGT0']) # ACGT1 is now the least recently used
+
+	memo.store('key', {'ACGT3': RESULTS['ACGT3']})
+
+	assert memo.lookup('key', ['ACGT0', 'ACGT1', 'ACGT2', 'ACGT3']) == [
+		RESULTS['ACGT0'], None, RESULTS['ACGT2'], RESULTS['ACGT3']]
+	assert memo.statistics() == {'hits': 4, 'misses': 1, 'evictions': 1, 'size': 3}
+
+
+def test_results_are_kept_per_memo_key(memo):
+	memo.store('key', {'ACGT0': RESULTS['ACGT0']})
+
+	assert memo.lookup('other key', ['ACGT0']) == [None]
+
+
+def test_database_round_trip(tmp_path, monkeypatch):
+	monkeypatch.setattr(alignment_memo, 'DATABASE_QUERY_SIZE', 2) # Several queries
+	database = str(tmp_path / 'memo.sqlite')
+	memo = AlignmentMemo(max_size=2, database=database)
+	memo.store('key', RESULTS)
+	memo.close()
+
+	memo = AlignmentMemo(max_size=2, database=database) # The next run
+	try:
+		seqs = list(RESULTS) + ['TTTT']
+		assert memo.lookup('key', seqs) == list(RESULTS.values()) + [None]
+		assert memo.lookup('other key', list(RESULTS)) == [None] * len(RESULTS)
+		assert memo.statistics()['size'] == 2
+	finally:
+		memo.close()
+
+
+def test_database_results_are_replaced(tmp_path):
+	database = str(tmp_path / 'memo.sqlite')
+	memo = AlignmentMemo(database=database)
+	memo.store('key', {'ACGT0': RESULTS['ACGT0']})
+	memo.store('key', {'ACGT0': (0, 0, 0, 'N/A')})
+	memo.close()
+
+	memo = AlignmentMemo(database=database)
+	try:
+		assert memo.lookup('key', ['ACGT0']) == [(0, 0, 0, 'N/A')]
+	finally:
+		memo.close()
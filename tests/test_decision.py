@@ -0,0 +1,83 @@
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import decision
+
+# Three library types that are hard enough to tell apart that the tests take
+# many reads, so that their errors can be measured.
+PROBABILITIES = {
+	'A': {'x': 0.5, 'y': 0.3, 'z': 0.2},
+	'B': {'x': 0.3, 'y': 0.5, 'z': 0.2},
+	'C': {'x': 0.3, 'y': 0.3, 'z': 0.4},
+}
+
+
+def decided(test, lib_type, rng, max_reads=10000):
+	'''
+	Updates the test with reads of lib_type until it decides, returns its
+	decision.
+	'''
+
+	read_types = list(PROBABILITIES[lib_type])
+	weights = list(PROBABILITIES[lib_type].values())
+	for read_type in rng.choices(read_types, weights, k=max_reads):
+		test.update(read_type)
+		if (test.decision()[1] <= test.error_budget):
+			break
+
+	return test.decision()
+
+
+@pytest.mark.parametrize('decision_mode', ['sprt', 'bayes'])
+def test_no_decision_before_the_first_read(decision_mode):
+	test = decision.sequential_test(decision_mode, PROBABILITIES)
+
+	test.update('unknown') # Carries no evidence
+
+	assert test.decision() == ('N/A', 1.0)
+	assert test.nr_of_reads == 0
+
+
+def test_sprt_error_is_the_likelihood_ratio():
+	test = decision.sequential_test('sprt', PROBABILITIES)
+
+	for read_type in 'xxy':
+		test.update(read_type)
+
+	likelihoods = {lib_type: math.prod(PROBABILITIES[lib_type][read_type] for read_type in 'xxy')
+					for lib_type in PROBABILITIES}
+	best, second_best = sorted(likelihoods.values(), reverse=True)[:2]
+	assert test.decision() == ('A', pytest.approx(second_best / best))
+
+
+def test_bayes_error_is_the_posterior_of_the_other_types():
+	test = decision.sequential_test('bayes', PROBABILITIES)
+
+	for read_type in 'xxy':
+		test.update(read_type)
+
+	likelihoods = {lib_type: math.prod(PROBABILITIES[lib_type][read_type] for read_type in 'xxy')
+					for lib_type in PROBABILITIES}
+	assert test.decision() == ('A', pytest.approx(1 - likelihoods['A'] / sum(likelihoods.values())))
+
+
+@pytest.mark.parametrize('decision_mode, error_bound', [('sprt', 2 * 0.05), ('bayes', 0.05)])
+def test_wrong_decisions_within_the_error_budget(decision_mode, error_bound):
+	rng = random.Random(1)
+	nr_of_runs = 600
+	nr_wrong = 0
+
+	for run in range(nr_of_runs):
+		lib_type = 'ABC'[run % 3]
+		test = decision.sequential_test(decision_mode, PROBABILITIES, error_budget=0.05)
+		decided_type, error = decided(test, lib_type, rng)
+		assert error <= 0.05
+		nr_wrong += (decided_type != lib_type)
+
+	assert nr_wrong / nr_of_runs <= error_bound
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastq_checker_pair
+import fastq_checker_single
+
+FASTQ = ''.join(f'@r{i}\nACGT\n+\nIIII\n' for i in range(10))
+MALFORMED_FASTQ = FASTQ.replace('@r1\nACGT', '@r1\nACXT')
+
+
+@pytest.fixture
+def fastq_files(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path) # The checked files are written to the working directory
+	(tmp_path / 'good.fq').write_text(FASTQ)
+	(tmp_path / 'bad.fq').write_text(MALFORMED_FASTQ)
+	return 'good.fq', 'bad.fq'
+
+
+def test_pair_checker(fastq_files, capsys):
+	good, bad = fastq_files
+
+	proper_formats, nr_of_seqs_fout = (
+		fastq_checker_pair.check_format_and_remove_low_quality_reads_pair(good, good)[:2])
+
+	assert proper_formats
+	assert nr_of_seqs_fout == 10
+	assert 'All of the sequences in the out files have average qualities above' in (
+		capsys.readouterr().out)
+
+
+@pytest.mark.parametrize('files', [(0, 1), (1, 0)])
+def test_pair_checker_with_malformed_file(fastq_files, capsys, files):
+	fastq_file_1, fastq_file_2 = (fastq_files[i] for i in files)
+
+	proper_formats, nr_of_seqs_fout = (
+		fastq_checker_pair.check_format_and_remove_low_quality_reads_pair(fastq_file_1,
+																		fastq_file_2)[:2])
+
+	output = capsys.readouterr().out
+	assert not proper_formats
+	assert nr_of_seqs_fout == 0
+	assert 'has other characters than ATGCN' in output
+	assert 'average qualities above' not in output
+
+
+def test_single_checker_with_malformed_file(fastq_files, capsys):
+	proper_format = fastq_checker_single.check_format_and_remove_low_quality_reads_single(
+		fastq_files[1])[0]
+
+	output = capsys.readouterr().out
+	assert not proper_format
+	assert 'average quality above' not in output
@@ -0,0 +1,32 @@
+import gzip
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastq_io import DecompressorStream
+
+pytestmark = pytest.mark.skipif(shutil.which('gzip') is None, reason='needs gzip')
+
+FASTQ = b''.join(b'@r%d\nACGT\n+\nIIII\n' % i for i in range(100000))
+
+
+@pytest.fixture
+def truncated_gz(tmp_path):
+	path = tmp_path / 'truncated.fq.gz'
+	path.write_bytes(gzip.compress(FASTQ)[:-100])
+	return str(path)
+
+
+def test_truncated_file_read_to_the_end(truncated_gz):
+	with pytest.raises(IOError):
+		with DecompressorStream(['gzip', '-dc', truncated_gz]) as f_in:
+			f_in.read()
+
+
+def test_truncated_file_read_partly(truncated_gz):
+	with DecompressorStream(['gzip', '-dc', truncated_gz]) as f_in:
+		assert f_in.readline() == b'@r0\n'
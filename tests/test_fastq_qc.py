@@ -0,0 +1,116 @@
+import gzip
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastq_qc
+
+# Reads of two bands, alternating, so the lower band is appended from a spool
+# after the last record of the file.
+RECORDS = [(f'r{i}', 'ACGT', 'IIII' if i % 2 == 0 else '5555') for i in range(5)]
+
+
+def write_fastq(path, records, final_newline, newline='\n'):
+	'''
+	Writes the records to a plain or gzip (.gz) fastq file, with or without
+	a newline at its end, and with '\n' or '\r\n' newlines.
+	'''
+
+	data = '\n'.join(f'@{header}\n{sequence}\n+\n{qualities}'
+					for header, sequence, qualities in records)
+	if final_newline:
+		data += '\n'
+	with (gzip.open if path.endswith('.gz') else open)(path, 'wt', newline=newline) as f_out:
+		f_out.write(data)
+
+
+@pytest.mark.parametrize('name', ['in.fq', 'in.fq.gz'])
+def test_written_records_without_final_newline(tmp_path, name):
+	fastq_file = str(tmp_path / name)
+	write_fastq(fastq_file, RECORDS, final_newline=False)
+	expected = tmp_path / 'expected.fq'
+	write_fastq(str(expected), [record for record in RECORDS if record[2] == 'IIII']
+				+ [record for record in RECORDS if record[2] == '5555'], final_newline=True)
+
+	bands = fastq_qc.calculate_quality_bands([fastq_file], 40)[0]
+	fastq_qc.write_selected_reads([fastq_file], [str(tmp_path / 'out.fq')], bands, 0)
+
+	assert (tmp_path / 'out.fq').read_bytes() == expected.read_bytes()
+
+
+def test_top_records_without_final_newline(tmp_path):
+	fastq_file = str(tmp_path / 'in.fq')
+	write_fastq(fastq_file, RECORDS, final_newline=False)
+	expected = tmp_path / 'expected.fq'
+	write_fastq(str(expected), RECORDS, final_newline=True)
+
+	selected = fastq_qc.select_top_reads([fastq_file], len(RECORDS))[0]
+	fastq_qc.write_records([str(tmp_path / 'out.fq')], [records for qualities, records in selected])
+
+	assert (tmp_path / 'out.fq').read_bytes() == expected.read_bytes()
+
+
+@pytest.mark.parametrize('name', ['in.fq', 'in.fq.gz'])
+@pytest.mark.parametrize('final_newline', [True, False])
+def test_written_records_with_crlf_newlines(tmp_path, name, final_newline):
+	fastq_file = str(tmp_path / name)
+	write_fastq(fastq_file, RECORDS, final_newline, newline='\r\n')
+	expected = tmp_path / 'expected.fq'
+	write_fastq(str(expected), [record for record in RECORDS if record[2] == 'IIII']
+				+ [record for record in RECORDS if record[2] == '5555'], final_newline=True)
+
+	bands, histogram = fastq_qc.calculate_quality_bands([fastq_file], 40)[:2]
+	fastq_qc.write_selected_reads([fastq_file], [str(tmp_path / 'out.fq')], bands, 0)
+
+	assert sum(histogram.values()) == len(RECORDS)
+	assert (tmp_path / 'out.fq').read_bytes() == expected.read_bytes()
+
+
+def test_top_records_with_crlf_newlines(tmp_path):
+	fastq_file = str(tmp_path / 'in.fq')
+	write_fastq(fastq_file, RECORDS, final_newline=True, newline='\r\n')
+	expected = tmp_path / 'expected.fq'
+	write_fastq(str(expected), RECORDS, final_newline=True)
+
+	selected = fastq_qc.select_top_reads([fastq_file], len(RECORDS))[0]
+	fastq_qc.write_records([str(tmp_path / 'out.fq')], [records for qualities, records in selected])
+
+	assert (tmp_path / 'out.fq').read_bytes() == expected.read_bytes()
+
+
+@pytest.mark.parametrize('records', [RECORDS + [('empty', '', '')],
+									RECORDS + [('r0', '', ''), ('r0', 'ACGT', 'IIII')]])
+def test_in_file_averages_leave_out_empty_reads(tmp_path, records):
+	fastq_file = str(tmp_path / 'in.fq')
+	write_fastq(fastq_file, records, final_newline=True)
+
+	fin_qualities, nr_of_seqs_fin = fastq_qc.calculate_quality_bands([fastq_file], 40)[2:4]
+	top_qualities, top_nr_of_seqs = fastq_qc.select_top_reads([fastq_file], len(records))[1:]
+
+	with_bases = [qualities for header, sequence, qualities in records if sequence]
+	assert nr_of_seqs_fin == top_nr_of_seqs == len(with_bases)
+	assert fin_qualities == pytest.approx(top_qualities)
+	assert fin_qualities[0] == pytest.approx(sum(ord(qualities[0]) - 33
+												for qualities in with_bases))
+
+
+@pytest.mark.parametrize('lengths', [[4, 4, 4], [4, 2, 0, 3], [4, 2, 1000]])
+def test_read_statistics_per_position(lengths):
+	records = [(b'@r\n', b'ACGN'[:length % 5].ljust(length, b'a') + b'\n', b'+\n',
+				bytes(33 + (i + position) % 41 for position in range(length)) + b'\n')
+				for i, length in enumerate(lengths)]
+	statistics = fastq_qc.ReadStatistics()
+
+	statistics.add(fastq_qc.records_read_batch(records))
+
+	summary = statistics.summary()
+	for position, quality in enumerate(summary['position_qualities']):
+		qualities = [record[3][position] - 33 for record in records if len(record[3]) > position + 1]
+		assert quality == pytest.approx(sum(qualities) / len(qualities))
+	assert len(summary['position_qualities']) == max(lengths)
+	assert summary['nr_of_bases'] == sum(lengths)
+	assert summary['reads_with_n'] == pytest.approx(sum(b'N' in record[1] for record in records)
+													/ len(records))
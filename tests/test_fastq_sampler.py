@@ -0,0 +1,112 @@
+import gzip
+import os
+import random
+import sys
+from contextlib import closing
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastq_sampler
+from fastq_io import read_fastq_records
+
+NR_OF_RECORDS = 1000
+
+
+@pytest.fixture
+def fastq_file(tmp_path):
+	path = tmp_path / 'in.fq'
+	path.write_bytes(b''.join(b'@r%d\nACGT\n+\nIIII\n' % i for i in range(NR_OF_RECORDS)))
+	return str(path)
+
+
+def sampled_ids(records):
+	return [seq_id for seq_id, seq in fastq_sampler.reads_from_records(records)]
+
+
+def test_record_sample_is_bounded_and_copied(fastq_file):
+	sample = fastq_sampler.RecordSample(10)
+	sample.extend(read_fastq_records(fastq_file))
+
+	records = sample.records()
+	assert len(records) == 10
+	assert len(set(sampled_ids(records))) == 10
+	assert all(isinstance(line, bytes) for record in records for line in record)
+
+
+def test_record_sample_is_reproducible(fastq_file):
+	samples = []
+	for seed in (1, 1, 2):
+		sample = fastq_sampler.RecordSample(10, seed=seed)
+		sample.extend(read_fastq_records(fastq_file))
+		samples.append(sampled_ids(sample.records()))
+
+	assert samples[0] == samples[1]
+	assert samples[0] != samples[2]
+
+
+def test_record_sample_covers_the_whole_file(fastq_file):
+	sample = fastq_sampler.RecordSample(100)
+	sample.extend(read_fastq_records(fastq_file))
+
+	assert max(int(seq_id[1:]) for seq_id in sampled_ids(sample.records())) >= NR_OF_RECORDS // 2
+
+
+def test_record_sample_in_order_keeps_the_first_records(fastq_file):
+	sample = fastq_sampler.RecordSample(10, sample_reads=False)
+	sample.extend(read_fastq_records(fastq_file))
+
+	assert sampled_ids(sample.records()) == [f'r{i}' for i in range(10)]
+
+
+def test_record_sample_of_pairs(fastq_file):
+	sample = fastq_sampler.RecordSample(10)
+	sample.extend(zip(read_fastq_records(fastq_file), read_fastq_records(fastq_file)))
+
+	pairs = fastq_sampler.pairs_from_records(sample.records())
+	assert len(pairs) == 10
+	assert all(seq_R1 == seq_R2 == 'ACGT' for seq_id, seq_R1, seq_R2 in pairs)
+
+
+@pytest.fixture(params=['in.fq', 'in.fq.gz'])
+def sampled_file(tmp_path, request):
+	path = tmp_path / request.param
+	data = b''.join(b'@r%d\nACGT\n+\nIIII\n' % i for i in range(NR_OF_RECORDS))
+	path.write_bytes(gzip.compress(data) if request.param.endswith('.gz') else data)
+	return str(path)
+
+
+def test_sample_is_reproducible_per_seed(sampled_file):
+	samples = [fastq_sampler.random_reads(sampled_file, 20, seed) for seed in (1, 1, 2)]
+
+	assert samples[0] == samples[1]
+	assert samples[0] != samples[2]
+	assert len(set(samples[0])) == 20
+
+
+def test_sample_is_seeked_only_in_plain_files(sampled_file):
+	sample, seeked = fastq_sampler.sample_records(sampled_file, 20, random.Random(1))
+
+	assert seeked == (not sampled_file.endswith('.gz'))
+	positions = [position for record, position in sample]
+	assert positions == sorted(set(positions))
+	assert len(sample) == 20
+
+
+def test_reservoir_sample_is_reproducible_per_seed(fastq_file):
+	samples = []
+	for seed in (1, 1, 2):
+		with closing(read_fastq_records(fastq_file)) as records:
+			samples.append(fastq_sampler.reservoir_sample(records, 20, random.Random(seed)))
+
+	assert samples[0] == samples[1]
+	assert samples[0] != samples[2]
+	assert all(record[0] == b'@r%d\n' % record_nr for record, record_nr in samples[0])
+
+
+def test_pair_sample_is_reproducible_per_seed(fastq_file):
+	samples = [fastq_sampler.random_pairs(fastq_file, fastq_file, 20, seed) for seed in (1, 1, 2)]
+
+	assert samples[0] == samples[1]
+	assert samples[0] != samples[2]
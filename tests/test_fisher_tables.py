@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fisher_tables
+
+stats = pytest.importorskip('scipy.stats')
+
+TRAINING_DATA = [(995, 2), (500, 500), (1000, 5)]
+
+
+@pytest.fixture(autouse=True)
+def no_tables(tmp_path, monkeypatch):
+	monkeypatch.setattr(fisher_tables, 'FISHER_TABLE_DIR', str(tmp_path))
+	monkeypatch.setattr(fisher_tables, 'FISHER_TABLES', {})
+
+
+@pytest.mark.parametrize('training_data', TRAINING_DATA)
+@pytest.mark.parametrize('count, total', [(0, 0), (0, 10), (10, 10), (3, 10), (500, 1000),
+											(997, 1000)])
+def test_p_values_of_fisher_exact(training_data, count, total):
+	expected = stats.fisher_exact([list(training_data), [count, total - count]])[1]
+
+	assert fisher_tables.fisher_p_value(training_data, count, total) == pytest.approx(expected)
+	# Looked up from the row of the total the second time
+	assert fisher_tables.fisher_p_value(training_data, count, total) == pytest.approx(expected)
+
+
+def test_precomputed_table(tmp_path):
+	table = fisher_tables.FisherTable(TRAINING_DATA[0])
+	table.precompute(20)
+	table.p_value(5, 30) # Not saved, beyond max_total
+	table.save(fisher_tables.fisher_table_file(TRAINING_DATA[0]), 20)
+
+	loaded = fisher_tables.fisher_table(TRAINING_DATA[0])
+
+	assert set(loaded.rows) == set(range(21))
+	for total in range(21):
+		assert list(loaded.rows[total]) == list(table.rows[total])
+	assert loaded.p_value(5, 30) == pytest.approx(
+		stats.fisher_exact([list(TRAINING_DATA[0]), [5, 25]])[1])
@@ -0,0 +1,136 @@
+import os
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aligners
+import reference_cache
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='needs executable scripts')
+
+# A stand-in for gfServer, that serves its file name over a socket, like the
+# status, files and stop commands of gfServer that aligners.py uses.
+FAKE_GFSERVER = '''#!/usr/bin/env python3
+import socket
+import sys
+
+command, host, port = sys.argv[1:4]
+if (command == 'start'):
+	with socket.socket() as server:
+		server.bind((host, int(port)))
+		server.listen()
+		while True:
+			connection, address = server.accept()
+			with connection:
+				request = connection.recv(100)
+				connection.sendall(sys.argv[4].encode() if request == b'files' else b'ok')
+			if (request == b'stop'):
+				break
+else:
+	try:
+		with socket.create_connection((host, int(port))) as client:
+			client.sendall(command.encode())
+			print(client.recv(1000).decode())
+	except OSError:
+		sys.exit(1)
+'''
+
+# A stand-in for faToTwoBit, that copies the reference.
+FAKE_FA_TO_TWO_BIT = '''#!/usr/bin/env python3
+import shutil
+import sys
+
+shutil.copy(sys.argv[1], sys.argv[2])
+'''
+
+
+def colliding_names():
+	'''
+	Returns the names of two references whose first port is the same.
+	'''
+
+	names = {}
+	for i in range(10000):
+		name = f'ref{i}.fa'
+		first_port = zlib.crc32(name.encode()) % aligners.GFSERVER_PORT_RANGE
+		if first_port in names:
+			return names[first_port], name
+		names[first_port] = name
+
+
+@pytest.fixture
+def references(tmp_path, monkeypatch):
+	for name, script in (('gfServer', FAKE_GFSERVER), ('faToTwoBit', FAKE_FA_TO_TWO_BIT)):
+		(tmp_path / name).write_text(script)
+		(tmp_path / name).chmod(0o755)
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setattr(aligners, 'GFSERVER_EXECUTABLE', str(tmp_path / 'gfServer'))
+	monkeypatch.setattr(aligners, 'FA_TO_TWO_BIT_EXECUTABLE', str(tmp_path / 'faToTwoBit'))
+	monkeypatch.setattr(aligners, 'GFSERVER_STATE_DIR', str(tmp_path / 'gfservers'))
+	monkeypatch.setattr(aligners, 'GFSERVER_PORT', 20000 + os.getpid() % 20000)
+	monkeypatch.setattr(reference_cache, 'REFERENCE_HASHES', {})
+
+	names = colliding_names()
+	(tmp_path / 'reference_sequences').mkdir()
+	for name in names:
+		(tmp_path / 'reference_sequences' / name).write_text(f'>{name}\nACGT\n')
+	gfservers = []
+	yield names, gfservers
+
+	for gfserver in gfservers:
+		gfserver.stop()
+
+
+def started(gfservers, ref):
+	gfserver = aligners.GfServer(ref)
+	gfservers.append(gfserver)
+	gfserver.start()
+	return gfserver
+
+
+def test_references_with_the_same_first_port(references):
+	names, gfservers = references
+
+	first, second = (started(gfservers, name) for name in names)
+
+	assert first.port != second.port
+	assert first.process is not None and second.process is not None
+	assert first.serves_reference() and second.serves_reference()
+
+
+def test_running_server_is_reused(references):
+	names, gfservers = references
+	first = started(gfservers, names[0])
+
+	again = started(gfservers, names[0])
+
+	assert again.port == first.port
+	assert again.process is None
+
+
+def test_server_of_a_changed_reference_is_restarted(references):
+	names, gfservers = references
+	first = started(gfservers, names[0])
+	with open(os.path.join('reference_sequences', names[0]), 'a') as f_out:
+		f_out.write('>new\nTTTT\n')
+
+	again = started(gfservers, names[0])
+
+	assert again.process is not None
+	assert first.process.wait(timeout=10) == 0
+	sha256 = reference_cache.reference_hash(os.path.join('reference_sequences', names[0]))
+	assert aligners.read_gfserver_state(again.port)['sha256'] == sha256
+
+
+def test_stopped_server_forgets_its_state(references):
+	names, gfservers = references
+	first = started(gfservers, names[0])
+	port = first.port
+
+	first.stop()
+
+	assert aligners.read_gfserver_state(port) is None
+	assert not aligners.GfServer(names[0]).find()
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import guesslib_genomic_pair
+import guesslib_pair
+import guesslib_single
+
+
+def forward_reads(ref, reads, aligner, jobs):
+	'''
+	Aligns every read forward against the same transcript, in place of
+	guesslib_single.blat_in_batches.
+	'''
+
+	for seq_id, seq in reads:
+		yield seq_id, 1, 100, 1, 'transcript'
+
+
+def inward_pairs(ref, pairs, aligner, jobs):
+	'''
+	Aligns every pair as an inward pair against the same transcript, in place
+	of blat_pairs_in_batches.
+	'''
+
+	for seq_id, seq_R1, seq_R2 in pairs:
+		yield seq_id, (1, 100, 1, 'transcript'), (300, 200, 1, 'transcript')
+
+
+@pytest.mark.parametrize('decision_mode', ['fisher', 'sprt', 'bayes'])
+def test_single_reads_run_out_before_a_decision(monkeypatch, decision_mode):
+	monkeypatch.setattr(guesslib_single, 'blat_in_batches', forward_reads)
+	reads = [(f'r{i}', 'ACGT') for i in range(3)]
+
+	result = guesslib_single.guesslib_single('ref.fa', None, decision_mode=decision_mode,
+											reads=reads)
+
+	assert result[3] == 3
+	assert not result[4]
+
+
+@pytest.mark.parametrize('decision_mode', ['fisher', 'sprt', 'bayes'])
+def test_single_reads_decided(monkeypatch, decision_mode):
+	monkeypatch.setattr(guesslib_single, 'blat_in_batches', forward_reads)
+	reads = [(f'r{i}', 'ACGT') for i in range(100)]
+
+	result = guesslib_single.guesslib_single('ref.fa', None, decision_mode=decision_mode,
+											reads=reads)
+
+	assert result[0] == 'SF'
+	assert result[4]
+
+
+@pytest.mark.parametrize('guesslib', [guesslib_pair, guesslib_genomic_pair])
+@pytest.mark.parametrize('decision_mode', ['fisher', 'sprt', 'bayes'])
+def test_pairs_run_out_before_a_decision(monkeypatch, guesslib, decision_mode):
+	monkeypatch.setattr(guesslib, 'blat_pairs_in_batches', inward_pairs)
+	pairs = [('r0', 'ACGT', 'ACGT')] # Not enough for any test to decide
+	function = getattr(guesslib, guesslib.__name__)
+
+	result = function('ref.fa', None, None, decision_mode=decision_mode, pairs=pairs)
+
+	assert not result[-2]
@@ -0,0 +1,76 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kmer_index
+import reference_cache
+
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+
+def reverse_complement(seq):
+	return seq.translate(COMPLEMENT)[::-1]
+
+
+@pytest.fixture
+def transcripts(tmp_path, monkeypatch):
+	monkeypatch.setattr(reference_cache, 'REFERENCE_HASHES', {})
+	rng = random.Random(1)
+	transcripts = {f't{i}': ''.join(rng.choice('ACGT') for _ in range(500)) for i in range(3)}
+	fasta_file = tmp_path / 'ref.fa'
+	fasta_file.write_text(''.join(f'>{name} transcript {name}\n{seq[:250]}\n{seq[250:]}\n'
+									for name, seq in transcripts.items()))
+	return str(fasta_file), transcripts
+
+
+def test_forward_and_reverse_reads(transcripts):
+	fasta_file, seqs = transcripts
+	index = kmer_index.build_kmer_index(fasta_file)
+	read = seqs['t1'][100:200]
+
+	forward, reverse = index.align_batch([read, reverse_complement(read)])
+
+	assert forward == (101, 200, 1, 't1')
+	assert reverse == (200, 101, 1, 't1')
+
+
+def test_reads_without_hits(transcripts):
+	fasta_file, seqs = transcripts
+	index = kmer_index.build_kmer_index(fasta_file)
+
+	assert index.align_batch(['ACGT', 'N' * 100, '']) == [(0, 0, 0, 'N/A')] * 3
+	assert index.align_batch([]) == []
+
+
+def test_reads_of_several_transcripts(transcripts):
+	fasta_file, seqs = transcripts
+	index = kmer_index.build_kmer_index(fasta_file)
+	chimera = seqs['t0'][:100] + seqs['t2'][:60]
+
+	seq_start, seq_end, nr_of_results, transcript = index.align_batch([chimera])[0]
+
+	assert (seq_start, seq_end, transcript) == (1, len(chimera), 't0') # The most hits
+	assert nr_of_results == 2
+
+
+def test_cached_index_calls_the_same_strands(transcripts):
+	fasta_file, seqs = transcripts
+	rng = random.Random(2)
+	reads = []
+	for _ in range(50):
+		name = rng.choice(sorted(seqs))
+		start = rng.randrange(400)
+		read = seqs[name][start:start + 100]
+		reads.append(read if rng.random() < 0.5 else reverse_complement(read))
+
+	built = kmer_index.build_kmer_index(fasta_file).align_batch(reads)
+	kmer_index.load_kmer_index(fasta_file) # Saves the index
+	loaded = kmer_index.load_kmer_index(fasta_file).align_batch(reads)
+
+	assert loaded == built
+	assert all((result[0] < result[1]) == (read in seqs[result[3]])
+				for read, result in zip(reads, built))
@@ -0,0 +1,114 @@
+import gzip
+import io
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fastq_sampler
+from fastq_io import MateReader, record_id, record_sequence
+
+IDS = [f'r{i}' for i in range(2000)]
+
+
+def fastq(ids):
+	return b''.join(b'@%s\n%s\n+\nIIII\n' % (seq_id.encode(), b'ACGT') for seq_id in ids)
+
+
+def write_fastq(path, ids):
+	'''
+	Writes the records with the ids to a plain or gzip (.gz) fastq file,
+	returns the file name.
+	'''
+
+	data = fastq(ids)
+	path.write_bytes(gzip.compress(data) if path.name.endswith('.gz') else data)
+	return str(path)
+
+
+def shuffled(ids, seed=1):
+	ids = list(ids)
+	random.Random(seed).shuffle(ids)
+	return ids
+
+
+@pytest.fixture
+def stdin(monkeypatch):
+	def feed(data):
+		monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(data)))
+	return feed
+
+
+def test_stdin_mates_in_order(stdin):
+	stdin(fastq(['r0', 'r1', 'r2', 'r3']))
+	mates = MateReader('-')
+
+	try:
+		assert [record_sequence(mates.find_record(seq_id, record_nr))
+				for seq_id, record_nr in (('r1', 1), ('r3', 3))] == ['ACGT', 'ACGT']
+		assert mates.find_record('r4', 4) is None # R2 ended before R1
+	finally:
+		mates.close()
+
+
+def test_stdin_mates_out_of_order(stdin):
+	stdin(fastq(['r0', 'r2', 'r1', 'r3']))
+	mates = MateReader('-')
+
+	try:
+		with pytest.raises(ValueError, match='R2 on stdin must be in the order of R1'):
+			mates.find_record('r1', 1)
+	finally:
+		mates.close()
+
+
+@pytest.mark.parametrize('name', ['R2.fq', 'R2.fq.gz'])
+@pytest.mark.parametrize('order', ['in order', 'out of order'])
+def test_mate_reader(tmp_path, name, order):
+	ids_R2 = [seq_id for seq_id in IDS if seq_id != 'r3'] # r3 has no mate
+	if (order == 'out of order'):
+		ids_R2 = shuffled(ids_R2)
+	mates = MateReader(write_fastq(tmp_path / name, ids_R2))
+
+	try:
+		found = {seq_id: mates.find_record(seq_id, record_nr)
+					for record_nr, seq_id in enumerate(IDS) if record_nr % 3 == 0}
+	finally:
+		mates.close()
+
+	assert found.pop('r3') is None
+	assert [record_id(record) for record in found.values()] == list(found)
+
+
+@pytest.mark.parametrize('order', ['in order', 'out of order'])
+def test_mate_seeker(tmp_path, order):
+	fastq_file_1 = write_fastq(tmp_path / 'R1.fq', IDS)
+	ids_R2 = IDS[1:] # r0 has no mate
+	if (order == 'out of order'):
+		ids_R2 = shuffled(ids_R2)
+	mates = fastq_sampler.MateSeeker(write_fastq(tmp_path / 'R2.fq', ids_R2),
+									os.path.getsize(fastq_file_1))
+	record_size = len(fastq(['r0']))
+
+	try:
+		found = {IDS[i]: mates.find_record(IDS[i], i * record_size)
+					for i in range(0, len(IDS), 7)}
+	finally:
+		mates.close()
+
+	assert found.pop('r0') is None
+	assert [record_id(record) for record in found.values()] == list(found)
+
+
+@pytest.mark.parametrize('name', ['R2.fq', 'R2.fq.gz'])
+def test_sampled_pairs_are_mates(tmp_path, name):
+	fastq_file_1 = write_fastq(tmp_path / 'R1.fq', IDS)
+	fastq_file_2 = write_fastq(tmp_path / name, shuffled(IDS))
+
+	pairs = fastq_sampler.sample_pairs(fastq_file_1, fastq_file_2, 50, random.Random(1))
+
+	assert len(pairs) == 50
+	assert all(record_id(record_R1) == record_id(record_R2) for record_R1, record_R2 in pairs)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reference_cache
+
+FASTA = b'>t1\nACGTACGTACGT\n>t2\nTTTTGGGGCCCC\n'
+
+
+@pytest.fixture
+def fasta_file(tmp_path):
+	path = tmp_path / 'ref.fa'
+	path.write_bytes(FASTA)
+	return str(path)
+
+
+@pytest.fixture
+def uncachable_fasta_file(fasta_file):
+	# A file in place of the cache directory, as no directory can be made in
+	# it, like in a read-only directory (which root could still write to)
+	with open(fasta_file + reference_cache.CACHE_SUFFIX, 'w'):
+		pass
+	return fasta_file
+
+
+def build_copy(fasta_file, directory):
+	'''
+	A form of the reference that is just a copy of it, counting its builds.
+	'''
+
+	build_copy.builds += 1
+	with open(fasta_file, 'rb') as f_in, open(os.path.join(directory, 'copy.fa'), 'wb') as f_out:
+		f_out.write(f_in.read())
+
+
+@pytest.fixture(autouse=True)
+def new_process(monkeypatch):
+	monkeypatch.setattr(reference_cache, 'REFERENCE_HASHES', {})
+	monkeypatch.setattr(reference_cache, 'PROCESS_FORMS', {})
+	build_copy.builds = 0
+	yield
+	reference_cache.remove_process_forms()
+
+
+def test_reference_hash_is_cached(fasta_file):
+	assert reference_cache.reference_hash(fasta_file) == hashlib.sha256(FASTA).hexdigest()
+	assert os.path.isdir(reference_cache.cache_path(fasta_file, 'sha256'))
+
+
+def test_reference_hash_of_an_uncachable_reference(uncachable_fasta_file):
+	assert (reference_cache.reference_hash(uncachable_fasta_file)
+			== hashlib.sha256(FASTA).hexdigest())
+
+
+def test_form_is_cached_once(fasta_file):
+	directory = reference_cache.reference_form(fasta_file, 'copy', build_copy)
+
+	assert directory == reference_cache.cache_path(fasta_file, 'copy')
+	assert reference_cache.reference_form(fasta_file, 'copy', build_copy) == directory
+	assert build_copy.builds == 1
+
+
+def test_form_of_a_changed_reference_is_rebuilt(fasta_file):
+	directory = reference_cache.reference_form(fasta_file, 'copy', build_copy)
+	with open(fasta_file, 'ab') as f_out:
+		f_out.write(b'>t3\nAAAA\n')
+
+	directory = reference_cache.reference_form(fasta_file, 'copy', build_copy)
+
+	assert build_copy.builds == 2
+	with open(os.path.join(directory, 'copy.fa'), 'rb') as f_in:
+		assert f_in.read().endswith(b'>t3\nAAAA\n')
+
+
+def test_form_of_an_uncachable_reference(uncachable_fasta_file):
+	directory = reference_cache.reference_form(uncachable_fasta_file, 'copy', build_copy)
+
+	assert reference_cache.cached_reference(uncachable_fasta_file, 'copy', build_copy) is None
+	assert reference_cache.reference_form(uncachable_fasta_file, 'copy', build_copy) == directory
+	assert build_copy.builds == 1
+	with open(os.path.join(directory, 'copy.fa'), 'rb') as f_in:
+		assert f_in.read() == FASTA
+
+	reference_cache.remove_process_forms()
+	assert not os.path.exists(directory)